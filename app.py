@@ -4,21 +4,32 @@ from os import environ
 from os import path
 import logging.config
 from threading import Lock
+import time
 import eventlet
 from flask import render_template, Response, request, session
 from flask_api import status
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room
 from flask_swagger import swagger
+from redis.exceptions import ConnectionError as RedisConnectionError
 from swagger_ui import api_doc
 from setup_app import setup_app
 from util.database import db
 from util.error import NO_METER_ID, exception_message
-from util.websocket_provider import WebsocketProvider
+from util.redis_helpers import METER_UPDATES_CHANNEL
+from util.websocket_provider import WebsocketProvider, get_meter_ids_of_group, create_delta
 from models.user import User
 
 
 eventlet.monkey_patch()
 logger = logging.getLogger(__name__)
+# Seconds to wait after a meter update notification to collect the
+# notifications of the other meters fetched in the same run
+live_data_debounce = 1
+# Seconds after which the data of all groups with connected clients is
+# recreated in case a notification got lost
+live_data_refresh = 300
+# Seconds to wait before subscribing again after losing the redis connection
+live_data_reconnect = 5
 
 
 class RunConfig():
@@ -46,6 +57,8 @@ thread_lock = Lock()
 socketio = SocketIO(app, async_mode='eventlet', cors_allowed_origins='*')
 wp = WebsocketProvider()
 clients = {}
+group_data = {}
+group_sequences = {}
 swag = swagger(app, from_file_keyword='swagger_from_file')
 swag['info']['version'] = "1.0"
 swag['info']['title'] = "myBuzzn App API"
@@ -66,22 +79,103 @@ def live():
     return Response(render_template('live.html'))
 
 
+def group_room(group_id, delta=False):
+    """ Return the name of the socket room of the given group. Clients using
+    the delta protocol share a separate room. """
+    if delta:
+        return 'group_{}_delta'.format(group_id)
+    return 'group_{}'.format(group_id)
+
+
+def get_group_snapshot(group_id):
+    """ Return the live data of the given group the clients have last been
+    sent together with its sequence number, and create it if there is none.
+    """
+    if group_id not in group_data:
+        group_data[group_id] = wp.create_group_data(group_id)
+        group_sequences[group_id] = 0
+    return dict(type='snapshot', seq=group_sequences.get(group_id),
+                data=group_data.get(group_id))
+
+
+def emit_group_data(group_id):
+    """ Create the live data of the given group and emit it to the group's
+    rooms if it changed since it was emitted last. Clients using the delta
+    protocol only receive the changes together with a sequence number. """
+    data = wp.create_group_data(group_id)
+    if not data:
+        return
+    previous = group_data.get(group_id)
+    if previous is None:
+        group_sequences[group_id] = 0
+        group_data[group_id] = data
+        socketio.emit('live_data', get_group_snapshot(group_id),
+                      namespace='/live', room=group_room(group_id, delta=True))
+    else:
+        delta = create_delta(previous, data)
+        if delta.keys() == {'date'}:
+            return
+        group_sequences[group_id] += 1
+        group_data[group_id] = data
+        socketio.emit('live_data', dict(type='delta', seq=group_sequences.get(group_id),
+                                        data=delta),
+                      namespace='/live', room=group_room(group_id, delta=True))
+    socketio.emit('live_data', {'data': data},
+                  namespace='/live', room=group_room(group_id))
+
+
+def read_updated_meter_ids(pubsub, timeout):
+    """ Wait for meter update notifications and return the ids of all meters
+    updated in the meantime.
+    :param pubsub: the pubsub object subscribed to the meter updates
+    :param float timeout: the maximum number of seconds to wait
+    :returns: the updated meter ids
+    :rtype: set
+    """
+    meter_ids = set()
+    message = pubsub.get_message(timeout=timeout)
+    if message is not None:
+        socketio.sleep(live_data_debounce)
+    while message is not None:
+        meter_ids.add(message.get('data').decode('utf-8'))
+        message = pubsub.get_message()
+    return meter_ids
+
+
 def background_thread():
-    """ Emit server-generated live data to the clients every 60s. """
+    """ Emit server-generated live data to the clients whenever the worker
+    publishes new readings. Only the groups with connected clients which
+    contain an updated meter are recreated, and their data is only emitted if
+    it changed. """
+    pubsub = None
+    next_refresh = time.monotonic()
     while True:
+        try:
+            if pubsub is None:
+                pubsub = wp.redis_client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(METER_UPDATES_CHANNEL)
+            meter_ids = read_updated_meter_ids(pubsub,
+                                               max(next_refresh - time.monotonic(), 0))
+        except RedisConnectionError as e:
+            message = exception_message(e)
+            logger.error(message)
+            pubsub = None
+            socketio.sleep(live_data_reconnect)
+            continue
+
+        # Recreate all groups now and then in case a notification got lost
+        refresh = time.monotonic() >= next_refresh
+        if refresh:
+            next_refresh = time.monotonic() + live_data_refresh
         with app.app_context():
-            for key in dict(clients):
+            for group_id in {client.get('group_id') for client in dict(clients).values()}:
                 try:
-                    user = db.session.query(User).filter_by(
-                        meter_id=clients[key].get('meter_id')).first()
-                    message = json.dumps(wp.create_data(user.id))
-                    socketio.emit('live_data', {'data': message},
-                                  namespace='/live', room=key)
+                    if refresh or not get_meter_ids_of_group(group_id).isdisjoint(meter_ids):
+                        emit_group_data(group_id)
                 except Exception as e:
                     message = exception_message(e)
                     logger.error(message)
-                    del clients[key]
-            socketio.sleep(20)
+
 
 @socketio.on('connect', namespace='/live')
 def connect():
@@ -95,14 +189,43 @@ def connect():
     meter_id = request.args.get('meter_id', default=None, type=str)
     if meter_id is None:
         meter_id = session['meter_id']
-    clients[request.sid] = {'meter_id': meter_id}
+    delta = request.args.get('protocol', default='full', type=str) == 'delta'
+    user = db.session.query(User).filter_by(meter_id=meter_id).first()
+    if user is None:
+        logger.error('No user with meter id %s.', meter_id)
+    else:
+        join_room(group_room(user.group_id, delta))
+        clients[request.sid] = {'meter_id': meter_id, 'group_id': user.group_id,
+                                'delta': delta}
     emit('live_data', {'data': 'Connected with sid ' +
                                request.sid}, room=request.sid)
+    if user is not None:
+        # Send the group's current data right away instead of waiting for the
+        # next update
+        snapshot = get_group_snapshot(user.group_id)
+        if delta:
+            emit('live_data', snapshot, room=request.sid)
+        else:
+            emit('live_data', {'data': snapshot.get('data')}, room=request.sid)
+
+
+@socketio.on('resync', namespace='/live')
+def resync():
+    """ Send the current snapshot to a client using the delta protocol which
+    missed a sequence number. """
+    client = clients.get(request.sid)
+    if client is not None:
+        emit('live_data', get_group_snapshot(client.get('group_id')), room=request.sid)
 
 
 @socketio.on('disconnect', namespace='/live')
 def disconnect():
-    del clients[request.sid]
+    client = clients.pop(request.sid, None)
+    if client is not None and client.get('group_id') not in {
+            other.get('group_id') for other in dict(clients).values()}:
+        # Nobody receives the group's data anymore, so it may become stale
+        group_data.pop(client.get('group_id'), None)
+        group_sequences.pop(client.get('group_id'), None)
 
 
 def run_server():
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+import timeit
+from dateutil import parser
+from util.redis_helpers import parse_key_date
+
+
+meter_id = 'b4234cd4bed143a6b9bd09e347e17d34'
+number_of_keys = 2 * 24 * 60  # two days of minute readings
+repetitions = 5
+
+
+def create_keys():
+    """ Create reading keys in the layout written by the task. """
+
+    start = datetime(2020, 1, 15)
+    return [meter_id + '_' + (start + timedelta(minutes=i)).strftime('%Y-%m-%d %H:%M:%S')
+            for i in range(number_of_keys)]
+
+
+def parse_keys_dateutil(keys):
+    """ Parse the keys with the generic dateutil parser. """
+
+    return [parser.parse(key[len(meter_id) + 1:]) for key in keys]
+
+
+def parse_keys_fast(keys):
+    """ Parse the keys with the fixed-format fast path. """
+
+    return [parse_key_date(meter_id, key) for key in keys]
+
+
+def run():
+    """ Compare the time needed to parse the dates of two days of minute
+    readings. Run it from the project root like this:
+    'python -m benchmarks.benchmark_parse_key_date'.
+    """
+
+    keys = create_keys()
+    assert parse_keys_dateutil(keys) == parse_keys_fast(keys)
+
+    dateutil_time = min(timeit.repeat(lambda: parse_keys_dateutil(keys),
+                                      number=1, repeat=repetitions))
+    fast_time = min(timeit.repeat(lambda: parse_keys_fast(keys),
+                                  number=1, repeat=repetitions))
+    print('Parsing {} keys'.format(number_of_keys))
+    print('dateutil.parser.parse: {:.2f} ms'.format(dateutil_time * 1000))
+    print('parse_key_date:        {:.2f} ms'.format(fast_time * 1000))
+    print('speedup:               {:.1f}x'.format(dateutil_time / fast_time))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+import timeit
+from sqlalchemy import create_engine, extract
+from sqlalchemy.orm import sessionmaker
+from models.group import Group
+from models.per_capita_consumption import PerCapitaConsumption
+from models.user import User
+from util.database import db
+
+
+number_of_meters = 100
+number_of_days = 3 * 365  # three years of daily entries per meter
+repetitions = 5
+index_name = 'ix_per_capita_consumption_meter_id_date'
+
+
+def create_session():
+    """ Create an in-memory database with a synthetic per capita consumption
+    history of all meters. """
+
+    engine = create_engine('sqlite://')
+    db.Model.metadata.create_all(engine, tables=[Group.__table__, User.__table__,
+                                                 PerCapitaConsumption.__table__])
+    session = sessionmaker(bind=engine)()
+    start = datetime(2017, 1, 1)
+    session.bulk_insert_mappings(PerCapitaConsumption, [
+        dict(date=start + timedelta(days=day), meter_id='{:032x}'.format(meter),
+             consumption=5.0, consumption_cumulated=5.0 * day, inhabitants=2,
+             per_capita_consumption=2.5, per_capita_consumption_cumulated=2.5 * day,
+             days=day, moving_average=2.5, moving_average_annualized=913)
+        for meter in range(number_of_meters) for day in range(number_of_days)])
+    session.commit()
+    return session
+
+
+def query_extract(session, day):
+    """ Query the entries of one day per meter by comparing the date parts. """
+
+    return [session.query(PerCapitaConsumption).filter_by(meter_id='{:032x}'.format(meter)).
+            filter(extract('year', PerCapitaConsumption.date) == day.year,
+                   extract('month', PerCapitaConsumption.date) == day.month,
+                   extract('day', PerCapitaConsumption.date) == day.day).first()
+            for meter in range(number_of_meters)]
+
+
+def query_range(session, day):
+    """ Query the entries of one day per meter with a half-open date range. """
+
+    return [session.query(PerCapitaConsumption).filter_by(meter_id='{:032x}'.format(meter)).
+            filter(PerCapitaConsumption.date >= day,
+                   PerCapitaConsumption.date < day + timedelta(days=1)).first()
+            for meter in range(number_of_meters)]
+
+
+def query_latest(session):
+    """ Query the latest entry per meter. """
+
+    return [session.query(PerCapitaConsumption.date,
+                          PerCapitaConsumption.moving_average_annualized).
+            filter_by(meter_id='{:032x}'.format(meter)).
+            order_by(PerCapitaConsumption.date.desc()).first()
+            for meter in range(number_of_meters)]
+
+
+def measure(function):
+    """ Return the best time of running the given function in seconds. """
+
+    return min(timeit.repeat(function, number=1, repeat=repetitions))
+
+
+def run():
+    """ Compare the time needed to look up the day before and the latest
+    entry of all meters with and without the index on meter id and date. Run
+    it from the project root like this:
+    'python -m benchmarks.benchmark_per_capita_consumption_queries'.
+    """
+
+    session = create_session()
+    day = datetime(2019, 6, 1)
+    assert query_extract(session, day) == query_range(session, day)
+
+    print('Querying {} meters with {} days of history'.format(number_of_meters,
+                                                               number_of_days))
+    for indexed in (False, True):
+        session.execute('DROP INDEX IF EXISTS ' + index_name)
+        if indexed:
+            session.execute('CREATE INDEX {} ON per_capita_consumption (meter_id, date DESC)'.
+                            format(index_name))
+        print('with index:' if indexed else 'without index:')
+        print('  extract day before: {:.2f} ms'.format(
+            measure(lambda: query_extract(session, day)) * 1000))
+        print('  range day before:   {:.2f} ms'.format(
+            measure(lambda: query_range(session, day)) * 1000))
+        print('  latest entry:       {:.2f} ms'.format(
+            measure(lambda: query_latest(session)) * 1000))
+
+
+if __name__ == '__main__':
+    run()
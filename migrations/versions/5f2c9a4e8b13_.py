@@ -0,0 +1,26 @@
+""" Add index on meter id and date to per_capita_consumption table.
+
+Revision ID: 5f2c9a4e8b13
+Revises: 3d858c480257
+Create Date: 2026-10-18 10:12:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f2c9a4e8b13'
+down_revision = '3d858c480257'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_per_capita_consumption_meter_id_date', 'per_capita_consumption',
+                    ['meter_id', sa.text('date DESC')])
+
+
+def downgrade():
+    op.drop_index('ix_per_capita_consumption_meter_id_date',
+                  table_name='per_capita_consumption')
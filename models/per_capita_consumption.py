@@ -47,3 +47,8 @@ class PerCapitaConsumption(db.Model):
         self.days = days
         self.moving_average = moving_average
         self.moving_average_annualized = moving_average_annualized
+
+
+# Serves the day before lookups and the latest entry of a meter
+db.Index('ix_per_capita_consumption_meter_id_date', PerCapitaConsumption.meter_id,
+         PerCapitaConsumption.date.desc())
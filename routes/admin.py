@@ -5,6 +5,7 @@ from flask_jwt_extended import (create_access_token, get_raw_jwt, get_jwt_identi
                                 set_access_cookies, verify_jwt_in_request, unset_jwt_cookies)
 from models.user import User, GenderType, StateType, RoleType
 from models.group import Group
+from util.cache import invalidate_user, invalidate_group
 from util.database import db
 
 
@@ -114,6 +115,7 @@ def do_user_create():
     target.nick = request.form['nick']
     db.session.add(target)
     db.session.commit()
+    invalidate_group(target.group_id)
     return user_list("Created user " + target.name)
 
 
@@ -156,6 +158,7 @@ def do_user_update():
         return user_list("Unknown user.")
 
     targetUser = targetUsers[0]
+    invalidate_group(targetUser.group_id)
 
     targetUser.first_name = request.form['first_name']
     targetUser.name = request.form['name']
@@ -168,6 +171,8 @@ def do_user_update():
     targetUser.group_id = request.form['group_id']
 
     db.session.commit()
+    invalidate_user(targetUser.id)
+    invalidate_group(targetUser.group_id)
     return user_list("Updated user " + targetUser.name)
 
 
@@ -212,6 +217,8 @@ def user_delete():
     if target_user is None:
         return user_list("Unknown user.")
 
+    invalidate_user(target_user.id)
+    invalidate_group(target_user.group_id)
     db.session.delete(target_user)
     db.session.commit()
 
@@ -279,6 +286,7 @@ def do_group_update():
         'group_production_meter_id_second']
 
     db.session.commit()
+    invalidate_group(target_group.id)
     return group_list("Updated group " + target_group.name)
 
 
@@ -316,6 +324,7 @@ def group_delete():
     if target_group is None:
         return group_list("Unknown group.")
 
+    invalidate_group(target_group.id)
     db.session.delete(target_group)
     db.session.commit()
 
@@ -3,17 +3,17 @@ import os
 from datetime import datetime, timedelta
 import logging.config
 import redis
-from flask import Blueprint, jsonify
+from flask import Blueprint, Response, jsonify
 from flask_api import status
 from flask_jwt_extended import get_jwt_identity
-from models.group import Group
-from models.user import User
 from routes.disaggregation import read_begin_parameter
-from util.database import db
+from util.cache import get_user_parameters, get_group_parameters
+from util.date_helpers import calc_quarter_hour_index
 from util.error import UNKNOWN_USER, UNKNOWN_GROUP
 from util.login import login_required
-from util.redis_helpers import get_sorted_keys, get_sorted_keys_date_prefix, get_entry_date
-from util.websocket_provider import get_group_members
+from util.redis_helpers import get_reading_keys, get_entry_dates, calc_day_bounds,\
+    average_power_key, get_packed_readings, PACKED_READINGS, group_consumption_history_key,\
+    GROUP_CONSUMPTION_HISTORY_TTL, first_day_reading_key, last_day_reading_key, get_namespaced
 
 
 logger = logging.getLogger(__name__)
@@ -36,19 +36,20 @@ def get_readings(meter_id, begin):
     :rtype: dict
     """
 
-    result = {}
-    for key in get_sorted_keys(redis_client, meter_id):
-
-        reading_date, data = get_entry_date(redis_client, meter_id, key, 'reading')
-
-        if reading_date is None or data is None:
-            continue
+    if PACKED_READINGS:
+        begin_date = datetime.utcfromtimestamp(begin).date()
+        dates = [(begin_date + timedelta(days=i)).strftime('%Y-%m-%d') for i in
+                 range((datetime.utcnow().date() - begin_date).days + 1)]
+        begin_timestamp = datetime.utcfromtimestamp(begin).strftime('%Y-%m-%d %H:%M:%S')
+        return {timestamp: values for timestamp, values in
+                get_packed_readings(redis_client, meter_id, dates).items()
+                if timestamp >= begin_timestamp}
 
-        # Parse timestamp as int to use consistent timestamps
-        reading_timestamp = int(reading_date.timestamp())
-
-        if reading_timestamp >= begin:
-            result[reading_date.strftime('%Y-%m-%d %H:%M:%S')] = data.get('values')
+    result = {}
+    for reading_date, data in get_entry_dates(redis_client, meter_id,
+                                              get_reading_keys(redis_client, meter_id, begin),
+                                              'reading'):
+        result[reading_date.strftime('%Y-%m-%d %H:%M:%S')] = data.get('values')
 
     return result
 
@@ -66,20 +67,15 @@ def get_default_readings(meter_id):
     yesterday = datetime.strftime(datetime.utcnow() - timedelta(hours=24),
                                   '%Y-%m-%d')
 
-    # Get today's date
-    today = datetime.strftime(datetime.utcnow(), '%Y-%m-%d')
+    if PACKED_READINGS:
+        today = datetime.strftime(datetime.utcnow(), '%Y-%m-%d')
+        return get_packed_readings(redis_client, meter_id, [yesterday, today])
 
     # Get data from yesterday until now
-    redis_keys = get_sorted_keys_date_prefix(redis_client, meter_id, yesterday) +\
-        get_sorted_keys_date_prefix(redis_client, meter_id, today)
-
-    for key in redis_keys:
-
-        reading_date, data = get_entry_date(redis_client, meter_id, key, 'reading')
-
-        if reading_date is None or data is None:
-            continue
+    redis_keys = get_reading_keys(redis_client, meter_id,
+                                  calc_day_bounds(yesterday)[0])
 
+    for reading_date, data in get_entry_dates(redis_client, meter_id, redis_keys, 'reading'):
         result[reading_date.strftime('%Y-%m-%d %H:%M:%S')] = data.get('values')
 
     return result
@@ -95,8 +91,7 @@ def get_first_and_last_energy_for_date(meter_id, date):
     result = {}
 
     try:
-        key_first = f"{meter_id}_{date}_first"
-        data = json.loads(redis_client.get(key_first))
+        data = json.loads(get_namespaced(redis_client, first_day_reading_key(meter_id, date)))
 
         if data is not None:
             result[data.get("time")] = data.get('values').get('energy')
@@ -107,8 +102,7 @@ def get_first_and_last_energy_for_date(meter_id, date):
         logger.error(message)
 
     try:
-        key_last = f"{meter_id}_{date}_last"
-        data = json.loads(redis_client.get(key_last))
+        data = json.loads(get_namespaced(redis_client, last_day_reading_key(meter_id, date)))
 
         if data is not None:
             result[data.get("time")] = data.get('values').get('energy')
@@ -131,9 +125,9 @@ def get_average_power_for_meter_id_and_date(meter_id, date):
     average_power = {}
 
     try:
-        key_average_power = f"average_power_{meter_id}_{date}"
-        data = json.loads(redis_client.get(key_average_power))
-        average_power = data
+        data = redis_client.hgetall(average_power_key(meter_id, date))
+        average_power = {timestamp.decode('utf-8'): float(value)
+                         for timestamp, value in sorted(data.items())}
 
     except Exception as e:
         message = f"No average power available for {meter_id} " \
@@ -162,6 +156,83 @@ def create_member_data(member):
     return dict(power=member_powers, energy=member_consumptions)
 
 
+def get_cached_response(key):
+    """ Return a cached JSON response from the redis database.
+    :param str key: the key of the cached response
+    :return: the JSON encoded response or None if it is not cached
+    :rtype: bytes or type(None)
+    """
+
+    try:
+        return redis_client.get(key)
+
+    except redis.exceptions.RedisError as e:
+        message = 'Cannot read cached response {}: {}'.format(key, e)
+        logger.error(message)
+        return None
+
+
+def cache_response(key, response):
+    """ Cache a JSON response in the redis database.
+    :param str key: the key to cache the response under
+    :param str response: the JSON encoded response
+    """
+
+    try:
+        redis_client.set(key, response, ex=GROUP_CONSUMPTION_HISTORY_TTL)
+
+    except redis.exceptions.RedisError as e:
+        message = 'Cannot cache response {}: {}'.format(key, e)
+        logger.error(message)
+
+
+def create_group_consumption_history(group, date):
+    """ Create the consumption history of the given group on the given day.
+    :param dict group: the group's parameters
+    :param str date: the date in the format '%Y-%m-%d'
+    :return: the JSON encoded power and energy values of the group's meters
+    and the history of each group member
+    :rtype: str
+    """
+
+    group_users = {}
+
+    # Group community consumption meter
+    # Get today's average consumed power per 15 minutes
+    consumed_power = get_average_power_for_meter_id_and_date(group.get('group_meter_id'), date)
+    # Get first and last group energy consumption of today
+    consumed_energy = get_first_and_last_energy_for_date(group.get('group_meter_id'), date)
+
+    # First group production meter
+    # Get today's average production power for first production meter per 15 minutes
+    produced_first_meter_power = get_average_power_for_meter_id_and_date(
+        group.get('group_production_meter_id_first'), date)
+    # Get first and last group energy production of first production meter of today
+    produced_first_meter_energy = get_first_and_last_energy_for_date(
+        group.get('group_production_meter_id_first'), date)
+
+    # Second group production meter
+    # Get today's average production power for second production meter per 15 minutes
+    produced_second_meter_power = get_average_power_for_meter_id_and_date(
+        group.get('group_production_meter_id_second'), date)
+    # Get first and last group energy production of first production meter of today
+    produced_second_meter_energy = get_first_and_last_energy_for_date(
+        group.get('group_production_meter_id_second'), date)
+
+    # Group members
+    for member in group.get('members'):
+        member_data = create_member_data(member)
+        group_users[member.get('id')] = member_data
+
+    return json.dumps(dict(consumed_power=consumed_power,
+                           produced_first_meter_power=produced_first_meter_power,
+                           produced_second_meter_power=produced_second_meter_power,
+                           consumed_energy=consumed_energy,
+                           produced_first_meter_energy=produced_first_meter_energy,
+                           produced_second_meter_energy=produced_second_meter_energy,
+                           group_users=group_users), sort_keys=True)
+
+
 @IndividualConsumptionHistory.route('/individual-consumption-history',
                                     methods=['GET'])
 @login_required
@@ -175,8 +246,7 @@ def individual_consumption_history():
     swagger_from_file: swagger_files/get_individual-consumption-history.yml
     """
 
-    user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = get_user_parameters(get_jwt_identity())
 
     if user is None:
         return UNKNOWN_USER.make_json_response(status.HTTP_400_BAD_REQUEST)
@@ -190,8 +260,8 @@ def individual_consumption_history():
         else:
             begin = datetime.strftime(datetime.fromtimestamp(begin), '%Y-%m-%d')
 
-        energy = get_first_and_last_energy_for_date(user.meter_id, begin)
-        power = get_average_power_for_meter_id_and_date(user.meter_id, begin)
+        energy = get_first_and_last_energy_for_date(user.get('meter_id'), begin)
+        power = get_average_power_for_meter_id_and_date(user.get('meter_id'), begin)
 
         # Return result
         result['energy'] = energy
@@ -208,7 +278,9 @@ def individual_consumption_history():
 @GroupConsumptionHistory.route('/group-consumption-history', methods=['GET'])
 @login_required
 def group_consumption_history():
-    """ Shows the history of consumption of today in mW.
+    """ Shows the history of consumption of today in mW. The response is
+    shared by all members of a group and cached per quarter-hour, as the
+    average power values only change once per quarter-hour.
     :return: (a JSON object with each meter reading/power consumption/power
     production mapped to its timestamp, 200)
     or ({}, 206) if there is no history
@@ -216,54 +288,27 @@ def group_consumption_history():
     swagger_from_file: swagger_files/get_group-consumption-history.yml
     """
 
-    user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = get_user_parameters(get_jwt_identity())
     if user is None:
         return UNKNOWN_USER.make_json_response(status.HTTP_400_BAD_REQUEST)
-    group = db.session.query(Group).filter_by(id=user.group_id).first()
+    group = get_group_parameters(user.get('group_id'))
     if group is None:
         return UNKNOWN_GROUP.make_json_response(status.HTTP_400_BAD_REQUEST)
 
-    group_users = {}
+    now = datetime.utcnow()
+    today = datetime.strftime(now, '%Y-%m-%d')
+    key = group_consumption_history_key(user.get('group_id'), today,
+                                        calc_quarter_hour_index(now))
+    cached_response = get_cached_response(key)
+    if cached_response is not None:
+        return Response(cached_response, mimetype='application/json'), status.HTTP_200_OK
 
     try:
-        today = datetime.strftime(datetime.utcnow(), '%Y-%m-%d')
-
-        # Group community consumption meter
-        # Get today's average consumed power per 15 minutes
-        consumed_power = get_average_power_for_meter_id_and_date(group.group_meter_id, today)
-        # Get first and last group energy consumption of today
-        consumed_energy = get_first_and_last_energy_for_date(group.group_meter_id, today)
-
-        # First group production meter
-        # Get today's average production power for first production meter per 15 minutes
-        produced_first_meter_power = get_average_power_for_meter_id_and_date(
-            group.group_production_meter_id_first, today)
-        # Get first and last group energy production of first production meter of today
-        produced_first_meter_energy = get_first_and_last_energy_for_date(
-            group.group_production_meter_id_first, today)
-
-        # Second group production meter
-        # Get today's average production power for second production meter per 15 minutes
-        produced_second_meter_power = get_average_power_for_meter_id_and_date(
-            group.group_production_meter_id_second, today)
-        # Get first and last group energy production of first production meter of today
-        produced_second_meter_energy = get_first_and_last_energy_for_date(
-            group.group_production_meter_id_second, today)
-
-        # Group members
-        for member in get_group_members(user_id):
-            member_data = create_member_data(member)
-            group_users[member.get('id')] = member_data
+        response = create_group_consumption_history(group, today)
+        cache_response(key, response)
 
         # Return result
-        return jsonify(dict(consumed_power=consumed_power,
-                            produced_first_meter_power=produced_first_meter_power,
-                            produced_second_meter_power=produced_second_meter_power,
-                            consumed_energy=consumed_energy,
-                            produced_first_meter_energy=produced_first_meter_energy,
-                            produced_second_meter_energy=produced_second_meter_energy,
-                            group_users=group_users)), status.HTTP_200_OK
+        return Response(response, mimetype='application/json'), status.HTTP_200_OK
 
     except TypeError as e:
         logger.error("Exception: %s", e)
@@ -1,15 +1,14 @@
-from datetime import datetime, timedelta
+from datetime import datetime, time, timedelta
 import os
 import logging.config
 import redis
 from flask import Blueprint, jsonify, request
 from flask_api import status
 from flask_jwt_extended import get_jwt_identity
-from models.user import User
-from util.database import db
+from util.cache import get_user_parameters
 from util.error import UNKNOWN_USER, UNKNOWN_GROUP
 from util.login import login_required, get_parameters
-from util.redis_helpers import get_sorted_keys, get_sorted_keys_date_prefix, get_entry_date
+from util.redis_helpers import get_disaggregation_days
 
 
 logger = logging.getLogger(__name__)
@@ -19,12 +18,16 @@ redis_host = os.environ['REDIS_HOST']
 redis_port = os.environ['REDIS_PORT']
 redis_db = os.environ['REDIS_DB']
 redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+# The number of days back from today for which disaggregation values are served
+max_disaggregation_days = 31
 
 
 def get_disaggregation(meter_id, begin):
     """ Return all disaggregation values for the given meter id, starting with
     the given timestamp. As we were using unix timestamps as basis for our
     dates all along, there is no need to convert the given, timezone-unaware dates to UTC.
+    Begin timestamps more than max_disaggregation_days back are moved to the
+    begin of the first of these days.
     :param str meter_id: the meter id for which to get the values
     :param int begin: the unix timestamp to begin with
     :return: the disaggregation values for the period mapped to their
@@ -32,21 +35,15 @@ def get_disaggregation(meter_id, begin):
     :rtype: dict
     """
 
-    result = {}
-    for key in get_sorted_keys(redis_client, meter_id):
-
-        disaggregation_date, data = get_entry_date(redis_client, meter_id, key, 'disaggregation')
-
-        if disaggregation_date is None or data is None:
-            continue
+    start = max(datetime.fromtimestamp(begin), datetime.combine(
+        datetime.utcnow().date() - timedelta(days=max_disaggregation_days - 1), time()))
+    dates = [(start + timedelta(days=day)).strftime('%Y-%m-%d')
+             for day in range((datetime.utcnow().date() - start.date()).days + 1)]
+    start_timestamp = start.strftime('%Y-%m-%d %H:%M:%S')
 
-        # Parse timestamp as int to use consistent timestamps
-        disaggregation_timestamp = int(disaggregation_date.timestamp())
-
-        if disaggregation_timestamp >= begin:
-            result[disaggregation_date.strftime('%Y-%m-%d %H:%M:%S')] = data.get('values')
-
-    return result
+    return {timestamp: values for timestamp, values in
+            get_disaggregation_days(redis_client, meter_id, dates).items()
+            if timestamp >= start_timestamp}
 
 
 def get_default_disaggregation(meter_id):
@@ -57,8 +54,6 @@ def get_default_disaggregation(meter_id):
     :rtype: dict
     """
 
-    result = {}
-
     # Get two days ago's date
     two_days_back = datetime.strftime(datetime.utcnow() - timedelta(hours=48),
                                       '%Y-%m-%d')
@@ -71,20 +66,7 @@ def get_default_disaggregation(meter_id):
     today = datetime.strftime(datetime.utcnow(), '%Y-%m-%d')
 
     # Get data from two days back until now
-    redis_keys = get_sorted_keys_date_prefix(redis_client, meter_id, two_days_back) +\
-        get_sorted_keys_date_prefix(redis_client, meter_id, yesterday) +\
-        get_sorted_keys_date_prefix(redis_client, meter_id, today)
-
-    for key in redis_keys:
-
-        disaggregation_date, data = get_entry_date(redis_client, meter_id, key, 'disaggregation')
-
-        if disaggregation_date is None or data is None:
-            continue
-
-        result[disaggregation_date.strftime('%Y-%m-%d %H:%M:%S')] = data.get('values')
-
-    return result
+    return get_disaggregation_days(redis_client, meter_id, [two_days_back, yesterday, today])
 
 
 def read_begin_parameter():
@@ -111,8 +93,7 @@ def individual_disaggregation():
     swagger_from_file: swagger_files/get_individual-disaggregation.yml
     """
 
-    user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = get_user_parameters(get_jwt_identity())
     if user is None:
         return UNKNOWN_USER.make_json_response(status.HTTP_400_BAD_REQUEST)
 
@@ -121,9 +102,9 @@ def individual_disaggregation():
 
     try:
         if begin is None:
-            result = get_default_disaggregation(user.meter_id)
+            result = get_default_disaggregation(user.get('meter_id'))
         else:
-            result = get_disaggregation(user.meter_id, begin)
+            result = get_disaggregation(user.get('meter_id'), begin)
 
         # Return result
         return jsonify(result), status.HTTP_200_OK
@@ -158,9 +139,9 @@ def group_disaggregation():
 
     try:
         if begin is None:
-            result = get_default_disaggregation(group.group_meter_id)
+            result = get_default_disaggregation(group.get('group_meter_id'))
         else:
-            result = get_disaggregation(group.group_meter_id, begin)
+            result = get_disaggregation(group.get('group_meter_id'), begin)
 
         # Return result
         return jsonify(result), status.HTTP_200_OK
@@ -3,6 +3,7 @@ from flask import render_template, Blueprint, Response, request, redirect
 from flask_jwt_extended import (create_access_token, get_raw_jwt, get_jwt_identity,
                                 set_access_cookies, verify_jwt_in_request, unset_jwt_cookies)
 from models.user import User, StateType, RoleType
+from util.cache import invalidate_user
 from util.database import db
 
 
@@ -107,6 +108,7 @@ def do_user_baseline_update():
     targetUser.baseline = request.form['baseline']
 
     db.session.commit()
+    invalidate_user(targetUser.id)
     return Response(render_template('employee/user/list.html',
                                     users=targetUsers,
                                     message=f"Updated baseline for {targetUser.name}"),
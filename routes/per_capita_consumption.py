@@ -3,7 +3,7 @@ from flask import Blueprint, jsonify
 from flask_api import status
 from flask_jwt_extended import get_jwt_identity
 from models.per_capita_consumption import PerCapitaConsumption
-from models.user import User
+from util.cache import get_user_parameters
 from util.database import db
 from util.error import UNKNOWN_USER, NO_PER_CAPITA_CONSUMPTION, exception_message
 from util.login import login_required
@@ -22,6 +22,8 @@ def get_moving_average_annualized(meter_id):
     """
 
     try:
+        # The latest entry is the first one of the meter in the index on
+        # meter id and date descending
         result = db.session.query(PerCapitaConsumption.date,
                                   PerCapitaConsumption.moving_average_annualized).\
             filter_by(meter_id=meter_id).order_by(PerCapitaConsumption.date.desc()).first()
@@ -46,8 +48,7 @@ def per_capita_consumption():
     swagger_from_file: swagger_files/get_per-capita-consumption.yml
     """
 
-    user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = get_user_parameters(get_jwt_identity())
 
     if user is None:
         return UNKNOWN_USER.make_json_response(status.HTTP_400_BAD_REQUEST)
@@ -55,7 +56,7 @@ def per_capita_consumption():
     result = {}
 
     try:
-        result = get_moving_average_annualized(user.meter_id)
+        result = get_moving_average_annualized(user.get('meter_id'))
         if result is None:
             return NO_PER_CAPITA_CONSUMPTION.make_json_response(status.HTTP_206_PARTIAL_CONTENT)
 
@@ -9,6 +9,7 @@ from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from models.user import User, BaselineStateType
 from models.group import Group
+from util.cache import invalidate_user, invalidate_group
 from util.error import UNKNOWN_USER
 from util.database import db
 
@@ -103,5 +104,7 @@ def put_profile():
         target_user.avatar = base64.b64encode(buffered.getvalue())
 
     db.session.commit()
+    invalidate_user(target_user.id)
+    invalidate_group(target_user.group_id)
 
     return '', status.HTTP_200_OK
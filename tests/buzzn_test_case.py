@@ -4,7 +4,9 @@ from flask_testing import TestCase
 from models.group import Group
 from models.user import User, GenderType, StateType, BaselineStateType
 from setup_app import setup_app
+from util.cache import clear_caches
 from util.database import db
+from util.energy_saving_calculation import clear_load_profile_cache
 
 
 class TestConfig():
@@ -51,5 +53,7 @@ class BuzznTestCase(TestCase):
         db.session.commit()
 
     def create_app(self):
+        clear_caches()
+        clear_load_profile_cache()
         app = setup_app(TestConfig())
         return app
@@ -254,7 +254,8 @@ SORTED_KEYS_ALL_TERMS = [[b'52d7c87f8c26433dbd095048ad30c8cf_2019-03-11 01:00:00
 SORTED_KEYS_ESTIMATION = [SORTED_KEYS_ALL_TERMS[0],
                           SORTED_KEYS_ALL_TERMS[1]] + SORTED_KEYS_ALL_TERMS
 
-SQLALCHEMY_RETURN_VALUES = [(1002846.2290000044,), (896919.8780000011,)]
+LOAD_PROFILE_ROWS = [('2019-03-12', 50), ('2019-03-12', 50), ('2019-05-01', 100),
+                     ('2019-08-01', 100), ('2019-12-01', 100), ('2020-06-01', 100)]
 
 USER_CONSUMPTION_DAY_ONE_ITERATION_FIRST = [
     None,
@@ -295,3 +296,8 @@ READINGS_ALL_TERMS = [READINGS_LAST_TERM[0], READINGS_LAST_TERM[1],
 
 READINGS_ESTIMATION = [READINGS_ALL_TERMS[0],
                        READINGS_ALL_TERMS[1]] + READINGS_ALL_TERMS
+
+# The last readings on the begin and end of the previous term and on the start
+# and end of the ongoing term, with and without namespace
+TERM_BOUNDARY_READINGS = [READINGS_LAST_TERM[1], READINGS_LAST_TERM[0],
+                          READINGS_ONGOING_TERM[1], READINGS_ONGOING_TERM[0]] + [None] * 4
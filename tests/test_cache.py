@@ -0,0 +1,82 @@
+import json
+from unittest import mock
+from models.user import User
+from tests.buzzn_test_case import BuzznTestCase
+from util.cache import TTLCache, get_user_parameters, get_group_parameters
+from util.database import db
+
+
+class TTLCacheTestCase(BuzznTestCase):
+    """ Unit tests for class TTLCache. """
+
+    def test_lru_eviction(self):
+        """ Unit tests for the eviction of the least recently used entry. """
+
+        cache = TTLCache(60, 2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+
+        # Check that the least recently used entry was evicted
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('c'), 3)
+
+    @mock.patch('util.cache.time.monotonic', side_effect=[100.0, 159.0, 160.0])
+    def test_expiry(self, _monotonic):
+        """ Unit tests for the expiry of entries after their time to live. """
+
+        cache = TTLCache(60, 2)
+        cache.set('a', 1)
+
+        # Check that the entry is valid until its time to live has passed
+        self.assertEqual(cache.get('a'), 1)
+        self.assertIsNone(cache.get('a'))
+
+
+class CacheTestCase(BuzznTestCase):
+    """ Unit tests for the cached user and group lookups. """
+
+    def test_get_user_parameters(self):
+        """ Unit tests for function get_user_parameters(). """
+
+        result = get_user_parameters(self.test_case_user.id)
+
+        # Check result values
+        self.assertEqual(result, dict(meter_id='EASYMETER_60404854', group_id=1,
+                                      inhabitants=2))
+        self.assertIsNone(get_user_parameters(42))
+
+        # Check that the cached value is returned without a database query
+        with mock.patch('util.cache.db') as database:
+            self.assertEqual(get_user_parameters(self.test_case_user.id), result)
+            database.session.query.assert_not_called()
+
+    def test_get_group_parameters(self):
+        """ Unit tests for function get_group_parameters(). """
+
+        result = get_group_parameters(self.test_case_group.id)
+
+        # Check result values
+        self.assertEqual(result.get('group_meter_id'), 'EASYMETER_1124001747')
+        self.assertEqual(result.get('members'), [dict(id=self.test_case_user.id,
+                                                      meter_id='EASYMETER_60404854',
+                                                      inhabitants=2)])
+        self.assertIsNone(get_group_parameters(42))
+
+    def test_invalidate_on_profile_update(self):
+        """ Check that a profile update invalidates the cached user and group. """
+
+        get_user_parameters(self.test_case_user.id)
+        get_group_parameters(self.test_case_group.id)
+        login_request = self.client.post('/login', data=json.dumps({
+            'user': 'test@test.net', 'password': 'some_password1'}))
+        self.client.put('/profile', data=json.dumps({'inhabitants': 3}), headers={
+            'Authorization': 'Bearer {}'.format(login_request.json['sessionToken'])})
+
+        # Check that the updated inhabitants are returned
+        self.assertEqual(db.session.query(User).first().inhabitants, 3)
+        self.assertEqual(get_user_parameters(self.test_case_user.id).get('inhabitants'), 3)
+        self.assertEqual(get_group_parameters(self.test_case_group.id).get(
+            'members')[0].get('inhabitants'), 3)
@@ -3,6 +3,7 @@ import json
 from unittest import mock
 from flask_api import status
 from models.user import User, GenderType, StateType
+from routes.consumption_history import get_average_power_for_meter_id_and_date
 from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import EMPTY_GROUP_CONSUMPTION,\
     EMPTY_RESPONSE, EMPTY_RESPONSE_BYTES, GROUP_CONSUMPTION, INDIVIDUAL_CONSUMPTION, \
@@ -19,8 +20,8 @@ class IndividualConsumptionHistoryTestCase(BuzznTestCase):
                 return_value=AVERAGE_POWER)
     @mock.patch('routes.consumption_history.get_first_and_last_energy_for_date',
                 return_value=FIRST_LAST_ENERGY)
-    def test_individual_consumption_history(self, get_average_power_for_meter_id_and_date,
-                                            get_first_and_last_energy_for_date):
+    def test_individual_consumption_history(self, _get_first_and_last_energy_for_date,
+                                            _get_average_power_for_meter_id_and_date):
         """ Unit tests for individual_consumption_history(). """
 
         # Check if route exists
@@ -45,8 +46,8 @@ class IndividualConsumptionHistoryTestCase(BuzznTestCase):
                 return_value=EMPTY_RESPONSE)
     @mock.patch('routes.consumption_history.get_first_and_last_energy_for_date',
                 return_value=EMPTY_RESPONSE)
-    def test_parameters(self, get_average_power_for_meter_id_and_date,
-                        get_first_and_last_energy_for_date):
+    def test_parameters(self, _get_first_and_last_energy_for_date,
+                        _get_average_power_for_meter_id_and_date):
         """ Check handling of erroneous parameters. """
 
         login_request = self.client.post('/login',
@@ -84,6 +85,24 @@ class IndividualConsumptionHistoryTestCase(BuzznTestCase):
             response_tics_format.data.decode('utf-8')), EMPTY_RESPONSE_BYTES)
 
 
+class AveragePowerTestCase(BuzznTestCase):
+    """ Unit tests for function get_average_power_for_meter_id_and_date(). """
+
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.hgetall', return_value={
+        b'2020-01-15 10:30:00': b'232000.0', b'2020-01-15 10:15:00': b'224550.0',
+        b'2020-01-15 10:45:00': b'227630.0'})
+    def test_get_average_power_for_meter_id_and_date(self, hgetall):
+        """ Check that the average power values are read from the day's hash. """
+
+        result = get_average_power_for_meter_id_and_date('EASYMETER_60404854', '2020-01-15')
+
+        # Check result values
+        hgetall.assert_called_once_with('average_power_EASYMETER_60404854_2020-01-15')
+        self.assertEqual(result, AVERAGE_POWER)
+        self.assertEqual(list(result.keys()), sorted(AVERAGE_POWER.keys()))
+
+
 class GroupConsumptionHistoryTestCase(BuzznTestCase):
     """ Unit tests for route GroupConsumptionHistory. """
 
@@ -102,8 +121,8 @@ class GroupConsumptionHistoryTestCase(BuzznTestCase):
                 return_value=AVERAGE_POWER)
     @mock.patch('routes.consumption_history.get_first_and_last_energy_for_date',
                 return_value=FIRST_LAST_ENERGY)
-    def test_group_consumption_history(self, get_average_power_for_meter_id_and_date,
-                                       get_first_and_last_energy_for_date):
+    def test_group_consumption_history(self, _get_first_and_last_energy_for_date,
+                                       _get_average_power_for_meter_id_and_date):
         """ Unit tests for group_consumption_history()."""
 
         # Check if route exists
@@ -121,13 +140,31 @@ class GroupConsumptionHistoryTestCase(BuzznTestCase):
         self.assertEqual(ast.literal_eval(
             response.data.decode('utf-8')), GROUP_CONSUMPTION)
 
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.get', return_value=json.dumps(GROUP_CONSUMPTION).encode())
+    @mock.patch('routes.consumption_history.get_average_power_for_meter_id_and_date')
+    def test_group_consumption_history_cached(self, get_average_power, get):
+        """ Unit tests for group_consumption_history() with a cached response. """
+
+        login_request = self.client.post('/login',
+                                         data=json.dumps({'user': 'test@test.net',
+                                                          'password': 'some_password1'}))
+        response = self.client.get('/group-consumption-history', headers={
+            'Authorization': 'Bearer {}'.format(login_request.json["sessionToken"])})
+
+        # Check that the cached response is returned without recomputing it
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.json, json.loads(json.dumps(GROUP_CONSUMPTION)))
+        get_average_power.assert_not_called()
+        self.assertTrue(get.call_args[0][0].startswith('group_consumption_history_1_'))
+
     # pylint: disable=unused-argument
     @mock.patch('routes.consumption_history.get_average_power_for_meter_id_and_date',
                 return_value=EMPTY_RESPONSE)
     @mock.patch('routes.consumption_history.get_first_and_last_energy_for_date',
                 return_value=EMPTY_RESPONSE)
-    def test_parameters(self, get_average_power_for_meter_id_and_date,
-                        get_first_and_last_energy_for_date):
+    def test_parameters(self, _get_first_and_last_energy_for_date,
+                        _get_average_power_for_meter_id_and_date):
         """ Test handling of erroneous parameters. """
 
         login_request = self.client.post('/login',
@@ -1,7 +1,7 @@
 from datetime import datetime, date, timedelta
 from util.date_helpers import calc_support_year_start, calc_term_boundaries,\
     calc_end, calc_support_year_start_datetime, calc_support_week_start,\
-    calc_two_days_back
+    calc_two_days_back, calc_quarter_hour_index
 from tests.buzzn_test_case import BuzznTestCase
 
 
@@ -138,3 +138,12 @@ class DateHelpersTestCase(BuzznTestCase):
 
         # Check return type
         self.assertIsInstance(result, int)
+
+    def test_calc_quarter_hour_index(self):
+        """ Unit tests for function calc_quarter_hour_index(). """
+
+        # Check result values
+        self.assertEqual(calc_quarter_hour_index(datetime(2020, 1, 15)), 0)
+        self.assertEqual(calc_quarter_hour_index(datetime(2020, 1, 15, 10, 14, 59)), 40)
+        self.assertEqual(calc_quarter_hour_index(datetime(2020, 1, 15, 10, 15)), 41)
+        self.assertEqual(calc_quarter_hour_index(datetime(2020, 1, 15, 23, 59)), 95)
@@ -1,7 +1,9 @@
+from datetime import datetime, timedelta
 import ast
 import json
 from unittest import mock
 from flask_api import status
+from routes.disaggregation import get_disaggregation, get_default_disaggregation
 from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import EMPTY_RESPONSE, DISAGGREGATION,\
     INDIVIDUAL_DISAGGREGATION
@@ -13,7 +15,7 @@ class IndividualDisaggregation(BuzznTestCase):
     # pylint does not understand the required argument from the @mock.patch decorator
     # pylint: disable=unused-argument
     @mock.patch('routes.disaggregation.get_default_disaggregation', return_value=DISAGGREGATION)
-    def test_individual_disaggregation(self, get_disaggregation):
+    def test_individual_disaggregation(self, _get_default_disaggregation):
         """ Unit tests for individual_disaggregation(). """
 
         # Check if route exists
@@ -38,7 +40,7 @@ class GroupDisaggregation(BuzznTestCase):
     # pylint does not understand the required argument from the @mock.patch decorator
     # pylint: disable=unused-argument
     @mock.patch('routes.disaggregation.get_default_disaggregation', return_value=EMPTY_RESPONSE)
-    def test_group_disaggregation(self, get_default_disaggregation):
+    def test_group_disaggregation(self, _get_default_disaggregation):
         """ Unit tests for group_disaggregation(). """
 
         # Check if route exists
@@ -66,7 +68,7 @@ class Disaggregation(BuzznTestCase):
                 return_value=EMPTY_RESPONSE)
     @mock.patch('routes.disaggregation.get_default_disaggregation',
                 return_value=EMPTY_RESPONSE)
-    def test_parameters(self, get_disaggregation, get_default_disaggregation):
+    def test_parameters(self, _get_default_disaggregation, _get_disaggregation):
         """ Test handling of erroneous parameters. """
 
         login_request = self.client.post('/login',
@@ -93,3 +95,44 @@ class Disaggregation(BuzznTestCase):
                 response_timestamp_format.data.decode('utf-8')), EMPTY_RESPONSE)
             self.assertEqual(ast.literal_eval(
                 response_parameter.data.decode('utf-8')), EMPTY_RESPONSE)
+
+    @mock.patch('routes.disaggregation.max_disaggregation_days', 36500)
+    @mock.patch('routes.disaggregation.get_disaggregation_days', return_value=DISAGGREGATION)
+    def test_get_disaggregation(self, get_disaggregation_days):
+        """ Unit tests for function get_disaggregation(). """
+
+        begin = int(datetime(2020, 1, 15, 10, 1, 5).timestamp())
+        result = get_disaggregation('EASYMETER_60404854', begin)
+
+        # Check that the days from the begin until today are fetched
+        dates = get_disaggregation_days.call_args[0][2]
+        self.assertEqual(dates[0], '2020-01-15')
+        self.assertEqual(dates[-1], datetime.utcnow().strftime('%Y-%m-%d'))
+        self.assertEqual(len(dates), len(set(dates)))
+
+        # Check that the values before the begin are left out
+        self.assertEqual(result, {'2020-01-15 10:01:10': DISAGGREGATION.get(
+            '2020-01-15 10:01:10')})
+
+    @mock.patch('routes.disaggregation.max_disaggregation_days', 3)
+    @mock.patch('routes.disaggregation.get_disaggregation_days', return_value=DISAGGREGATION)
+    def test_get_disaggregation_clamped(self, get_disaggregation_days):
+        """ Unit tests for function get_disaggregation() if the begin lies
+        too far back. """
+
+        get_disaggregation('EASYMETER_60404854', 0)
+
+        # Check that only the last days are fetched
+        dates = get_disaggregation_days.call_args[0][2]
+        self.assertEqual(dates, [(datetime.utcnow() - timedelta(days=day)).strftime('%Y-%m-%d')
+                                 for day in (2, 1, 0)])
+
+    @mock.patch('routes.disaggregation.get_disaggregation_days', return_value=DISAGGREGATION)
+    def test_get_default_disaggregation(self, get_disaggregation_days):
+        """ Unit tests for function get_default_disaggregation(). """
+
+        result = get_default_disaggregation('EASYMETER_60404854')
+
+        # Check that the last three days are fetched at once
+        self.assertEqual(len(get_disaggregation_days.call_args[0][2]), 3)
+        self.assertEqual(result, DISAGGREGATION)
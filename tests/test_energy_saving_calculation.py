@@ -1,15 +1,17 @@
 from unittest import mock
-from datetime import datetime
+from datetime import date, datetime
 import json
 from models.user import User, GenderType
 from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import ALL_USER_METER_IDS,\
     READINGS_ALL_TERMS, READINGS_ESTIMATION, READINGS_LAST_TERM, READINGS_ONGOING_TERM, \
-    ENERGY_CONSUMPTION_LAST_TERM, ENERGY_CONSUMPTION_ONGOING_TERM, SQLALCHEMY_RETURN_VALUES
+    ENERGY_CONSUMPTION_LAST_TERM, ENERGY_CONSUMPTION_ONGOING_TERM, LOAD_PROFILE_ROWS,\
+    TERM_BOUNDARY_READINGS
 from util.database import db
-from util.energy_saving_calculation import calc_ratio_values,\
+from util.energy_saving_calculation import calc_ratio_values, LoadProfileIndex,\
     calc_energy_consumption_last_term, calc_energy_consumption_ongoing_term,\
-    calc_estimated_energy_consumption, calc_estimated_energy_saving
+    calc_estimated_energy_consumption, calc_estimated_energy_saving,\
+    calc_estimated_energy_savings
 
 
 class EnergySavingCalculationTestCase(BuzznTestCase):
@@ -27,12 +29,18 @@ class EnergySavingCalculationTestCase(BuzznTestCase):
         self.client.post('/login', data=json.dumps({'user': 'test@test.net',
                                                     'password': 'some_password1'}))
 
-    # pylint: disable=unused-argument
-    @mock.patch('sqlalchemy.engine.result.ResultProxy.first',
-                side_effect=SQLALCHEMY_RETURN_VALUES)
-    def test_calc_ratio_values(self, first):
+    @mock.patch('util.energy_saving_calculation.datetime')
+    @mock.patch('util.energy_saving_calculation.get_engine')
+    def test_calc_ratio_values(self, get_engine, mock_datetime):
         """ Unit tests for function calc_ratio_values(). """
 
+        mock_datetime.side_effect = datetime
+        mock_datetime.utcnow.return_value = datetime(2019, 9, 12)
+        execute = get_engine.return_value.connect.return_value.__enter__.return_value.execute
+        execute.return_value.fetchone.return_value = (len(LOAD_PROFILE_ROWS), '2020-06-01')
+        execute.return_value.fetchall.return_value = LOAD_PROFILE_ROWS
+        version_query = mock.call('SELECT COUNT(*), MAX(date) FROM loadprofile')
+        load_query = mock.call('SELECT date, energy FROM loadprofile ORDER BY date, time')
         start = datetime(2019, 3, 12).date()
         result = calc_ratio_values(start)
 
@@ -40,7 +48,34 @@ class EnergySavingCalculationTestCase(BuzznTestCase):
         self.assertIsInstance(result, float)
 
         # Check result value
-        self.assertTrue(1.0 >= result >= 0.0)
+        self.assertEqual(result, 0.75)
+
+        # Check that the database is queried once a day and that the load
+        # profile is loaded once while it is unchanged
+        self.assertEqual(calc_ratio_values(start), 0.75)
+        self.assertEqual(execute.call_args_list.count(version_query), 1)
+        mock_datetime.utcnow.return_value = datetime(2019, 9, 13)
+        self.assertEqual(calc_ratio_values(start), 0.75)
+        self.assertEqual(execute.call_args_list.count(version_query), 2)
+        self.assertEqual(execute.call_args_list.count(load_query), 1)
+
+        # Check that the load profile is reloaded on the day after it has changed
+        execute.return_value.fetchone.return_value = (len(LOAD_PROFILE_ROWS), '2020-06-02')
+        self.assertEqual(calc_ratio_values(start), 0.75)
+        self.assertEqual(execute.call_args_list.count(load_query), 1)
+        mock_datetime.utcnow.return_value = datetime(2019, 9, 14)
+        self.assertEqual(calc_ratio_values(start), 0.75)
+        self.assertEqual(execute.call_args_list.count(load_query), 2)
+
+    def test_load_profile_index(self):
+        """ Unit tests for class LoadProfileIndex. """
+
+        index = LoadProfileIndex(LOAD_PROFILE_ROWS)
+
+        # Check result values
+        self.assertEqual(index.calc_energy(date(2019, 3, 12), date(2020, 3, 12)), 400.0)
+        self.assertEqual(index.calc_energy(date(2019, 3, 13), date(2019, 6, 1)), 100.0)
+        self.assertIsNone(index.calc_energy(date(2021, 1, 1), date(2021, 2, 1)))
 
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', side_effect=READINGS_LAST_TERM)
@@ -92,3 +127,25 @@ class EnergySavingCalculationTestCase(BuzznTestCase):
 
         # Check result types
         self.assertIsInstance(result, (float, type(None)))
+
+    @mock.patch('util.energy_saving_calculation.calc_ratio_values', return_value=0.5)
+    @mock.patch('redis.Redis.get', side_effect=READINGS_ESTIMATION)
+    @mock.patch('redis.client.Pipeline.execute',
+                side_effect=[[TERM_BOUNDARY_READINGS[:4] + TERM_BOUNDARY_READINGS[:1] + [None]
+                              + TERM_BOUNDARY_READINGS[2:4] + [None] * 8], [[], None]])
+    def test_calc_estimated_energy_savings(self, execute, _get, _calc_ratio_values):
+        """ Unit tests for function calc_estimated_energy_savings() """
+
+        start = datetime(2019, 3, 12).date()
+        expected = calc_estimated_energy_saving(ALL_USER_METER_IDS[1], start)
+        savings, community_saving = calc_estimated_energy_savings(
+            [ALL_USER_METER_IDS[1], ALL_USER_METER_IDS[2]], start)
+
+        # Check that all term boundary readings are fetched in one pipeline
+        # and the missing one is looked up in another
+        self.assertEqual(execute.call_count, 2)
+
+        # Check result values
+        self.assertEqual(savings, {ALL_USER_METER_IDS[1]: expected,
+                                   ALL_USER_METER_IDS[2]: None})
+        self.assertEqual(community_saving, expected)
@@ -13,7 +13,7 @@ from routes.global_challenge import get_individual_saving, get_community_saving,
     get_individual_baseline
 from tests.string_constants import COMMUNITY_SAVING, COMMUNITY_SAVING_DICT, INDIVIDUAL_BASELINE,\
     INDIVIDUAL_GLOBAL_CHALLENGE, INDIVIDUAL_SAVING, INDIVIDUAL_SAVING_DICT,\
-    READINGS_ESTIMATION, SORTED_KEYS_ESTIMATION
+    TERM_BOUNDARY_READINGS
 
 
 class GlobalChallengeTestCase(BuzznTestCase):
@@ -53,10 +53,8 @@ class GlobalChallengeTestCase(BuzznTestCase):
                                                     'password': 'some_password1'}))
 
     # pylint: disable=unused-argument
-    @mock.patch('redis.Redis.scan_iter',
-                side_effect=SORTED_KEYS_ESTIMATION)
-    @mock.patch('redis.Redis.get', side_effect=READINGS_ESTIMATION)
-    def test_estimate_energy_saving_each_user(self, scan_iter, get):
+    @mock.patch('redis.client.Pipeline.execute', return_value=[TERM_BOUNDARY_READINGS])
+    def test_estimate_energy_saving_each_user(self, execute):
         """ Unit tests for function estimate_energy_saving_each_user(). """
 
         start = datetime(2019, 3, 12).date()
@@ -69,10 +67,8 @@ class GlobalChallengeTestCase(BuzznTestCase):
             self.assertIsInstance(value, (float, type(None)))
 
     # pylint: disable=unused-argument
-    @mock.patch('redis.Redis.scan_iter',
-                side_effect=SORTED_KEYS_ESTIMATION)
-    @mock.patch('redis.Redis.get', side_effect=READINGS_ESTIMATION)
-    def test_estimate_energy_saving_all_users(self, scan_iter, get):
+    @mock.patch('redis.client.Pipeline.execute', return_value=[TERM_BOUNDARY_READINGS])
+    def test_estimate_energy_saving_all_users(self, execute):
         """ Unit tests for function estimate_energy_saving_each_user(). """
 
         start = datetime(2019, 3, 12).date()
@@ -0,0 +1,63 @@
+from unittest import mock
+from tests.buzzn_test_case import BuzznTestCase
+from tests.string_constants import FIRST_METER_READING_DATE, FIRST_ENERGY_DATE,\
+    LAST_METER_READING_DATE, LAST_ENERGY_DATE
+from util.meter_reading_dates import find_meter_reading_dates, get_meter_reading_dates
+
+
+METER_ID = '52d7c87f8c26433dbd095048ad30c8cf'
+
+
+class MeterReadingDatesTestCase(BuzznTestCase):
+    """ Unit tests for the bulk lookups of the first and last readings of
+    days. """
+
+    def test_find_meter_reading_dates(self):
+        """ Unit tests for function find_meter_reading_dates(). """
+
+        redis_client = mock.MagicMock()
+        pipeline = redis_client.pipeline.return_value
+        pipeline.execute.side_effect = [
+            [[('r:' + METER_ID + '_2020-01-15 00:00:04').encode('utf-8')], None,
+             [('r:' + METER_ID + '_2020-01-15 23:59:04').encode('utf-8')], None,
+             [], b'{"first_energy": 5, "last_energy": 9}', [], None],
+            [[FIRST_METER_READING_DATE, LAST_METER_READING_DATE]], [True, True]]
+
+        result = find_meter_reading_dates(redis_client, [
+            (METER_ID, '2020-01-15', 'first'), (METER_ID, '2020-01-15', 'last'),
+            (METER_ID, '2020-01-16', 'first'), (METER_ID, '2020-01-17', 'last')])
+
+        # Check that the index and rollup lookups, the reading fetches and
+        # the writes of the day keys each run in one pipeline
+        self.assertEqual(pipeline.execute.call_count, 3)
+        pipeline.zrangebyscore.assert_any_call(
+            'reading_index_' + METER_ID, 1579046400, '(1579132800', start=0, num=1)
+        pipeline.zrevrangebyscore.assert_any_call(
+            'reading_index_' + METER_ID, '(1579132800', 1579046400, start=0, num=1)
+        pipeline.mget.assert_called_once_with([METER_ID.join(['r:', '_2020-01-15 00:00:04']),
+                                               METER_ID.join(['r:', '_2020-01-15 23:59:04'])])
+        self.assertEqual([call[0][0] for call in pipeline.set.call_args_list],
+                         ['agg:' + METER_ID + '_2020-01-15_first',
+                          'agg:' + METER_ID + '_2020-01-15_last'])
+        redis_client.get.assert_not_called()
+
+        # Check result values
+        self.assertEqual(result, [FIRST_ENERGY_DATE, LAST_ENERGY_DATE, 5, None])
+
+    def test_get_meter_reading_dates(self):
+        """ Unit tests for function get_meter_reading_dates(). """
+
+        redis_client = mock.MagicMock()
+        pipeline = redis_client.pipeline.return_value
+        pipeline.execute.side_effect = [[[FIRST_METER_READING_DATE, None, FIRST_METER_READING_DATE,
+                                          LAST_METER_READING_DATE, LAST_METER_READING_DATE,
+                                          None]]]
+
+        result = get_meter_reading_dates(redis_client, [METER_ID], [
+            ('2020-01-15', 'first'), ('2020-01-15', 'last'), ('2020-01-16', 'first')])
+
+        # Check that the lookups stop after the MGETs if no day is missing
+        # and that namespaced keys take precedence
+        pipeline.execute.assert_called_once()
+        self.assertEqual(result, {METER_ID: [FIRST_ENERGY_DATE, LAST_ENERGY_DATE,
+                                             FIRST_ENERGY_DATE]})
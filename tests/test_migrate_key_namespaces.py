@@ -0,0 +1,39 @@
+from unittest import mock
+from tests.buzzn_test_case import BuzznTestCase
+from tests.string_constants import FIRST_METER_READING_DATE
+from util.migrate_key_namespaces import migrate_meter
+
+
+class MigrateKeyNamespacesTestCase(BuzznTestCase):
+    """ Unit tests for the key namespace migration. """
+
+    def test_migrate_meter(self):
+        """ Unit tests for function migrate_meter(). """
+
+        meter_id = '52d7c87f8c26433dbd095048ad30c8cf'
+        redis_client = mock.MagicMock()
+        redis_client.scan_iter.return_value = [
+            (meter_id + '_2020-01-15 10:00:04').encode('utf-8'),
+            (meter_id + '_2020-01-15 10:01:10').encode('utf-8'),
+            (meter_id + '_last').encode('utf-8'),
+            (meter_id + 'f_last').encode('utf-8')]
+        redis_client.mget.return_value = [
+            FIRST_METER_READING_DATE,
+            '{"type": "disaggregation", "values": {"Grundlast-1": 50000000}}']
+
+        result = migrate_meter(redis_client, meter_id)
+
+        # Check that each key is renamed to the namespace of its type
+        pipeline = redis_client.pipeline.return_value
+        pipeline.renamenx.assert_any_call(meter_id + '_2020-01-15 10:00:04',
+                                          'r:' + meter_id + '_2020-01-15 10:00:04')
+        pipeline.renamenx.assert_any_call(meter_id + '_2020-01-15 10:01:10',
+                                          'd:' + meter_id + '_2020-01-15 10:01:10')
+        pipeline.renamenx.assert_any_call(meter_id + '_last', 'agg:' + meter_id + '_last')
+        self.assertEqual(result, 3)
+
+        # Check that the time index refers to the renamed reading
+        pipeline.zadd.assert_called_once_with(
+            'reading_index_' + meter_id, {'r:' + meter_id + '_2020-01-15 10:00:04': 1579082404})
+        pipeline.zrem.assert_called_once_with('reading_index_' + meter_id,
+                                              meter_id + '_2020-01-15 10:00:04')
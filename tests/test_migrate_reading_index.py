@@ -0,0 +1,37 @@
+from unittest import mock
+from tests.buzzn_test_case import BuzznTestCase
+from tests.string_constants import FIRST_METER_READING_DATE
+from util.migrate_reading_index import migrate
+
+
+class MigrateReadingIndexTestCase(BuzznTestCase):
+    """ Unit tests for the reading index migration. """
+
+    def test_migrate(self):
+        """ Unit tests for function migrate(). """
+
+        meter_id = '52d7c87f8c26433dbd095048ad30c8cf'
+        redis_client = mock.MagicMock()
+        redis_client.exists.return_value = 0
+        redis_client.scan_iter.return_value = [
+            (meter_id + '_2020-01-15 10:00:04').encode('utf-8'),
+            (meter_id + '_2020-01-15_last').encode('utf-8'),
+            b'117154df05874f41bfdaebcae6abfe98_2020-01-15 10:00:04',
+            ('r:' + meter_id + '_2020-01-15 10:01:04').encode('utf-8'),
+            ('reading_index_' + meter_id).encode('utf-8')]
+        redis_client.mget.return_value = [FIRST_METER_READING_DATE]
+
+        result = migrate(redis_client, [meter_id])
+
+        # Check that only the readings of the given meters without namespace
+        # are indexed
+        self.assertEqual(result, 1)
+        redis_client.mget.assert_called_once_with([meter_id + '_2020-01-15 10:00:04'])
+        redis_client.pipeline.return_value.zadd.assert_called_once_with(
+            'reading_index_' + meter_id, {meter_id + '_2020-01-15 10:00:04': 1579082404})
+        redis_client.set.assert_called_once_with('reading_index_migrated', 1)
+
+        # Check that the readings are only indexed once
+        redis_client.exists.return_value = 1
+        self.assertEqual(migrate(redis_client, [meter_id]), 0)
+        redis_client.scan_iter.assert_called_once()
@@ -0,0 +1,122 @@
+from datetime import datetime
+from unittest import mock
+from models.per_capita_consumption import PerCapitaConsumption
+from models.user import User, GenderType
+from tests.buzzn_test_case import BuzznTestCase
+from util.database import db
+from util.per_capita_backfill import backfill
+
+
+def reading(energy):
+    """ Return a stored reading with the given energy. """
+
+    return ('{"type": "reading", "values": {"energy": %d}}' % energy).encode('utf-8')
+
+
+class PerCapitaBackfillTestCase(BuzznTestCase):
+    """ Unit tests for the per capita consumption backfill. """
+
+    def setUp(self):
+        """ Create test users and their per capita consumption in the database. """
+
+        super().setUp()
+        self.test_user = User(GenderType.FEMALE, 'judith', 'greif', 'judith@buzzn.net',
+                              'TestToken2', '52d7c87f8c26433dbd095048ad30c8cf', 1)
+        self.test_user.inhabitants = 2
+        db.session.add(self.test_user)
+        self.test_user2 = User(GenderType.MALE, 'danny', 'stey', 'danny@buzzn.net',
+                               'TestToken3', '117154df05874f41bfdaebcae6abfe98', 1)
+        self.test_user2.inhabitants = 1
+        db.session.add(self.test_user2)
+        db.session.add(PerCapitaConsumption(datetime(2020, 1, 14), self.test_user.meter_id,
+                                            5.0, 10.0, 2, 2.5, 5.0, 1, 5.0, 1825))
+        db.session.add(PerCapitaConsumption(datetime(2020, 1, 16), self.test_user.meter_id,
+                                            0.0, 0.0, 2, 0.0, 0.0, 0, 0.0, 0))
+        db.session.commit()
+
+    @mock.patch('redis.client.Pipeline.execute', side_effect=[
+        [[reading(100000000000), reading(110000000000), reading(310000000000), None,
+          reading(510000000000), None, None, reading(710000000000), None, None] + [None] * 30],
+        [[], None] * 15])
+    def test_backfill(self, execute):
+        """ Unit tests for function backfill(). """
+
+        count = backfill(db.session, datetime(2020, 1, 15), datetime(2020, 1, 18),
+                         [self.test_user.meter_id, self.test_user2.meter_id])
+
+        # Check that the first and last readings of all days are fetched in
+        # one pipeline and the missing ones are looked up in another
+        self.assertEqual(execute.call_count, 2)
+
+        # Check result values
+        self.assertEqual(count, 8)
+        rows = db.session.query(PerCapitaConsumption).filter_by(
+            meter_id=self.test_user.meter_id).order_by(PerCapitaConsumption.date).all()
+        self.assertEqual([row.days for row in rows], [1, 2, 3, 4, 5])
+        # Missing first and last readings are replaced by the closest
+        # readings, the day without readings keeps the moving average
+        self.assertEqual([row.consumption for row in rows], [5.0, 20.0, 20.0, 20.0, 17.5])
+        self.assertEqual(rows[-1].consumption_cumulated, 87.5)
+        self.assertEqual(rows[-1].per_capita_consumption_cumulated, 43.75)
+        self.assertEqual(rows[-1].moving_average, 8.75)
+        self.assertEqual(rows[-1].moving_average_annualized, 3194)
+
+        # The series without the day before starts with the base values
+        rows = db.session.query(PerCapitaConsumption).filter_by(
+            meter_id=self.test_user2.meter_id).order_by(PerCapitaConsumption.date).all()
+        self.assertEqual([row.date for row in rows],
+                         [datetime(2020, 1, day) for day in range(15, 19)])
+        self.assertEqual([row.days for row in rows], [0, 1, 2, 3])
+        self.assertEqual([row.moving_average for row in rows], [0.0] * 4)
+
+    @mock.patch('redis.client.Pipeline.execute', side_effect=[[[None] * 16],
+                                                               [[], None] * 8])
+    def test_backfill_support_year_start(self, _execute):
+        """ Unit tests for function backfill() over the start of a support
+        year and with a user without inhabitants. """
+
+        self.test_user2.inhabitants = 0
+        db.session.add(PerCapitaConsumption(datetime(2020, 3, 9), self.test_user.meter_id,
+                                            5.0, 10.0, 2, 2.5, 5.0, 1, 5.0, 1825))
+        db.session.commit()
+        count = backfill(db.session, datetime(2020, 3, 10), datetime(2020, 3, 12),
+                         [self.test_user.meter_id, self.test_user2.meter_id])
+
+        # Check that the user without inhabitants is skipped
+        self.assertEqual(count, 3)
+        self.assertEqual(db.session.query(PerCapitaConsumption).filter_by(
+            meter_id=self.test_user2.meter_id).count(), 0)
+
+        # Check that the series restarts with the base values on the day
+        # before the start of the support year
+        rows = db.session.query(PerCapitaConsumption).filter_by(
+            meter_id=self.test_user.meter_id).filter(
+                PerCapitaConsumption.date >= datetime(2020, 3, 10)).order_by(
+                    PerCapitaConsumption.date).all()
+        self.assertEqual([row.days for row in rows], [2, 0, 1])
+        self.assertEqual([row.consumption_cumulated for row in rows], [20.0, 0.0, 0.0])
+
+    @mock.patch('redis.Redis.get')
+    @mock.patch('redis.client.Pipeline.execute')
+    def test_backfill_year(self, execute, get):
+        """ Unit tests for function backfill() over a year without _first and
+        _last keys. """
+
+        # The last reading of the day before, the first and last readings of
+        # each day and the first reading of the day after of both meters
+        number_of_lookups = 2 * (2 * 366 + 2)
+        key = ('r:' + self.test_user.meter_id + '_2020-06-01 12:00:00').encode('utf-8')
+        execute.side_effect = [[[None] * 2 * number_of_lookups],
+                               [[key], None] * number_of_lookups,
+                               [[reading(100000000000 + i * 1000000000)
+                                 for i in range(number_of_lookups)]],
+                               [True] * number_of_lookups]
+
+        count = backfill(db.session, datetime(2020, 1, 1), datetime(2020, 12, 31),
+                         [self.test_user.meter_id, self.test_user2.meter_id])
+
+        # Check that the whole year is looked up with a constant number of
+        # pipelines instead of round trips per day
+        self.assertEqual(execute.call_count, 4)
+        get.assert_not_called()
+        self.assertEqual(count, 2 * 366)
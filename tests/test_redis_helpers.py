@@ -1,6 +1,7 @@
 from datetime import datetime
 import os
 from unittest import mock
+from dateutil.tz import tzutc
 import redis
 from tests.buzzn_test_case import BuzznTestCase
 from models.user import User, GenderType, StateType
@@ -10,11 +11,15 @@ from tests.string_constants import FIRST_METER_READING_DATE, DAY_ONE, FIRST_ENER
     DATE_KEY1_DAY_ONE, KEY_LAST, EMPTY_RESPONSE_ARRAY
 from util.database import db
 from util.redis_helpers import get_first_meter_reading_date, get_last_meter_reading_date, \
-    get_entry_date
+    get_entry_date, get_reading_keys_date, calc_day_bounds, get_entry_dates, PipelineWriter, \
+    encode_reading, decode_readings, parse_key_date, get_last_readings, \
+    get_disaggregation_days, reading_key, disaggregation_entry_key, last_reading_key,\
+    strip_namespace, get_namespaced, calc_rollup, merge_rollups, update_day_readings,\
+    UPDATE_DAY_READINGS, remove_disaggregations
 
 
-class RedisHelpersTestCase(BuzznTestCase):
-    """ Unit tests for redis helpers methods. """
+class RedisTestCase(BuzznTestCase):
+    """ Common setup of the redis helpers unit tests. """
 
     def setUp(self):
         db.drop_all()
@@ -31,6 +36,10 @@ class RedisHelpersTestCase(BuzznTestCase):
         redis_db = os.environ['REDIS_DB']
         self.redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
 
+
+class RedisHelpersTestCase(RedisTestCase):
+    """ Unit tests for redis helpers methods. """
+
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', return_value=FIRST_METER_READING_DATE)
     def test_get_entry_date(self, get):
@@ -62,6 +71,254 @@ class RedisHelpersTestCase(BuzznTestCase):
         self.assertEqual(entry_date, None)
         self.assertEqual(data, None)
 
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.mget', return_value=USER_CONSUMPTION_DAY_ONE_ITERATION_FIRST)
+    def test_get_entry_dates(self, mget):
+        """ Unit tests for function get_entry_dates(). """
+        keys = [key.decode('utf-8') for key in SORTED_KEYS_DAY_ONE]
+        result = get_entry_dates(self.redis_client, self.test_user.meter_id, keys + [KEY_LAST],
+                                 'reading')
+        # Check that all entries are fetched with a single MGET without derived keys
+        mget.assert_called_once_with(keys)
+        # Check result values
+        self.assertEqual(len(result), 1)
+        entry_date, data = result[0]
+        self.assertEqual(entry_date.strftime('%Y-%m-%d %H:%M:%S'), keys[2][len(
+            self.test_user.meter_id) + 1:])
+        self.assertEqual(data.get('values').get('energy'), FIRST_ENERGY_DATE)
+
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.set')
+    @mock.patch('redis.Redis.zrevrangebyscore', return_value=[KEY1_DAY_ONE])
+    @mock.patch('redis.Redis.mget', side_effect=[[None, FIRST_METER_READING_DATE, None, None],
+                                                 [FIRST_METER_READING_DATE]])
+    def test_get_last_readings(self, mget, zrevrangebyscore, set_key):
+        """ Unit tests for function get_last_readings(). """
+        meter_ids = ['269e682dbfd74a569ff4561b6416c999', self.test_user.meter_id]
+        result = get_last_readings(self.redis_client, meter_ids)
+        # Check that the _last keys are fetched with a single MGET, with and
+        # without namespace
+        mget.assert_any_call(['agg:' + meter_id + '_last' for meter_id in meter_ids]
+                             + [meter_id + '_last' for meter_id in meter_ids])
+        # Check that the missing _last key is filled from a bounded index lookup
+        zrevrangebyscore.assert_called_once()
+        self.assertEqual(zrevrangebyscore.call_args[0][0], 'reading_index_' + meter_ids[0])
+        set_key.assert_called_once_with('agg:' + meter_ids[0] + '_last',
+                                        FIRST_METER_READING_DATE)
+        # Check result values
+        for meter_id in meter_ids:
+            self.assertEqual(result.get(meter_id).get('values').get('energy'),
+                             FIRST_ENERGY_DATE)
+
+    def test_get_disaggregation_days(self):
+        """ Unit tests for function get_disaggregation_days(). """
+        redis_client = mock.MagicMock()
+        redis_client.pipeline.return_value.execute.return_value = [
+            {b'2020-01-15 10:01:10': b'{"Grundlast-1": 50000000}'},
+            {},
+            {b'2020-01-16 00:00:04': b'{"Grundlast-1": 49000000}',
+             b'2020-01-16 00:00:01': b'{"Grundlast-1": 48000000}'}]
+        result = get_disaggregation_days(redis_client, self.test_user.meter_id,
+                                         ['2020-01-15', '2020-01-16', '2020-01-17'])
+        # Check that each day's hash is fetched in one pipeline
+        redis_client.pipeline.return_value.hgetall.assert_any_call(
+            'disaggregation_' + self.test_user.meter_id + '_2020-01-15')
+        redis_client.pipeline.return_value.execute.assert_called_once()
+        # Check result values
+        self.assertEqual(list(result.items()), [
+            ('2020-01-15 10:01:10', {'Grundlast-1': 50000000}),
+            ('2020-01-16 00:00:01', {'Grundlast-1': 48000000}),
+            ('2020-01-16 00:00:04', {'Grundlast-1': 49000000})])
+
+    def test_update_day_readings(self):
+        """ Unit tests for function update_day_readings(). """
+        redis_client = mock.MagicMock()
+        update_day_readings(redis_client, self.test_user.meter_id, 1579082400.0,
+                            {'energy': 100})
+        # Check that the day's keys are updated by the script registered once
+        redis_client.register_script.assert_not_called()
+        redis_client.evalsha.assert_called_once_with(
+            UPDATE_DAY_READINGS.sha, 4,
+            'agg:' + self.test_user.meter_id + '_2020-01-15_first',
+            'agg:' + self.test_user.meter_id + '_2020-01-15_last',
+            self.test_user.meter_id + '_2020-01-15_first',
+            self.test_user.meter_id + '_2020-01-15_last',
+            '{"type": "reading", "values": {"energy": 100}, '
+            '"time": "2020-01-15 10:00:00"}', '2020-01-15 10:00:00', 1579082400.0)
+        # Check that a pipeline writer buffers the executions of the same script
+        writer = PipelineWriter(self.redis_client, 10)
+        for timestamp in 1579082400.0, 1579082460.0:
+            update_day_readings(writer, self.test_user.meter_id, timestamp, {'energy': 100})
+        self.assertEqual(writer.pipeline.scripts, {UPDATE_DAY_READINGS})
+        self.assertEqual(writer.buffered_commands, 2)
+
+    def test_calc_rollup(self):
+        """ Unit tests for functions calc_rollup() and merge_rollups(). """
+        entries = [(datetime(2020, 1, 15, 10, 0), {'values': {'energy': 100, 'power': 10}}),
+                   (datetime(2020, 1, 15, 10, 1), {'values': {'energy': 150, 'power': 30}})]
+        rollup = calc_rollup(entries)
+        # Check result values
+        self.assertEqual(rollup, dict(first_time=1579082400, first_energy=100,
+                                      last_time=1579082460, last_energy=150,
+                                      min_power=10, max_power=30, avg_power=20, count=2))
+        self.assertIsNone(calc_rollup([]))
+        merged = merge_rollups(rollup, calc_rollup(
+            [(datetime(2020, 1, 15, 9, 59), {'values': {'energy': 90, 'power': 50}})]))
+        self.assertEqual(merged, dict(first_time=1579082340, first_energy=90,
+                                      last_time=1579082460, last_energy=150,
+                                      min_power=10, max_power=50, avg_power=30, count=3))
+        self.assertEqual(merge_rollups(None, rollup), rollup)
+
+    def test_calc_day_bounds(self):
+        """ Unit tests for function calc_day_bounds(). """
+        begin, end = calc_day_bounds('2020-01-15')
+        # Check result values
+        self.assertEqual(begin, 1579046400)
+        self.assertEqual(end, 1579046400 + 24 * 60 * 60)
+
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.zrangebyscore', return_value=SORTED_KEYS_DAY_ONE)
+    def test_get_reading_keys_date(self, zrangebyscore):
+        """ Unit tests for function get_reading_keys_date(). """
+        date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
+        result = get_reading_keys_date(self.redis_client, self.test_user.meter_id, date)
+        begin, end = calc_day_bounds(date)
+        # Check that the time index is queried for the whole day only
+        zrangebyscore.assert_called_once_with('reading_index_' + self.test_user.meter_id,
+                                              begin, '(' + str(end))
+        # Check result values
+        self.assertEqual(result, [key.decode('utf-8') for key in SORTED_KEYS_DAY_ONE])
+
+    def test_pipeline_writer(self):
+        """ Unit tests for class PipelineWriter. """
+        redis_client = mock.MagicMock()
+        redis_client.pipeline.return_value.execute.return_value = []
+        writer = PipelineWriter(redis_client, 2)
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        # Check that nothing is flushed before the buffer is full
+        redis_client.pipeline.return_value.execute.assert_not_called()
+        writer.zadd('reading_index_' + self.test_user.meter_id, {KEY1_DAY_ONE: 0})
+        writer.set(KEY_LAST, FIRST_METER_READING_DATE)
+        writer.flush()
+        # Check that the pipeline is not transactional and flushed twice
+        redis_client.pipeline.assert_called_once_with(transaction=False)
+        self.assertEqual(redis_client.pipeline.return_value.execute.call_count, 2)
+        self.assertEqual(writer.flushed_commands, 3)
+        self.assertEqual(len(writer.flush_durations), 2)
+
+        # Check that progress is recorded after the commands buffered before
+        # it succeeded and dropped if one of its commands failed
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.hset_progress('high_water_marks', self.test_user.meter_id, 1)
+        writer.flush()
+        redis_client.pipeline.return_value.hset.assert_called_once_with(
+            'high_water_marks', self.test_user.meter_id, 1)
+        redis_client.pipeline.return_value.execute.return_value = [redis.RedisError()]
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.hset_progress('high_water_marks', self.test_user.meter_id, 2)
+        writer.flush()
+        redis_client.pipeline.return_value.hset.assert_called_once()
+
+        # Check that a failed write does not affect the progress of the
+        # following flushes
+        redis_client.pipeline.return_value.execute.return_value = []
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.hset_progress('high_water_marks', self.test_user.meter_id, 3)
+        writer.flush()
+        redis_client.pipeline.return_value.hset.assert_called_with(
+            'high_water_marks', self.test_user.meter_id, 3)
+
+    def test_pipeline_writer_progress(self):
+        """ Unit tests for the progress commands of class PipelineWriter with
+        two meters of which only one write fails. """
+        redis_client = mock.MagicMock()
+        pipeline = redis_client.pipeline.return_value
+        writer = PipelineWriter(redis_client, 3)
+        # The first meter's commands are flushed before its progress is buffered
+        pipeline.execute.return_value = [True, redis.RedisError(), True]
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.set(KEY1_DAY_ONE, FIRST_METER_READING_DATE)
+        writer.hset_progress('high_water_marks', 'meter1', 1)
+        pipeline.execute.return_value = [True, True]
+        writer.set(KEY_LAST, FIRST_METER_READING_DATE)
+        writer.hset_progress('high_water_marks', 'meter2', 2)
+        writer.flush()
+        # Check that only the progress of the meter whose write failed is
+        # dropped
+        pipeline.hset.assert_called_once_with('high_water_marks', 'meter2', 2)
+
+    def test_remove_disaggregations(self):
+        """ Unit tests for function remove_disaggregations(). """
+        redis_client = mock.MagicMock()
+        meter_id = self.test_user.meter_id
+        redis_client.scan_iter.side_effect = [
+            [b'disaggregation_' + meter_id.encode() + b'_2020-01-14',
+             b'disaggregation_' + meter_id.encode() + b'_2020-01-15',
+             b'disaggregation_high_water_marks'],
+            [b'd:' + meter_id.encode() + b'_2020-01-14 23:59:59',
+             b'd:' + meter_id.encode() + b'_2020-01-15 00:00:01']]
+        result = remove_disaggregations(redis_client, 1579046400)
+        # Check that only the keys of the days before the cutoff are removed
+        self.assertEqual(result, 2)
+        redis_client.delete.assert_called_once_with(
+            b'disaggregation_' + meter_id.encode() + b'_2020-01-14',
+            b'd:' + meter_id.encode() + b'_2020-01-14 23:59:59')
+
+    def test_encode_decode_readings(self):
+        """ Unit tests for functions encode_reading() and decode_readings(). """
+        values = {'power': 27279, 'power3': -27279, 'energyOut': 0, 'power1': 0,
+                  'energy': 2180256872214000, 'power2': -2437}
+        data = encode_reading(1579082404, values) + encode_reading(1579082470, values) +\
+            encode_reading(1579082404, dict(values, power=0))
+        result = decode_readings(data)
+        # Check that the timestamps are sorted and duplicates are replaced
+        self.assertEqual(list(result.keys()), ['2020-01-15 10:00:04', '2020-01-15 10:01:10'])
+        self.assertEqual(result['2020-01-15 10:00:04'], dict(values, power=0))
+        self.assertEqual(result['2020-01-15 10:01:10'], values)
+
+        # Check that missing values and values which are None are left out
+        # and values which are not packed are dropped
+        result = decode_readings(encode_reading(1579082404, dict(
+            energy=2180256872214000, power=None, voltage1=230000)))
+        self.assertEqual(result['2020-01-15 10:00:04'], dict(energy=2180256872214000))
+
+    def test_parse_key_date(self):
+        """ Unit tests for function parse_key_date(). """
+        # Check the fixed-format fast path
+        self.assertEqual(parse_key_date(self.test_user.meter_id, KEY1_DAY_ONE), DATE_KEY1_DAY_ONE)
+        # Check the fallback to the generic parser
+        self.assertEqual(parse_key_date(self.test_user.meter_id,
+                                        self.test_user.meter_id + '_2020-01-15T10:00:04Z'),
+                         datetime(2020, 1, 15, 10, 0, 4, tzinfo=tzutc()))
+        # Check that namespaced keys are parsed the same way
+        self.assertEqual(parse_key_date(self.test_user.meter_id, 'r:' + KEY1_DAY_ONE),
+                         DATE_KEY1_DAY_ONE)
+
+    def test_strip_namespace(self):
+        """ Unit tests for function strip_namespace(). """
+        for key in reading_key(self.test_user.meter_id, '2020-01-15 10:00:04'),\
+                disaggregation_entry_key(self.test_user.meter_id, '2020-01-15 10:00:04'):
+            self.assertEqual(strip_namespace(key),
+                             self.test_user.meter_id + '_2020-01-15 10:00:04')
+        self.assertEqual(strip_namespace(last_reading_key(self.test_user.meter_id)),
+                         self.test_user.meter_id + '_last')
+        self.assertEqual(strip_namespace(KEY1_DAY_ONE), KEY1_DAY_ONE)
+
+    @mock.patch('redis.Redis.get', side_effect=[None, FIRST_METER_READING_DATE])
+    def test_get_namespaced(self, get):
+        """ Unit tests for function get_namespaced(). """
+        result = get_namespaced(self.redis_client, last_reading_key(self.test_user.meter_id))
+        # Check that the key without namespace is read if the namespaced key is missing
+        get.assert_called_with(self.test_user.meter_id + '_last')
+        self.assertEqual(result, FIRST_METER_READING_DATE)
+
+
+class MeterReadingDateTestCase(RedisTestCase):
+    """ Unit tests for the redis helpers methods which look up the first and
+    last reading of a day. """
+
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', return_value=FIRST_METER_READING_DATE)
     def test_get_first_meter_reading_date(self, get):
@@ -74,12 +331,17 @@ class RedisHelpersTestCase(BuzznTestCase):
         self.assertEqual(result, FIRST_ENERGY_DATE)
 
     # pylint: disable=unused-argument
-    @mock.patch('redis.Redis.get', side_effect=USER_CONSUMPTION_DAY_ONE_ITERATION_FIRST)
-    @mock.patch('redis.Redis.scan_iter', return_value=SORTED_KEYS_DAY_ONE)
-    def test_get_first_meter_reading_date_no_first_key(self, get, scan_iter):
+    # The first key is missing with and without namespace
+    @mock.patch('redis.Redis.get', side_effect=[None] + USER_CONSUMPTION_DAY_ONE_ITERATION_FIRST)
+    @mock.patch('redis.Redis.zrangebyscore', return_value=SORTED_KEYS_DAY_ONE)
+    @mock.patch('redis.Redis.set')
+    def test_get_first_meter_reading_date_no_first_key(self, set_key, zrangebyscore, get):
         """ Unit tests for function get_first_meter_reading_date() if iteration is needed. """
         date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
         result = get_first_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
+        # Check that the first reading found is stored under the namespaced key
+        self.assertEqual(set_key.call_args[0][0],
+                         'agg:' + self.test_user.meter_id + '_' + date + '_first')
         # Check result types
         self.assertIsInstance(result, (int, type(None)))
         # Check result values
@@ -87,14 +349,27 @@ class RedisHelpersTestCase(BuzznTestCase):
 
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', side_effect=USER_CONSUMPTION_DAY_ONE_ITERATION_FIRST)
-    @mock.patch('redis.Redis.scan_iter', return_value=EMPTY_RESPONSE_ARRAY)
-    def test_get_first_meter_reading_date_no_keys(self, get, scan_iter):
+    @mock.patch('redis.Redis.zrangebyscore', return_value=EMPTY_RESPONSE_ARRAY)
+    @mock.patch('redis.Redis.hget', return_value=None)
+    def test_get_first_meter_reading_date_no_keys(self, hget, zrangebyscore, get):
         """ Unit tests for function get_first_meter_reading_date() if no keys are available. """
         date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
         result = get_first_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
         # Check result values
         self.assertEqual(result, None)
 
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.get', return_value=None)
+    @mock.patch('redis.Redis.zrangebyscore', return_value=EMPTY_RESPONSE_ARRAY)
+    @mock.patch('redis.Redis.hget', return_value=b'{"first_energy": 1000, "last_energy": 2000}')
+    def test_get_first_meter_reading_date_compacted(self, hget, zrangebyscore, get):
+        """ Unit tests for function get_first_meter_reading_date() if the readings
+        were compacted. """
+        date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
+        result = get_first_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
+        # Check result values
+        self.assertEqual(result, 1000)
+
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', return_value=LAST_METER_READING_DATE)
     def test_get_last_meter_reading_date(self, get):
@@ -107,12 +382,17 @@ class RedisHelpersTestCase(BuzznTestCase):
         self.assertEqual(result, LAST_ENERGY_DATE)
 
     # pylint: disable=unused-argument
-    @mock.patch('redis.Redis.get', side_effect=USER_CONSUMPTION_DAY_ONE_ITERATION_LAST)
-    @mock.patch('redis.Redis.scan_iter', return_value=SORTED_KEYS_DAY_ONE)
-    def test_get_last_meter_reading_date_no_last_key(self, get, scan_iter):
+    # The last key is missing with and without namespace
+    @mock.patch('redis.Redis.get', side_effect=[None] + USER_CONSUMPTION_DAY_ONE_ITERATION_LAST)
+    @mock.patch('redis.Redis.zrangebyscore', return_value=SORTED_KEYS_DAY_ONE)
+    @mock.patch('redis.Redis.set')
+    def test_get_last_meter_reading_date_no_last_key(self, set_key, zrangebyscore, get):
         """ Unit tests for function get_last_meter_reading_date() if iteration is needed. """
         date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
         result = get_last_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
+        # Check that the last reading found is stored under the namespaced key
+        self.assertEqual(set_key.call_args[0][0],
+                         'agg:' + self.test_user.meter_id + '_' + date + '_last')
         # Check result types
         self.assertIsInstance(result, (int, type(None)))
         # Check result values
@@ -120,10 +400,23 @@ class RedisHelpersTestCase(BuzznTestCase):
 
     # pylint: disable=unused-argument
     @mock.patch('redis.Redis.get', side_effect=USER_CONSUMPTION_DAY_ONE_ITERATION_LAST)
-    @mock.patch('redis.Redis.scan_iter', return_value=EMPTY_RESPONSE_ARRAY)
-    def test_get_last_meter_reading_date_no_keys(self, get, scan_iter):
+    @mock.patch('redis.Redis.zrangebyscore', return_value=EMPTY_RESPONSE_ARRAY)
+    @mock.patch('redis.Redis.hget', return_value=None)
+    def test_get_last_meter_reading_date_no_keys(self, hget, zrangebyscore, get):
         """ Unit tests for function get_last_meter_reading_date() if no keys are available. """
         date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
         result = get_last_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
         # Check result values
         self.assertEqual(result, None)
+
+    # pylint: disable=unused-argument
+    @mock.patch('redis.Redis.get', return_value=None)
+    @mock.patch('redis.Redis.zrangebyscore', return_value=EMPTY_RESPONSE_ARRAY)
+    @mock.patch('redis.Redis.hget', return_value=b'{"first_energy": 1000, "last_energy": 2000}')
+    def test_get_last_meter_reading_date_compacted(self, hget, zrangebyscore, get):
+        """ Unit tests for function get_last_meter_reading_date() if the readings
+        were compacted. """
+        date = datetime.strftime(DAY_ONE.date(), '%Y-%m-%d')
+        result = get_last_meter_reading_date(self.redis_client, self.test_user.meter_id, date)
+        # Check result values
+        self.assertEqual(result, 2000)
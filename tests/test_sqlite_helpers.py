@@ -1,7 +1,11 @@
+from datetime import datetime
+from unittest import mock
 from models.user import User, GenderType
 from models.group import Group
+from models.per_capita_consumption import PerCapitaConsumption
 from util.database import db
-from util.sqlite_helpers import get_all_meter_ids, get_all_users, get_all_user_meter_ids
+from util.sqlite_helpers import get_all_meter_ids, get_all_users, get_all_user_meter_ids,\
+    write_per_capita_consumption
 from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import ALL_METER_IDS, ALL_USER_METER_IDS
 
@@ -72,3 +76,55 @@ class TestSqliteHelpers(BuzznTestCase):
 
         # Check return values
         self.assertEqual(result, ALL_USER_METER_IDS)
+
+    @mock.patch('redis.client.Pipeline.execute', return_value=[[
+        b'{"type": "reading", "values": {"energy": 300000000000}}',
+        b'{"type": "reading", "values": {"energy": 100000000000}}', None, None]])
+    def test_write_per_capita_consumption(self, execute):
+        """ Unit tests for function write_per_capita_consumption(). """
+
+        self.test_user.inhabitants = 2
+        self.test_user2.inhabitants = 1
+        db.session.add(PerCapitaConsumption(datetime(2020, 1, 14), ALL_USER_METER_IDS[0],
+                                            5.0, 10.0, 2, 2.5, 5.0, 1, 5.0, 1825))
+        db.session.add(PerCapitaConsumption(datetime(2020, 1, 15), ALL_USER_METER_IDS[2],
+                                            1.0, 1.0, 1, 1.0, 1.0, 1, 1.0, 365))
+        db.session.commit()
+        write_per_capita_consumption(datetime(2020, 1, 15), db.session)
+
+        # Check that the first and last readings are fetched in one pipeline
+        execute.assert_called_once()
+
+        # Check result values
+        rows = {row.meter_id: row for row in db.session.query(PerCapitaConsumption).filter_by(
+            date=datetime(2020, 1, 15)).all()}
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].consumption, 20.0)
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].consumption_cumulated, 30.0)
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].per_capita_consumption_cumulated, 15.0)
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].days, 2)
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].moving_average, 7.5)
+        self.assertEqual(rows[ALL_USER_METER_IDS[1]].days, 0)
+        self.assertEqual(rows[ALL_USER_METER_IDS[2]].moving_average_annualized, 365)
+
+    @mock.patch('redis.client.Pipeline.execute', return_value=[[
+        b'{"type": "reading", "values": {"energy": 300000000000}}',
+        b'{"type": "reading", "values": {"energy": 100000000000}}', None, None]])
+    def test_write_per_capita_consumption_no_inhabitants(self, _execute):
+        """ Unit tests for function write_per_capita_consumption() with a user
+        without inhabitants. """
+
+        self.test_user.inhabitants = 2
+        self.test_user2.inhabitants = 0
+        self.test_user3.inhabitants = 1
+        db.session.add(PerCapitaConsumption(datetime(2020, 1, 14), ALL_USER_METER_IDS[0],
+                                            5.0, 10.0, 2, 2.5, 5.0, 1, 5.0, 1825))
+        db.session.commit()
+        write_per_capita_consumption(datetime(2020, 1, 15), db.session)
+
+        # Check that only the user without inhabitants is skipped
+        rows = {row.meter_id: row for row in db.session.query(PerCapitaConsumption).filter_by(
+            date=datetime(2020, 1, 15)).all()}
+        self.assertEqual(set(rows), {ALL_USER_METER_IDS[0], ALL_USER_METER_IDS[2]})
+        self.assertEqual(rows[ALL_USER_METER_IDS[0]].consumption, 20.0)
+        self.assertEqual(rows[ALL_USER_METER_IDS[2]].days, 0)
@@ -1,4 +1,7 @@
+from datetime import datetime
 import json
+import threading
+from unittest import mock
 from discovergy.discovergy import Discovergy
 import redis
 from models.user import User, GenderType, StateType
@@ -6,7 +9,10 @@ from models.group import Group
 from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import READING, READING_NEGATIVE_POWER
 from util.database import db
-from util.task import check_and_nullify_power_value, client_name, Task
+from util.redis_helpers import METER_UPDATES_CHANNEL, reading_key
+from util.task import check_and_nullify_power_value, client_name, Task, Scheduler,\
+    job_runtimes_key, job_overruns_key, calc_quarter_hour_end, lookup_reading,\
+    lookup_disaggregation, remove_compacted_day_readings
 
 
 class TaskTestCase(BuzznTestCase):
@@ -55,6 +61,230 @@ class TaskTestCase(BuzznTestCase):
         self.assertEqual(result['values']['power'], READING['values']['power'])
         self.assertEqual(result_adjusted['values']['power'], 0)
 
+    def test_calc_fetch_starts(self):
+        """ Unit tests for function Task.calc_fetch_starts(). """
+
+        meter_ids = [self.test_user.meter_id, self.test_user2.meter_id,
+                     self.test_user3.meter_id]
+        backfill_start = 1577836800000
+        high_water_mark = 1579046400000
+        self.task.redis_client = mock.MagicMock()
+        self.task.redis_client.hgetall.return_value = {
+            self.test_user.meter_id.encode('utf-8'): str(high_water_mark).encode('utf-8'),
+            self.test_user2.meter_id.encode('utf-8'): str(high_water_mark).encode('utf-8')}
+        self.task.redis_client.pipeline.return_value.execute.return_value = [1, 0]
+
+        result = self.task.calc_fetch_starts(meter_ids, 'high_water_marks', backfill_start,
+                                             lookup_reading)
+
+        # Check that only the entries at the high-water marks are looked up,
+        # with or without namespace
+        self.task.redis_client.pipeline.return_value.exists.assert_any_call(
+            'r:' + self.test_user.meter_id + '_2020-01-15 00:00:00',
+            self.test_user.meter_id + '_2020-01-15 00:00:00')
+        self.assertEqual(self.task.redis_client.pipeline.return_value.exists.call_count, 2)
+
+        # Check that existing meters are fetched incrementally and new meters
+        # or meters with a gap are backfilled
+        self.assertEqual(result, {self.test_user.meter_id: high_water_mark,
+                                  self.test_user2.meter_id: backfill_start,
+                                  self.test_user3.meter_id: backfill_start})
+
+        # Check that disaggregation values are looked up in the hash of their day
+        self.task.calc_fetch_starts(meter_ids, 'high_water_marks', backfill_start,
+                                    lookup_disaggregation)
+        self.task.redis_client.pipeline.return_value.hexists.assert_any_call(
+            'disaggregation_' + self.test_user.meter_id + '_2020-01-15', '2020-01-15 00:00:00')
+
+    @mock.patch('util.task.fetch_timeout', 0.1)
+    def test_fetch_concurrently(self):
+        """ Unit tests for function Task.fetch_concurrently(). """
+
+        stuck = threading.Event()
+
+        def fetch(meter_id):
+            if meter_id == self.test_user2.meter_id:
+                raise ValueError('Fetch failed')
+            if meter_id == self.test_user3.meter_id:
+                stuck.wait(5)
+            return meter_id
+
+        executor = self.task.fetch_executor
+        result = list(self.task.fetch_concurrently(
+            'job', [self.test_user.meter_id, self.test_user2.meter_id,
+                    self.test_user3.meter_id], fetch))
+        stuck.set()
+
+        # Check that failing and stuck meters are skipped
+        self.assertEqual(result, [(self.test_user.meter_id, self.test_user.meter_id)])
+        self.assertEqual(self.task.fetch_stats['job'],
+                         dict(meters=3, fetched=1, errors=1, timeouts=1))
+
+        # Check that the pool is reused by the following fetches
+        list(self.task.fetch_concurrently('job', [self.test_user.meter_id], fetch))
+        self.assertIs(self.task.fetch_executor, executor)
+
+    @mock.patch('util.task.calc_term_boundaries', return_value=(1577833200000, 1579042800000))
+    def test_calc_missing_term_boundaries(self, _calc_term_boundaries):
+        """ Unit tests for function Task.calc_missing_term_boundaries(). """
+
+        self.task.redis_client = mock.MagicMock()
+        pipeline = self.task.redis_client.pipeline.return_value
+        pipeline.execute.return_value = [1, False, 0, False, 0, True, 0, False]
+
+        result = self.task.calc_missing_term_boundaries([self.test_user.meter_id,
+                                                         self.test_user2.meter_id])
+
+        # Check that the last hourly reading of the boundary day is looked up
+        pipeline.zcount.assert_any_call('reading_index_' + self.test_user.meter_id,
+                                        1577919600, 1577923199)
+
+        # Check that only the boundaries without hourly readings or rollups
+        # are missing
+        self.assertEqual(result, {self.test_user.meter_id: [(1579042800000, 1579132799000)],
+                                  self.test_user2.meter_id: [(1579042800000, 1579132799000)]})
+
+    def test_calc_quarter_hour_end(self):
+        """ Unit tests for function calc_quarter_hour_end(). """
+
+        # Check that a quarter-hour includes its end, but not its begin
+        self.assertEqual(calc_quarter_hour_end(1579082400), datetime(2020, 1, 15, 10, 0))
+        self.assertEqual(calc_quarter_hour_end(1579082401), datetime(2020, 1, 15, 10, 15))
+        self.assertEqual(calc_quarter_hour_end(1579083300), datetime(2020, 1, 15, 10, 15))
+
+    def test_calculate_average_power(self):
+        """ Unit tests for function Task.calculate_average_power(). """
+
+        self.task.redis_client = mock.MagicMock()
+        self.task.redis_client.hmget.return_value = [b'81000.5', b'3']
+        self.task.calculate_average_power(db.session, datetime(2020, 1, 15, 10, 15))
+
+        # Check that the accumulated values are read instead of the readings
+        self.task.redis_client.scan_iter.assert_not_called()
+        self.task.redis_client.keys.assert_not_called()
+        self.task.redis_client.hmget.assert_any_call(
+            'power_accumulator_' + self.test_user.meter_id + '_2020-01-15',
+            '2020-01-15 10:15:00:sum', '2020-01-15 10:15:00:count')
+
+        # Check that the average is added to the day's hash
+        self.task.redis_client.pipeline.return_value.hset.assert_any_call(
+            'average_power_' + self.test_user.meter_id + '_2020-01-15',
+            '2020-01-15 10:15:00', 27000.166666666668)
+
+        # Check that the group consumption history cached before is dropped
+        self.task.redis_client.delete.assert_called_once_with(
+            'group_consumption_history_1_2020-01-15_41')
+
+    def test_write_last_readings(self):
+        """ Unit tests for function Task.write_last_readings(). """
+
+        self.task.d = mock.MagicMock()
+        self.task.redis_client = mock.MagicMock()
+        self.task.redis_client.zadd.side_effect = [1, 0]
+        with mock.patch.object(self.task, 'fetch_concurrently', return_value=iter([
+                (self.test_user.meter_id, READING), (self.test_user2.meter_id, READING)])):
+            self.task.write_last_readings(db.session)
+
+        # Check that the first and last readings of the day are updated
+        self.assertEqual(self.task.redis_client.evalsha.call_count, 2)
+
+        # Check that only the meter with a new reading is published
+        self.task.redis_client.publish.assert_called_once_with(
+            METER_UPDATES_CHANNEL, self.test_user.meter_id)
+
+    def test_write_last_disaggregations(self):
+        """ Unit tests for function Task.write_last_disaggregations(). """
+
+        self.task.d = mock.MagicMock()
+        self.task.redis_client = mock.MagicMock()
+        disaggregation = {'1579082470000': {'Grundlast-1': 50000000},
+                          '1579082464000': {'Grundlast-1': 49000000}}
+        with mock.patch.object(self.task, 'fetch_concurrently', return_value=iter([
+                (self.test_user.meter_id, disaggregation)])):
+            self.task.write_last_disaggregations(db.session)
+
+        # Check that the last value is added to the hash of its day instead
+        # of being stored under a key of its own
+        self.task.redis_client.set.assert_called_once()
+        self.task.redis_client.hset.assert_called_once_with(
+            'disaggregation_' + self.test_user.meter_id + '_2020-01-15', '2020-01-15 10:01:10',
+            json.dumps({'Grundlast-1': 50000000}))
+
+    def test_compact_meter_readings(self):
+        """ Unit tests for function Task.compact_meter_readings(). """
+
+        self.task.redis_client = mock.MagicMock()
+        meter_id = self.test_user.meter_id
+        keys = [reading_key(meter_id, '2020-01-15 10:00:00'),
+                reading_key(meter_id, '2020-01-15 11:00:00')]
+        self.task.redis_client.zrangebyscore.side_effect = [
+            [(keys[0].encode('utf-8'), 1579082400.0)], [key.encode('utf-8') for key in keys], []]
+        self.task.redis_client.mget.return_value = [
+            json.dumps(dict(type='reading', values=dict(energy=100, power=10))),
+            json.dumps(dict(type='reading', values=dict(energy=200, power=30)))]
+        pipeline = self.task.redis_client.pipeline.return_value
+        pipeline.execute.side_effect = [[{}, None], []]
+        self.assertEqual(self.task.compact_meter_readings(meter_id, 1579132800), 2)
+
+        # Check that the rollups are written and the readings removed
+        pipeline.hset.assert_any_call('agg:' + meter_id + '_daily', '2020-01-15', json.dumps(
+            dict(first_time=1579082400, first_energy=100, last_time=1579086000,
+                 last_energy=200, min_power=10, max_power=30, avg_power=20.0, count=2)))
+        self.assertEqual(set(pipeline.hset.call_args_list[0][1]['mapping']),
+                         {'2020-01-15 10:00:00', '2020-01-15 11:00:00'})
+        pipeline.delete.assert_any_call(*keys)
+        pipeline.zremrangebyscore.assert_called_once_with(
+            'reading_index_' + meter_id, 1579046400, '(1579132800')
+
+        # Check that the day's first and last readings and disaggregation
+        # values are removed
+        pipeline.delete.assert_any_call('agg:' + meter_id + '_2020-01-15_first',
+                                        'agg:' + meter_id + '_2020-01-15_last',
+                                        meter_id + '_2020-01-15_first',
+                                        meter_id + '_2020-01-15_last')
+        pipeline.delete.assert_any_call('packed_readings_' + meter_id + '_2020-01-15',
+                                        'power_accumulator_' + meter_id + '_2020-01-15',
+                                        'disaggregation_' + meter_id + '_2020-01-15')
+
+    def test_remove_compacted_day_readings(self):
+        """ Unit tests for function remove_compacted_day_readings(). """
+
+        redis_client = mock.MagicMock()
+        meter_id = self.test_user.meter_id
+        redis_client.scan_iter.side_effect = [
+            [('agg:' + meter_id + '_2020-01-14_first').encode('utf-8'),
+             (meter_id + '_2020-01-13_first').encode('utf-8'),
+             ('agg:' + meter_id + '_2020-01-15_first').encode('utf-8')],
+            [('agg:' + meter_id + '_2020-01-14_last').encode('utf-8'),
+             ('agg:' + meter_id + '_last').encode('utf-8')]]
+        redis_client.pipeline.return_value.execute.side_effect = [[True, False, True]]
+        self.assertEqual(remove_compacted_day_readings(redis_client, 1579046400), 2)
+
+        # Check that only the keys of the compacted days before the cutoff are
+        # removed
+        redis_client.pipeline.return_value.hexists.assert_any_call(
+            'agg:' + meter_id + '_daily', '2020-01-13')
+        redis_client.delete.assert_called_once_with(
+            ('agg:' + meter_id + '_2020-01-14_first').encode('utf-8'),
+            ('agg:' + meter_id + '_2020-01-14_last').encode('utf-8'))
+
+    @mock.patch('util.task.create_session', return_value=db.session)
+    @mock.patch('util.task.remove_compacted_day_readings', return_value=0)
+    @mock.patch('util.task.remove_disaggregations', return_value=0)
+    def test_compact_readings(self, remove_disaggregations, remove_day_readings,
+                              _create_session):
+        """ Unit tests for function Task.compact_readings(). """
+
+        with mock.patch.object(self.task, 'compact_meter_readings', return_value=0) as \
+                compact_meter_readings, mock.patch('util.task.reading_retention_days', 90):
+            self.task.compact_readings(1579082400)
+
+        # Check that the readings of all meters are compacted and the
+        # disaggregation values removed before the same cutoff
+        compact_meter_readings.assert_any_call(self.test_user.meter_id, 1571270400)
+        remove_disaggregations.assert_called_once_with(self.task.redis_client, 1571270400)
+        remove_day_readings.assert_called_once_with(self.task.redis_client, 1571270400)
+
     def check_init(self):
         """ Unit tests for function Task.__init__(). """
 
@@ -62,3 +292,81 @@ class TaskTestCase(BuzznTestCase):
         self.assertIsInstance(self.task.d, Discovergy)
         self.assertIsInstance(self.task.redis_client, redis.Redis)
         self.assertEqual(self.task.d.client_name, client_name)
+
+
+class SchedulerTestCase(BuzznTestCase):
+    """ Unit tests for class Scheduler. """
+
+    @mock.patch('util.task.stdlib_time')
+    def test_run_job(self, stdlib_time):
+        """ Unit tests for function Scheduler.run_job(). """
+
+        stdlib_time.time.side_effect = [1000.0, 1000.0, 1010.0]
+        redis_client = mock.MagicMock()
+        function = mock.MagicMock()
+        scheduler = Scheduler(redis_client)
+        scheduler.add_job('job', 60, function)
+        job = scheduler.jobs[0]
+
+        # Check that the first deadline is aligned to the period
+        self.assertEqual(job['next_run'], 1020)
+
+        scheduler.run_job(job)
+
+        # Check that the job is called with its deadline and its runtime is exported
+        function.assert_called_once_with(1020)
+        redis_client.hset.assert_called_once_with(job_runtimes_key, 'job', 10.0)
+        self.assertEqual(job['next_run'], 1080)
+        redis_client.hincrby.assert_not_called()
+
+    @mock.patch('util.task.stdlib_time')
+    def test_run_job_overrun(self, stdlib_time):
+        """ Unit tests for function Scheduler.run_job() if the job overruns
+        its period. """
+
+        stdlib_time.time.side_effect = [1020.0, 1020.0, 1150.0]
+        redis_client = mock.MagicMock()
+        scheduler = Scheduler(redis_client)
+        scheduler.add_job('job', 60, mock.MagicMock(), run_immediately=True)
+        job = scheduler.jobs[0]
+        scheduler.run_job(job)
+
+        # Check that the missed deadlines are skipped and the overrun is exported
+        self.assertEqual(job['next_run'], 1200)
+        redis_client.hincrby.assert_called_once_with(job_overruns_key, 'job', 2)
+
+    @mock.patch('util.task.stdlib_time')
+    def test_run_job_immediately(self, stdlib_time):
+        """ Unit tests for function Scheduler.run_job() if the job runs on
+        start. """
+
+        stdlib_time.time.side_effect = [1030.0, 1030.0, 1040.0]
+        scheduler = Scheduler(mock.MagicMock())
+        function = mock.MagicMock()
+        scheduler.add_job('job', 60, function, run_immediately=True)
+        job = scheduler.jobs[0]
+        scheduler.run_job(job)
+
+        # Check that the next deadline is aligned to the period again
+        function.assert_called_once_with(1030.0)
+        self.assertEqual(job['next_run'], 1080)
+
+    @mock.patch('util.task.stdlib_time')
+    def test_run_job_catch_up(self, stdlib_time):
+        """ Unit tests for function Scheduler.run_job() if a job which
+        catches up missed its deadlines. """
+
+        stdlib_time.time.side_effect = [1000.0, 1150.0, 1150.0, 1150.0, 1151.0]
+        redis_client = mock.MagicMock()
+        function = mock.MagicMock()
+        scheduler = Scheduler(redis_client)
+        scheduler.add_job('job', 60, function, catch_up=True)
+        job = scheduler.jobs[0]
+        scheduler.run_job(job)
+
+        # Check that the missed deadlines are replayed one after another
+        self.assertEqual(job['next_run'], 1080)
+        scheduler.run_job(job)
+        self.assertEqual(function.call_args_list, [mock.call(1020), mock.call(1080)])
+        self.assertEqual(job['next_run'], 1140)
+        redis_client.hincrby.assert_not_called()
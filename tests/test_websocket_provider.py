@@ -6,8 +6,8 @@ from tests.buzzn_test_case import BuzznTestCase
 from tests.string_constants import GROUP_LAST_READING, GROUP_MEMBERS, GROUP_PRODUCTION_METER_IDS,\
     GROUPMEMBER1_LAST_READING, GROUPMEMBER1_WEBSOCKET_DATA, MEMBER_WEBSOCKET_DATA, WEBSOCKET_DATA
 from util.database import db
-from util.websocket_provider import WebsocketProvider, get_group_production_meter_ids,\
-    get_group_members
+from util.websocket_provider import WebsocketProvider, get_production_meter_ids_of_group,\
+    get_members_of_group, get_meter_ids_of_group, create_delta
 
 
 class WebsocketProviderTestCase(BuzznTestCase):
@@ -53,7 +53,7 @@ class WebsocketProviderTestCase(BuzznTestCase):
         ws = WebsocketProvider()
         test_user = db.session.query(
             User).filter_by(name='User').first()
-        group_members = get_group_members(test_user.id)
+        group_members = get_members_of_group(test_user.group_id)
 
         data = ws.create_member_data(group_members[0])
 
@@ -68,16 +68,20 @@ class WebsocketProviderTestCase(BuzznTestCase):
     # pylint does not understand the required argument from the @mock.patch decorator
     # pylint: disable=unused-argument
     @mock.patch('flask_socketio.SocketIO')
-    @mock.patch('redis.Redis.get', return_value=GROUP_LAST_READING)
+    @mock.patch('redis.Redis.mget', return_value=[GROUP_LAST_READING] * 10)
     @mock.patch('util.websocket_provider.WebsocketProvider.create_member_data',
                 side_effect=MEMBER_WEBSOCKET_DATA)
-    def test_create_data(self, socketio, get_last_reading, _create_member_data):
-        """ Unit tests for function create_data(). """
+    def test_create_group_data(self, socketio, get_last_readings, _create_member_data):
+        """ Unit tests for function create_group_data(). """
 
         ws = WebsocketProvider()
         test_user = db.session.query(
             User).filter_by(name='User').first()
-        data = ws.create_data(test_user.id)
+        data = ws.create_group_data(test_user.group_id)
+
+        # Check that all last readings are fetched with a single MGET
+        get_last_readings.assert_called_once()
+        self.assertEqual(len(get_last_readings.call_args[0][0]), 10)
 
         # Check return type
         self.assertTrue(isinstance(data, dict))
@@ -92,10 +96,10 @@ class WebsocketProviderTestCase(BuzznTestCase):
                              item2.get('consumption'))
             self.assertEqual(item1.get('power'), item2.get('power'))
 
-    def test_get_group_production_meter_ids(self):
-        """ Unit tests for function get_group_production_meter_ids(). """
+    def test_get_production_meter_ids_of_group(self):
+        """ Unit tests for function get_production_meter_ids_of_group(). """
 
-        result = get_group_production_meter_ids(1)
+        result = get_production_meter_ids_of_group(1)
 
         # Check result values
         self.assertEqual(result, GROUP_PRODUCTION_METER_IDS)
@@ -103,10 +107,10 @@ class WebsocketProviderTestCase(BuzznTestCase):
         # Check result type
         self.assertIsInstance(result, tuple)
 
-    def test_get_group_members(self):
-        """ Unit tests for function get_group_members(). """
+    def test_get_members_of_group(self):
+        """ Unit tests for function get_members_of_group(). """
 
-        result = get_group_members(1)
+        result = get_members_of_group(1)
 
         # Check result types
         self.assertIsInstance(result, list)
@@ -119,3 +123,36 @@ class WebsocketProviderTestCase(BuzznTestCase):
             # Check result values
             self.assertEqual(
                 group_user, GROUP_MEMBERS[result.index(group_user)])
+
+        # Check that a group without members has none
+        self.assertEqual(get_members_of_group(2), [])
+
+    def test_get_meter_ids_of_group(self):
+        """ Unit tests for function get_meter_ids_of_group(). """
+
+        result = get_meter_ids_of_group(1)
+
+        # Check result values
+        self.assertEqual(result, {member.get('meter_id') for member in GROUP_MEMBERS}
+                         | set(GROUP_PRODUCTION_METER_IDS))
+
+    def test_create_delta(self):
+        """ Unit tests for function create_delta(). """
+
+        data = dict(WEBSOCKET_DATA, date=WEBSOCKET_DATA.get('date') + 60000,
+                    group_users=[dict(WEBSOCKET_DATA.get('group_users')[0], power=1000),
+                                 WEBSOCKET_DATA.get('group_users')[1],
+                                 dict(id=4, meter_id='EASYMETER_60404854',
+                                      consumption=1, power=2)])
+
+        result = create_delta(WEBSOCKET_DATA, data)
+
+        # Check that only the changes are included
+        self.assertEqual(result, dict(date=data.get('date'),
+                                      group_users=[dict(id=1, power=1000),
+                                                   data.get('group_users')[2]],
+                                      removed_users=[3]))
+
+        # Check that unchanged data results in the date only
+        self.assertEqual(create_delta(WEBSOCKET_DATA, WEBSOCKET_DATA),
+                         dict(date=WEBSOCKET_DATA.get('date')))
@@ -0,0 +1,149 @@
+from collections import OrderedDict
+import os
+import threading
+import time
+from models.group import Group
+from models.user import User
+from util.database import db
+
+
+# Users and groups change only through the admin, employee and profile routes,
+# which invalidate the affected entries. The time to live bounds how long other
+# processes may serve stale entries.
+cache_ttl = float(os.environ.get('CACHE_TTL', '300'))
+cache_size = int(os.environ.get('CACHE_SIZE', '1024'))
+
+
+class TTLCache:
+    """ A thread-safe in-process cache whose entries expire after a time to
+    live and which evicts the least recently used entry when it is full. """
+
+    def __init__(self, ttl, max_size):
+        """ Create an empty cache.
+        :param float ttl: the time to live of each entry in seconds
+        :param int max_size: the maximum number of entries
+        """
+
+        self.ttl = ttl
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """ Return the cached value for the given key.
+        :param key: the key to look up
+        :returns: the cached value or None if there is no valid entry
+        """
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """ Cache the given value for the given key and evict the least
+        recently used entry if the cache is full.
+        :param key: the key to store the value under
+        :param value: the value to cache
+        """
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, key):
+        """ Remove the entry for the given key if there is one.
+        :param key: the key to remove
+        """
+
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def clear(self):
+        """ Remove all entries. """
+
+        with self.lock:
+            self.entries.clear()
+
+
+user_cache = TTLCache(cache_ttl, cache_size)
+group_cache = TTLCache(cache_ttl, cache_size)
+
+
+def get_user_parameters(user_id):
+    """ Get the meter id, group id and inhabitants of the given user from the
+    cache or from the SQLite database.
+    :param int user_id: the user's id
+    :returns: the user's parameters or None if there is no such user
+    :rtype: dict or type(None)
+    """
+
+    user_id = int(user_id)
+    parameters = user_cache.get(user_id)
+    if parameters is None:
+        user = db.session.query(User).filter_by(id=user_id).first()
+        if user is None:
+            return None
+        parameters = dict(meter_id=user.meter_id, group_id=user.group_id,
+                          inhabitants=user.inhabitants)
+        user_cache.set(user_id, parameters)
+
+    return dict(parameters)
+
+
+def get_group_parameters(group_id):
+    """ Get the meter ids and the members' ids, meter ids and inhabitants of
+    the given group from the cache or from the SQLite database.
+    :param int group_id: the group's id
+    :returns: the group's parameters or None if there is no such group
+    :rtype: dict or type(None)
+    """
+
+    group_id = int(group_id)
+    parameters = group_cache.get(group_id)
+    if parameters is None:
+        group = db.session.query(Group).filter_by(id=group_id).first()
+        if group is None:
+            return None
+        members = [dict(id=user.id, meter_id=user.meter_id, inhabitants=user.inhabitants)
+                   for user in db.session.query(User).filter_by(group_id=group_id).all()]
+        parameters = dict(group_meter_id=group.group_meter_id,
+                          group_production_meter_id_first=group.group_production_meter_id_first,
+                          group_production_meter_id_second=group.group_production_meter_id_second,
+                          members=members)
+        group_cache.set(group_id, parameters)
+
+    return dict(parameters, members=[dict(member) for member in parameters.get('members')])
+
+
+def invalidate_user(user_id):
+    """ Remove the given user from the cache.
+    :param int user_id: the user's id
+    """
+
+    if user_id is not None:
+        user_cache.invalidate(int(user_id))
+
+
+def invalidate_group(group_id):
+    """ Remove the given group and its member list from the cache.
+    :param int group_id: the group's id
+    """
+
+    if group_id is not None:
+        group_cache.invalidate(int(group_id))
+
+
+def clear_caches():
+    """ Remove all users and groups from the cache. """
+
+    user_cache.clear()
+    group_cache.clear()
@@ -1,7 +1,7 @@
 import os
 from datetime import datetime
 import redis
-from util.redis_helpers import get_entry_date
+from util.redis_helpers import get_entry_dates, get_reading_keys
 
 
 redis_host = os.environ['REDIS_HOST']
@@ -19,14 +19,9 @@ def get_readings(meter_id, begin):
     """
 
     result = {}
-    all_keys = sorted([key.decode('utf-8')
-                       for key in redis_client.scan_iter(meter_id + '*')])
-    for key in all_keys:
-
-        reading_date, data = get_entry_date(redis_client, meter_id, key, 'reading')
-
-        if reading_date is None or data is None:
-            continue
+    for reading_date, data in get_entry_dates(redis_client, meter_id,
+                                              get_reading_keys(redis_client, meter_id),
+                                              'reading'):
 
         reading_timestamp = reading_date.timestamp()
         if reading_timestamp >= begin:
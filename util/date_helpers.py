@@ -110,3 +110,13 @@ def calc_two_days_back():
     # round it to have no decimal places to match the timestamp format required
     # by the discovergy API
     return round((datetime.utcnow() - timedelta(hours=48)).timestamp() * 1000)
+
+
+def calc_quarter_hour_index(dt):
+    """ Calculate the index of the quarter-hour of the day the given datetime
+    falls into, from 0 for 00:00 to 95 for 23:45.
+    :param datetime dt: the datetime to get the index of
+    :rtype: int
+    """
+
+    return (dt.hour * 60 + dt.minute) // 15
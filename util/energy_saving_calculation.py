@@ -1,9 +1,12 @@
 from datetime import datetime, timedelta
+from functools import lru_cache
 import os
 import logging.config
+import numpy as np
 import redis
 from util.error import exception_message
 from util.database import get_engine
+from util.meter_reading_dates import get_last_meter_reading_dates
 from util.redis_helpers import get_last_meter_reading_date
 
 
@@ -14,6 +17,99 @@ redis_db = os.environ['REDIS_DB']
 redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
 
 
+class LoadProfileIndex:
+    """ The standard load profile as an array of quarter-hour energies with
+    their cumulative sums, so that the energy of any date range is the
+    difference of two cumulative sums. """
+
+    def __init__(self, rows):
+        """ Create the index.
+        :param list rows: the load profile's dates in the format '%Y-%m-%d'
+        and energies, sorted by date and time
+        """
+
+        self.dates = np.array([row[0] for row in rows], dtype='datetime64[D]')
+        energies = np.array([row[1] or 0 for row in rows], dtype=np.float64)
+        self.cumulative_energies = np.concatenate(([0.0], np.cumsum(energies)))
+
+    def calc_energy(self, begin, end):
+        """ Return the sum of the energies from the begin to the end date,
+        both inclusive.
+        :param datetime.date begin: the first date
+        :param datetime.date end: the last date
+        :returns: the sum or None if there are no energies in the range
+        :rtype: float or type(None)
+        """
+
+        first = np.searchsorted(self.dates, np.datetime64(begin, 'D'), side='left')
+        last = np.searchsorted(self.dates, np.datetime64(end, 'D'), side='right')
+        if last <= first:
+            return None
+
+        return float(self.cumulative_energies[last] - self.cumulative_energies[first])
+
+
+@lru_cache(maxsize=1)
+def get_load_profile_version(date):  # pylint: disable=unused-argument
+    """ Return the number of entries and the last date of the standard load
+    profile in the SQLite database, which change whenever it is reimported.
+    The version is cached per day, so the database is queried once a day and
+    a reimported load profile is picked up on the next day.
+    :param datetime.date date: the current date, only used as the cache key
+    :returns: the number of entries and the last date
+    :rtype: tuple
+    """
+
+    engine = get_engine()
+    with engine.connect() as con:
+        return tuple(con.execute('SELECT COUNT(*), MAX(date) FROM loadprofile').fetchone())
+
+
+@lru_cache(maxsize=1)
+def get_load_profile_index(version):
+    """ Load the standard load profile from the SQLite database. The index is
+    cached per version of the load profile, so it is only reloaded after the
+    load profile has changed.
+    :param tuple version: the load profile's version as returned by
+    get_load_profile_version()
+    :rtype: LoadProfileIndex
+    """
+
+    message = 'Loading the standard load profile with {} entries until {}'.format(*version)
+    logger.info(message)
+    engine = get_engine()
+    with engine.connect() as con:
+        rows = con.execute('SELECT date, energy FROM loadprofile ORDER BY date, time').fetchall()
+
+    return LoadProfileIndex(rows)
+
+
+@lru_cache(maxsize=32)
+def calc_term_ratio_values(start, term_end, version):
+    """ Calculate the share of the standard load profile's energy of the term
+    starting at the given date which lies between its start and the term end.
+    :param datetime.date start: the start date of the term
+    :param datetime.date term_end: the end date of the share
+    :param tuple version: the load profile's version as returned by
+    get_load_profile_version()
+    :rtype: float
+    """
+
+    end = datetime(start.year + 1, start.month, start.day).date()
+    index = get_load_profile_index(version)
+
+    # Total energy which should be ~ 1.000.000 kWh
+    energy_total = index.calc_energy(start, end)
+
+    # Sum of energy promilles
+    energy_promille = index.calc_energy(start, term_end)
+
+    if energy_promille is None or energy_total is None:
+        return 0.0
+
+    return energy_promille/energy_total
+
+
 def calc_ratio_values(start):
     """ Calculates the percentages of energy consumption for the specified
     term. A term is a year where the start may be specified by the caller.
@@ -22,26 +118,10 @@ def calc_ratio_values(start):
     :rtype: float
     """
 
-    end = datetime(start.year + 1, start.month, start.day).date()
-    term_end = datetime.utcnow().date()
-    engine = get_engine()
-    energy_total = 0.0
     ratio_values = 0.0
     try:
-        with engine.connect() as con:
-            # Query total energy which should be ~ 1.000.000 kWh
-            energy_total = con.execute("SELECT SUM(energy) FROM loadprofile WHERE date BETWEEN \'"
-                                       + str(start) + "\' AND \'" + str(end) +
-                                       '\' ORDER BY date').first()[0]
-
-            # Query sum of energy promilles
-            energy_promille = con.execute("SELECT SUM(energy) FROM loadprofile"
-                                          + " WHERE date BETWEEN \'" +
-                                          str(start) + "\' AND \'"
-                                          + str(term_end) + '\' ORDER BY date').first()[0]
-
-        if (energy_promille is not None) and (energy_total is not None):
-            ratio_values = energy_promille/energy_total
+        today = datetime.utcnow().date()
+        ratio_values = calc_term_ratio_values(start, today, get_load_profile_version(today))
 
     except Exception as e:
         message = exception_message(e)
@@ -50,6 +130,14 @@ def calc_ratio_values(start):
     return ratio_values
 
 
+def clear_load_profile_cache():
+    """ Drop the cached load profile version, load profile and ratio values. """
+
+    get_load_profile_version.cache_clear()
+    get_load_profile_index.cache_clear()
+    calc_term_ratio_values.cache_clear()
+
+
 def calc_energy_consumption_last_term(meter_id, start):
     """ Calculate the last meter reading minus the first meter reading of the
     previous term for a given meter id.
@@ -142,3 +230,45 @@ def calc_estimated_energy_saving(meter_id, start):
         return None
 
     return energy_consumption_last_term - estimated_energy_consumption
+
+
+def calc_estimated_energy_savings(meter_ids, start):
+    """ Calculate the estimated energy saving of each of the given meter ids
+    in one pass. The term boundary readings of all meters are fetched at once
+    and the savings are calculated as in calc_estimated_energy_saving.
+    :param list meter_ids: the meter ids
+    :param datetime.date start: the start date of the given term
+    :returns: the estimated energy saving, None if there are no values, mapped
+    to the meter ids, and the sum of all estimated energy savings
+    :rtype: tuple(dict, float)
+    """
+
+    meter_ids = list(meter_ids)
+    if len(meter_ids) == 0:
+        return dict(), 0.0
+
+    # The last readings on the begin and end of the previous term and on the
+    # start and end of the ongoing term
+    dates = [datetime(start.year - 1, start.month, start.day).date(),
+             start - timedelta(days=1), start, datetime.utcnow().date()]
+    energies = get_last_meter_reading_dates(redis_client, meter_ids,
+                                            [datetime.strftime(date, '%Y-%m-%d')
+                                             for date in dates])
+    readings = np.array([[np.nan if energy is None else energy for energy in energies[meter_id]]
+                         for meter_id in meter_ids], dtype=np.float64)
+
+    ratio_values = calc_ratio_values(start)
+    energy_consumption_last_term = readings[:, 1] - readings[:, 0]
+    energy_consumption_ongoing_term = readings[:, 3] - readings[:, 2]
+    estimated_energy_consumption = (1 - ratio_values) * energy_consumption_last_term\
+        + energy_consumption_ongoing_term
+    savings = energy_consumption_last_term - estimated_energy_consumption
+
+    for meter_id in np.array(meter_ids)[np.isnan(savings)]:
+        message = 'No estimated energy saving available for meter_id {} from {} on'.format(
+            meter_id, str(start))
+        logger.info(message)
+
+    return ({meter_id: None if np.isnan(saving) else float(saving)
+             for meter_id, saving in zip(meter_ids, savings)},
+            float(np.nansum(savings)))
@@ -1,9 +1,7 @@
 from functools import wraps
 from flask import redirect
 from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
-from models.group import Group
-from models.user import User
-from util.database import db
+from util.cache import get_user_parameters, get_group_parameters
 
 
 def login_required(fn):
@@ -16,21 +14,24 @@ def login_required(fn):
     def wrapper(*args, **kwargs):
         verify_jwt_in_request()
         user_id = get_jwt_identity()
-        target_user = User.query.filter_by(id=user_id).first()
-        if target_user is None:
+        if get_user_parameters(user_id) is None:
             return redirect('/admin/login', code=403)
         return fn(*args, **kwargs)
     return wrapper
 
 
 def get_parameters():
-    """ Get user and group parameters for the current logged-in user. """
+    """ Get user and group parameters for the current logged-in user from the
+    cache.
+    :returns: the user's and the group's parameters or None, None if either
+    does not exist
+    :rtype: tuple
+    """
 
-    user_id = get_jwt_identity()
-    user = db.session.query(User).filter_by(id=user_id).first()
+    user = get_user_parameters(get_jwt_identity())
     if user is None:
         return None, None
-    group = db.session.query(Group).filter_by(id=user.group_id).first()
+    group = get_group_parameters(user.get('group_id'))
     if group is None:
         return None, None
     return user, group
@@ -0,0 +1,148 @@
+import json
+import logging
+from util.redis_helpers import first_day_reading_key, last_day_reading_key, strip_namespace,\
+    reading_index_key, daily_rollup_key, calc_day_bounds, parse_entry, mget_pipelined,\
+    get_first_meter_reading_date, get_last_meter_reading_date
+
+
+logger = logging.getLogger(__name__)
+
+
+# The functions returning the key of a day's first or last reading and
+# looking the reading up one by one
+DAY_READING_KEYS = dict(first=first_day_reading_key, last=last_day_reading_key)
+DAY_READING_LOOKUPS = dict(first=get_first_meter_reading_date,
+                           last=get_last_meter_reading_date)
+
+
+def queue_day_reading_key(pipeline, meter_id, date, boundary):
+    """ Queue the lookup of the key of the first or last reading of the given
+    meter id on the given day in the meter's time index.
+    :param pipeline: the pipeline to queue the lookup in
+    :param str meter_id: the meter id the reading belongs to
+    :param str date: the date in the format '%Y-%m-%d'
+    :param str boundary: 'first' or 'last'
+    """
+
+    begin, end = calc_day_bounds(date)
+    if boundary == 'first':
+        pipeline.zrangebyscore(reading_index_key(meter_id), begin, '(' + str(end),
+                               start=0, num=1)
+    else:
+        pipeline.zrevrangebyscore(reading_index_key(meter_id), '(' + str(end), begin,
+                                  start=0, num=1)
+
+
+def store_day_readings(redis_client, lookups, found, energies):
+    """ Fetch the readings with the given keys in one pipeline of MGETs, store
+    them under their days' _first or _last keys in another pipeline and set
+    their energies.
+    :param list lookups: the meter ids, the dates in the format '%Y-%m-%d' and
+    'first' or 'last'
+    :param list found: the positions of the lookups paired with the keys of
+    the readings found for them
+    :param list energies: the energies in the order of the lookups
+    """
+
+    pipeline = redis_client.pipeline(transaction=False)
+    values = mget_pipelined(redis_client, [key for _, key in found])
+    for (i, key), value in zip(found, values):
+        meter_id, date, boundary = lookups[i]
+        reading_date, data = parse_entry(meter_id, key, value, 'reading')
+        if reading_date is None or data is None:
+            energies[i] = DAY_READING_LOOKUPS[boundary](redis_client, meter_id, date)
+            continue
+
+        data['time'] = reading_date.strftime('%Y-%m-%d %H:%M:%S')
+        pipeline.set(DAY_READING_KEYS[boundary](meter_id, date), json.dumps(data))
+        energies[i] = data.get('values').get('energy')
+    pipeline.execute()
+
+
+def find_meter_reading_dates(redis_client, lookups):
+    """ Return the energies of the first or last readings of the given meter
+    ids on the given days for which the days' _first and _last keys are
+    missing. Each day's first or last reading key is looked up in the meter's
+    time index and the day's rollup in the meter's daily rollups in one
+    pipeline. The found readings are then fetched and stored by
+    store_day_readings.
+    :param list lookups: the meter ids, the dates in the format '%Y-%m-%d' and
+    'first' or 'last'
+    :returns: the energies in the order of the lookups, None where there is no
+    reading
+    :rtype: list
+    """
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for meter_id, date, boundary in lookups:
+        queue_day_reading_key(pipeline, meter_id, date, boundary)
+        pipeline.hget(daily_rollup_key(meter_id), date)
+    results = pipeline.execute()
+
+    energies = [None] * len(lookups)
+    found = []
+    for i, (meter_id, date, boundary) in enumerate(lookups):
+        keys, rollup = results[2 * i], results[2 * i + 1]
+        if len(keys) > 0:
+            found.append((i, keys[0].decode('utf-8')))
+        elif rollup is not None:
+            # The readings of the day may have been compacted into rollups
+            energies[i] = json.loads(rollup).get(boundary + '_energy')
+
+    if len(found) > 0:
+        store_day_readings(redis_client, lookups, found, energies)
+
+    return energies
+
+
+def get_meter_reading_dates(redis_client, meter_ids, boundaries):
+    """ Return the energies of the first or last readings of the given meter
+    ids on the given days. The days' _first and _last keys of all meters are
+    fetched with and without namespace in one pipeline of MGETs. Missing keys
+    are looked up in bulk by find_meter_reading_dates.
+    :param list meter_ids: the meter ids for which to get the values
+    :param list boundaries: the dates in the format '%Y-%m-%d', each paired
+    with 'first' or 'last'
+    :returns: the energies in the order of the boundaries, None where there is
+    no reading, mapped to their meter ids
+    :rtype: dict
+    """
+
+    lookups = [(meter_id, date, boundary) for meter_id in meter_ids
+               for date, boundary in boundaries]
+    keys = [DAY_READING_KEYS[boundary](meter_id, date) for meter_id, date, boundary in lookups]
+    keys += [strip_namespace(key) for key in keys]
+    values = mget_pipelined(redis_client, keys)
+
+    energies = [None] * len(lookups)
+    missing = []
+    for i in range(len(lookups)):
+        data = values[i] if values[i] is not None else values[len(lookups) + i]
+        if data is None:
+            missing.append(i)
+        else:
+            energies[i] = json.loads(data).get('values').get('energy')
+
+    if len(missing) > 0:
+        logger.info('No _first or _last keys available for %d days. Looking them up.',
+                    len(missing))
+        found = find_meter_reading_dates(redis_client, [lookups[i] for i in missing])
+        for i, energy in zip(missing, found):
+            energies[i] = energy
+
+    return {meter_id: energies[i * len(boundaries):(i + 1) * len(boundaries)]
+            for i, meter_id in enumerate(meter_ids)}
+
+
+def get_last_meter_reading_dates(redis_client, meter_ids, dates):
+    """ Return the energies of the last readings of the given meter ids on
+    the given days, fetched like in get_meter_reading_dates.
+    :param list meter_ids: the meter ids for which to get the values
+    :param list dates: the dates in the format '%Y-%m-%d'
+    :returns: the energies on the given dates, None where there is no
+    reading, mapped to their meter ids
+    :rtype: dict
+    """
+
+    return get_meter_reading_dates(redis_client, meter_ids,
+                                   [(date, 'last') for date in dates])
@@ -0,0 +1,57 @@
+from collections import defaultdict
+import json
+import os
+import logging.config
+import redis
+from util.database import create_session
+from util.redis_helpers import get_sorted_keys, get_entry_dates, disaggregation_key,\
+    DISAGGREGATION_PREFIX
+from util.sqlite_helpers import get_all_meter_ids
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger().setLevel(logging.INFO)
+redis_host = os.environ['REDIS_HOST']
+redis_port = os.environ['REDIS_PORT']
+redis_db = os.environ['REDIS_DB']
+
+
+def migrate_meter(redis_client, meter_id):
+    """ Add all disaggregation values of the given meter id stored as single
+    keys to the hashes of disaggregation values per day.
+    :param str meter_id: the meter id whose disaggregation values to migrate
+    :returns: the number of migrated disaggregation values
+    :rtype: int
+    """
+
+    keys = get_sorted_keys(redis_client, meter_id) +\
+        get_sorted_keys(redis_client, meter_id, DISAGGREGATION_PREFIX)
+    days = defaultdict(dict)
+    for disaggregation_date, data in get_entry_dates(redis_client, meter_id, keys,
+                                                     'disaggregation'):
+        days[disaggregation_date.strftime('%Y-%m-%d')][
+            disaggregation_date.strftime('%Y-%m-%d %H:%M:%S')] = json.dumps(data.get('values'))
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for date, values in days.items():
+        pipeline.hset(disaggregation_key(meter_id, date), mapping=values)
+    pipeline.execute()
+
+    return sum(len(values) for values in days.values())
+
+
+def run():
+    """ Migrate the disaggregation values of all meters stored in the redis
+    database. Run it from the project root like this:
+    'python util/migrate_disaggregation_days.py'.
+    """
+
+    redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+    session = create_session()
+    for meter_id in get_all_meter_ids(session):
+        count = migrate_meter(redis_client, meter_id)
+        logger.info('Migrated %s disaggregation values of meter id %s', count, meter_id)
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,91 @@
+import calendar
+import os
+import logging.config
+import redis
+from util.database import create_session
+from util.redis_helpers import get_sorted_keys, is_derived_key, parse_entry, parse_key_date,\
+    reading_index_key, AGGREGATE_PREFIX, READING_PREFIX, DISAGGREGATION_PREFIX, MGET_CHUNK_SIZE
+from util.sqlite_helpers import get_all_meter_ids
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger().setLevel(logging.INFO)
+redis_host = os.environ['REDIS_HOST']
+redis_port = os.environ['REDIS_PORT']
+redis_db = os.environ['REDIS_DB']
+
+
+def get_namespaced_keys(redis_client, meter_id, keys):
+    """ Return the namespaced key of each of the given keys written by
+    previous versions. Derived keys move to the aggregate namespace, entries
+    to the namespace of their type.
+    :param str meter_id: the meter id the keys belong to
+    :param list keys: the keys without namespace
+    :returns: the namespaced keys mapped to the keys without namespace
+    :rtype: dict
+    """
+
+    namespaced_keys = {key: AGGREGATE_PREFIX + key for key in keys
+                       if is_derived_key(meter_id, key)}
+    entry_keys = [key for key in keys if key not in namespaced_keys]
+    for i in range(0, len(entry_keys), MGET_CHUNK_SIZE):
+        chunk = entry_keys[i:i + MGET_CHUNK_SIZE]
+        for key, value in zip(chunk, redis_client.mget(chunk)):
+            if value is None:
+                continue
+            if parse_entry(meter_id, key, value, 'reading')[1] is not None:
+                namespaced_keys[key] = READING_PREFIX + key
+            elif parse_entry(meter_id, key, value, 'disaggregation')[1] is not None:
+                namespaced_keys[key] = DISAGGREGATION_PREFIX + key
+
+    return namespaced_keys
+
+
+def migrate_meter(redis_client, meter_id):
+    """ Rename the keys of the given meter id written by previous versions to
+    their namespaced keys and update the meter's time index accordingly. Keys
+    whose namespaced key was already written by the task are dropped, as the
+    namespaced value is newer.
+    :param str meter_id: the meter id whose keys to migrate
+    :returns: the number of migrated keys
+    :rtype: int
+    """
+
+    keys = [key for key in get_sorted_keys(redis_client, meter_id)
+            if key.startswith(meter_id + '_')]
+    namespaced_keys = get_namespaced_keys(redis_client, meter_id, keys)
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for key, namespaced_key in namespaced_keys.items():
+        pipeline.renamenx(key, namespaced_key)
+        if namespaced_key.startswith(READING_PREFIX):
+            timestamp = calendar.timegm(parse_key_date(meter_id, key).timetuple())
+            pipeline.zadd(reading_index_key(meter_id), {namespaced_key: timestamp})
+            pipeline.zrem(reading_index_key(meter_id), key)
+    pipeline.execute()
+
+    # Drop the keys which were not renamed because their namespaced key exists
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in namespaced_keys:
+        pipeline.delete(key)
+    pipeline.execute()
+
+    return len(namespaced_keys)
+
+
+def run():
+    """ Migrate the keys of all meters stored in the redis database. The task
+    and the app read both the namespaced keys and the keys without namespace,
+    so this may run in the background while they are running. Run it from the
+    project root like this: 'python util/migrate_key_namespaces.py'.
+    """
+
+    redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+    session = create_session()
+    for meter_id in get_all_meter_ids(session):
+        count = migrate_meter(redis_client, meter_id)
+        logger.info('Migrated %s keys of meter id %s', count, meter_id)
+
+
+if __name__ == '__main__':
+    run()
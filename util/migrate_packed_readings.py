@@ -0,0 +1,57 @@
+from collections import defaultdict
+from datetime import datetime
+import os
+import logging.config
+import redis
+from util.database import create_session
+from util.redis_helpers import get_reading_keys, get_entry_dates, encode_reading,\
+    packed_readings_key
+from util.sqlite_helpers import get_all_meter_ids
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger().setLevel(logging.INFO)
+redis_host = os.environ['REDIS_HOST']
+redis_port = os.environ['REDIS_PORT']
+redis_db = os.environ['REDIS_DB']
+
+
+def migrate_meter(redis_client, meter_id):
+    """ Pack all indexed readings of the given meter id into one string per
+    day and replace the day's packed readings with it.
+    :param str meter_id: the meter id whose readings to migrate
+    :returns: the number of migrated readings
+    :rtype: int
+    """
+
+    records = defaultdict(list)
+    for reading_date, data in get_entry_dates(redis_client, meter_id,
+                                              get_reading_keys(redis_client, meter_id),
+                                              'reading'):
+        # The reading dates are UTC, so interpret them as such
+        timestamp = (reading_date - datetime(1970, 1, 1)).total_seconds()
+        records[reading_date.strftime('%Y-%m-%d')].append(
+            encode_reading(timestamp, data.get('values')))
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for date, day_records in records.items():
+        pipeline.set(packed_readings_key(meter_id, date), b''.join(day_records))
+    pipeline.execute()
+
+    return sum(len(day_records) for day_records in records.values())
+
+
+def run():
+    """ Pack the readings of all meters stored in the redis database. Run it
+    from the project root like this: 'python util/migrate_packed_readings.py'.
+    """
+
+    redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+    session = create_session()
+    for meter_id in get_all_meter_ids(session):
+        count = migrate_meter(redis_client, meter_id)
+        logger.info('Packed %s readings of meter id %s', count, meter_id)
+
+
+if __name__ == '__main__':
+    run()
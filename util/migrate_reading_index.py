@@ -0,0 +1,70 @@
+import calendar
+import os
+import logging.config
+import redis
+from util.database import create_session
+from util.redis_helpers import is_derived_key, parse_entry, index_reading, MGET_CHUNK_SIZE
+from util.sqlite_helpers import get_all_meter_ids
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger().setLevel(logging.INFO)
+redis_host = os.environ['REDIS_HOST']
+redis_port = os.environ['REDIS_PORT']
+redis_db = os.environ['REDIS_DB']
+
+# Set once the readings written before the time indexes existed were indexed
+READING_INDEX_MIGRATED_KEY = 'reading_index_migrated'
+
+
+def migrate(redis_client, meter_ids):
+    """ Add the readings written before the time indexes existed, i.e. the
+    readings whose keys lack the namespace, to their meters' time indexes, as
+    all day lookups go through the indexes. The keyspace is scanned once and
+    the run is recorded under READING_INDEX_MIGRATED_KEY, so that later calls
+    return at once.
+    :param list meter_ids: the meter ids whose readings to index
+    :returns: the number of indexed readings
+    :rtype: int
+    """
+
+    if redis_client.exists(READING_INDEX_MIGRATED_KEY):
+        return 0
+
+    meter_ids = set(meter_ids)
+    keys = [key.decode('utf-8') for key in redis_client.scan_iter('*_*', 1000)]
+    keys = [key for key in keys if key.partition('_')[0] in meter_ids
+            and not is_derived_key(key.partition('_')[0], key)]
+    count = 0
+    for i in range(0, len(keys), MGET_CHUNK_SIZE):
+        chunk = keys[i:i + MGET_CHUNK_SIZE]
+        pipeline = redis_client.pipeline(transaction=False)
+        for key, value in zip(chunk, redis_client.mget(chunk)):
+            if value is None:
+                continue
+
+            meter_id = key.partition('_')[0]
+            entry_date, _ = parse_entry(meter_id, key, value, 'reading')
+            if entry_date is not None:
+                index_reading(pipeline, meter_id, key, calendar.timegm(entry_date.timetuple()))
+                count += 1
+        pipeline.execute()
+
+    redis_client.set(READING_INDEX_MIGRATED_KEY, count)
+    return count
+
+
+def run():
+    """ Index the readings of all meters written by previous versions. The
+    task runs this on start, so it only needs to be run by hand to index the
+    readings before starting the app. Run it from the project root like this:
+    'python util/migrate_reading_index.py'.
+    """
+
+    redis_client = redis.Redis(host=redis_host, port=redis_port, db=redis_db)
+    count = migrate(redis_client, get_all_meter_ids(create_session()))
+    logger.info('Indexed %s readings', count)
+
+
+if __name__ == '__main__':
+    run()
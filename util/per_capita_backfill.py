@@ -0,0 +1,149 @@
+from datetime import datetime, timedelta
+import argparse
+import logging.config
+import time
+from models.per_capita_consumption import PerCapitaConsumption
+from models.user import User
+from util.database import create_session
+from util.date_helpers import calc_support_year_start_datetime
+from util.error import exception_message
+from util.per_capita_consumption_calculation import get_data_days_before, define_base_values,\
+    calc_per_capita_consumption_series, redis_client
+from util.meter_reading_dates import get_meter_reading_dates
+
+
+logger = logging.getLogger(__name__)
+logging.getLogger().setLevel(logging.INFO)
+
+
+def parse_args():
+    usage = "Recompute the per capita consumption of the given meters over a date\
+    range from the stored meter readings and write it to the sqlite database\
+    mybuzzn.db, replacing existing entries. Run it like this from project root:\
+    \'python util/per_capita_backfill.py 2020-03-12 2020-04-30\'."
+
+    parser = argparse.ArgumentParser(description=usage)
+    parser.add_argument('begin', type=str, help='the first date in the format YYYY-MM-DD')
+    parser.add_argument('end', type=str, help='the last date in the format YYYY-MM-DD')
+    parser.add_argument('--meter-ids', type=str, nargs='+',
+                        help='the meter ids to backfill, all users\' meter ids by default')
+    args = vars(parser.parse_args())
+    return args
+
+
+def backfill_meter(meter_id, inhabitants, data, dates, energies):
+    """ Recompute the per capita consumption of one meter on the given days.
+    The series continues the given values of the day before the first day or
+    starts with the base values on the first day if there are none. Like the
+    daily job, it restarts with the base values on the day before the start of
+    each support year.
+    :param str meter_id: the meter id
+    :param int inhabitants: the number of inhabitants in the user's flat
+    :param models.per_capita_consumption.PerCapitaConsumption data: the values
+    of the day before the first day or None
+    :param list dates: the consecutive days
+    :param list energies: the meter readings of the days as expected by
+    calc_per_capita_consumption_series
+    :returns: the per capita consumption entries of the days
+    :rtype: list
+    """
+
+    support_year_start = calc_support_year_start_datetime().strftime('%m-%d')
+    resets = {i for i, date in enumerate(dates)
+              if (date + timedelta(days=1)).strftime('%m-%d') == support_year_start}
+    if data is None:
+        resets.add(0)
+    else:
+        data = dict(consumption_cumulated=data.consumption_cumulated,
+                    per_capita_consumption_cumulated=data.per_capita_consumption_cumulated,
+                    days=data.days,
+                    moving_average=data.moving_average)
+
+    rows = []
+    starts = sorted(resets | {0})
+    for first, last in zip(starts, starts[1:] + [len(dates)]):
+        if first in resets:
+            data = define_base_values(inhabitants, dates[first])
+            rows.append(dict(data, date=dates[first], meter_id=meter_id))
+            first += 1
+
+        series = calc_per_capita_consumption_series(data, energies[2 * first:2 * last + 2],
+                                                    inhabitants)
+        rows += [dict(values, date=date, meter_id=meter_id)
+                 for date, values in zip(dates[first:last], series)]
+        data = series[-1] if len(series) > 0 else data
+
+    return rows
+
+
+def backfill(session, begin, end, meter_ids=None):
+    """ Recompute the per capita consumption of the given users' meters on
+    each day from the begin to the end date from the first and last meter
+    readings of each day, which are fetched with one redis pipeline, and
+    replace the stored values in one transaction.
+    :param sqlalchemy.orm.scoping.scoped_session session: the database session
+    :param datetime begin: the first day
+    :param datetime end: the last day which cannot lie in the future
+    :param list meter_ids: the meter ids to backfill, all users' meter ids if
+    None
+    :returns: the number of written entries
+    :rtype: int
+    """
+
+    number_of_days = (end - begin).days + 1
+    if number_of_days < 1 or end.date() > datetime.utcnow().date():
+        logger.info('Invalid date range from %s to %s', begin.date(), end.date())
+        return 0
+
+    users = []
+    for meter_id, inhabitants in session.query(User.meter_id, User.inhabitants).all():
+        if meter_ids is not None and meter_id not in meter_ids:
+            continue
+        if not inhabitants:
+            logger.info('Invalid inhabitants value %s for meter id %s', inhabitants, meter_id)
+            continue
+        users.append((meter_id, inhabitants))
+
+    # The last reading of the day before the begin date, the first and last
+    # readings of each day and the first reading of the day after the end date
+    dates = [begin + timedelta(days=day) for day in range(number_of_days)]
+    boundaries = [(datetime.strftime(begin - timedelta(days=1), '%Y-%m-%d'), 'last')]
+    boundaries += [(datetime.strftime(date, '%Y-%m-%d'), boundary) for date in dates
+                   for boundary in ('first', 'last')]
+    boundaries.append((datetime.strftime(end + timedelta(days=1), '%Y-%m-%d'), 'first'))
+    energies = get_meter_reading_dates(redis_client, [meter_id for meter_id, _ in users],
+                                       boundaries)
+    data_days_before = get_data_days_before(begin, session)
+
+    rows = []
+    for meter_id, inhabitants in users:
+        rows += backfill_meter(meter_id, inhabitants, data_days_before.get(meter_id), dates,
+                               energies[meter_id])
+
+    if len(rows) == 0:
+        return 0
+
+    try:
+        session.execute(PerCapitaConsumption.__table__.insert().prefix_with('OR REPLACE'), rows)
+        session.commit()
+
+    except Exception as e:
+        message = exception_message(e)
+        logger.error(message)
+        session.rollback()
+        return 0
+
+    return len(rows)
+
+
+def run():
+    args = parse_args()
+    start = time.monotonic()
+    count = backfill(create_session(), datetime.strptime(args.get('begin'), '%Y-%m-%d'),
+                     datetime.strptime(args.get('end'), '%Y-%m-%d'), args.get('meter_ids'))
+    logger.info('Wrote %s per capita consumption entries in %.1f s', count,
+                time.monotonic() - start)
+
+
+if __name__ == '__main__':
+    run()
@@ -1,11 +1,12 @@
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, time
 import logging
 import os
+import numpy as np
 import redis
 import pytz
-from sqlalchemy import extract
 from models.per_capita_consumption import PerCapitaConsumption
 from util.error import exception_message
+from util.meter_reading_dates import get_meter_reading_dates
 from util.redis_helpers import get_last_meter_reading_date, get_first_meter_reading_date
 
 
@@ -58,14 +59,15 @@ def get_data_day_before(dt, meter_id, session):
     """
 
     day_before = dt - timedelta(days=1)
+    day_start = datetime(day_before.year, day_before.month, day_before.day)
 
     try:
+        # Query the half-open range of the day so that the index on meter id
+        # and date is used
         result = session.query(PerCapitaConsumption).filter_by(
-            meter_id=meter_id).filter(extract('year', PerCapitaConsumption.date) == day_before.year,
-                                      extract(
-                                          'month', PerCapitaConsumption.date) == day_before.month,
-                                      extract('day', PerCapitaConsumption.date) ==
-                                      day_before.day).first()
+            meter_id=meter_id).filter(PerCapitaConsumption.date >= day_start,
+                                      PerCapitaConsumption.date <
+                                      day_start + timedelta(days=1)).first()
 
         return result
 
@@ -75,6 +77,25 @@ def get_data_day_before(dt, meter_id, session):
         return None
 
 
+def get_data_days_before(dt, session):
+    """ Get the values from the day before of all meters from the SQLite
+    database with one query.
+    :param datetime dt: the request date
+    :param sqlalchemy.orm.scoping.scoped_session session: the database session
+    :returns: the values from the day before mapped to their meter ids
+    :rtype: dict
+    """
+
+    day_before = datetime.combine((dt - timedelta(days=1)).date(), time(0, 0, 0))
+    data_days_before = dict()
+    for data in session.query(PerCapitaConsumption).filter(
+            PerCapitaConsumption.date >= day_before,
+            PerCapitaConsumption.date < day_before + timedelta(days=1)).all():
+        data_days_before.setdefault(data.meter_id, data)
+
+    return data_days_before
+
+
 def define_base_values(inhabitants, date):
     """ Define the base values for a user on a given date.
     :param int inhabitants: the number of inhabitants in the user's flat
@@ -197,6 +218,83 @@ def calc_per_capita_consumption(meter_id, inhabitants, date, session):
     return build_data_package(data_day_before, consumption, inhabitants, date)
 
 
+def calc_per_capita_consumptions(users, date, session):
+    """ Calculate the per capita consumption for the given users on a given
+    date in one pass. The values from the day before are loaded with one query
+    and the first and last readings of the date are fetched with one redis
+    pipeline. The values are calculated as in calc_per_capita_consumption.
+    :param list users: the users' meter ids and inhabitants
+    :param datetime date: the calculation day which cannot lie in the future
+    :param sqlalchemy.orm.scoping.scoped_session session: the database session
+    :returns: the per capita consumption values or None if there is no data
+    for the day before in the database, mapped to the meter ids, without the
+    meter ids whose calculation failed
+    :rtype: dict
+    """
+
+    # Check input parameter date
+    if check_input_parameter_date(date) is False:
+        logger.info(
+            'The input parameter \'date\' cannot lie in the future.')
+        return dict()
+
+    data_days_before = get_data_days_before(date, session)
+    datasets = {meter_id: None for meter_id, _ in users if meter_id not in data_days_before}
+    users = [(meter_id, inhabitants) for meter_id, inhabitants in users
+             if meter_id in data_days_before]
+
+    energies = get_meter_reading_dates(redis_client, [meter_id for meter_id, _ in users],
+                                       [(datetime.strftime(date, '%Y-%m-%d'), 'last'),
+                                        (datetime.strftime(date, '%Y-%m-%d'), 'first')])
+
+    for meter_id, inhabitants in users:
+        try:
+            data_day_before = data_days_before[meter_id]
+            consumption = calc_consumption(meter_id, inhabitants, date, energies[meter_id],
+                                           data_day_before)
+            datasets[meter_id] = build_data_package(data_day_before, consumption,
+                                                    inhabitants, date)
+
+        except Exception as e:
+            message = exception_message(e)
+            logger.error(message)
+
+    return datasets
+
+
+def calc_consumption(meter_id, inhabitants, date, energies, data_day_before):
+    """ Calculate the consumption of a given user on a given date from the
+    date's last and first meter readings like calc_per_capita_consumption.
+    :param str meter_id: the user's meter id
+    :param int inhabitants: the number of inhabitants in the user's flat
+    :param datetime date: the calculation day
+    :param list energies: the last and first meter readings of the date, None
+    where there is no reading
+    :param list data_day_before: the data from the day before the date from
+    the SQLite database
+    :returns: the date's consumption in kWh
+    :rtype: float
+    """
+
+    consumption_mywh_last, consumption_mywh_first = energies
+
+    # if the last or first reading of the date does not exit, take the
+    # reading closest to it
+    if consumption_mywh_last is None:
+        consumption_mywh_last = get_first_meter_reading_date(
+            redis_client, meter_id, datetime.strftime(date + timedelta(days=1), '%Y-%m-%d'))
+    if consumption_mywh_first is None:
+        consumption_mywh_first = get_last_meter_reading_date(
+            redis_client, meter_id, datetime.strftime(date - timedelta(days=1), '%Y-%m-%d'))
+
+    # if the first and last reading do not exist, set the consumption so that
+    # the moving average does not change in relation to the previous day
+    if consumption_mywh_last is None or consumption_mywh_first is None:
+        return data_day_before.moving_average * inhabitants
+
+    return (consumption_mywh_last - consumption_mywh_first)/1e10
+
+
 def build_data_package(data_day_before, consumption, inhabitants, date):
     """ Build a per capita consumption data package from the retrieved database values.
     :param list data_day_before: the data from the day before the date in
@@ -247,3 +345,56 @@ def build_data_package(data_day_before, consumption, inhabitants, date):
                 moving_average=moving_average,
                 moving_average_annualized=moving_average_annualized
                 )
+
+
+def calc_per_capita_consumption_series(data_day_before, energies, inhabitants):
+    """ Calculate the per capita consumption values of consecutive days at
+    once. As in calc_per_capita_consumption, the consumption of a day is the
+    difference of its last and first meter readings, a missing last reading is
+    replaced by the first reading of the day after and a missing first reading
+    by the last reading of the day before. Days without consumption keep the
+    moving average of the day before.
+    :param dict data_day_before: the consumption_cumulated,
+    per_capita_consumption_cumulated, days and moving_average of the day
+    before the first day
+    :param list energies: the last meter reading of the day before the first
+    day, the first and last meter readings of each day and the first meter
+    reading of the day after the last day, None where there is no reading
+    :param int inhabitants: the number of inhabitants in the user's flat
+    :returns: the per capita consumption values of each day
+    :rtype: list
+    """
+
+    energies = np.array([np.nan if energy is None else energy for energy in energies],
+                        dtype=np.float64)
+    firsts = np.where(np.isnan(energies[1:-1:2]), energies[:-2:2], energies[1:-1:2])
+    lasts = np.where(np.isnan(energies[2:-1:2]), energies[3::2], energies[2:-1:2])
+    consumptions = (lasts - firsts)/1e10
+    per_capita_consumptions = consumptions/inhabitants
+    days = data_day_before['days'] + np.arange(1, len(consumptions) + 1)
+
+    # Fill in the days without consumption in order, as each of them depends
+    # on the moving average of the day before
+    missing = np.isnan(consumptions)
+    per_capita_consumptions_cumulated = data_day_before['per_capita_consumption_cumulated']\
+        + np.cumsum(np.where(missing, 0.0, per_capita_consumptions))
+    for i in np.flatnonzero(missing):
+        moving_average = data_day_before['moving_average'] if i == 0 else\
+            per_capita_consumptions_cumulated[i - 1]/days[i - 1]
+        consumptions[i] = moving_average * inhabitants
+        per_capita_consumptions[i] = consumptions[i]/inhabitants
+        per_capita_consumptions_cumulated[i:] += per_capita_consumptions[i]
+
+    consumptions_cumulated = data_day_before['consumption_cumulated'] + np.cumsum(consumptions)
+    moving_averages = per_capita_consumptions_cumulated/days
+    moving_averages_annualized = np.round(moving_averages * 365)
+
+    return [dict(consumption=float(consumptions[i]),
+                 consumption_cumulated=float(consumptions_cumulated[i]),
+                 inhabitants=inhabitants,
+                 per_capita_consumption=float(per_capita_consumptions[i]),
+                 per_capita_consumption_cumulated=float(per_capita_consumptions_cumulated[i]),
+                 days=int(days[i]),
+                 moving_average=float(moving_averages[i]),
+                 moving_average_annualized=int(moving_averages_annualized[i]))
+            for i in range(len(consumptions))]
@@ -1,90 +1,717 @@
+import calendar
+from datetime import datetime
 import json
 import logging.config
+import os
+import struct
+import time
 from dateutil import parser
+from redis.commands.core import Script
 from util.error import exception_message
 
 logger = logging.getLogger(__name__)
+MGET_CHUNK_SIZE = 500
+
+# The channel on which the worker publishes the id of each meter whose last
+# reading changed
+METER_UPDATES_CHANNEL = 'meter_updates'
+
+# The seconds a cached group consumption history response is valid. The
+# averaging job invalidates it at the start of each quarter-hour.
+GROUP_CONSUMPTION_HISTORY_TTL = 900
+
+# The number of most recent indexed entries to look at when a meter's _last
+# key is missing
+LAST_READING_FALLBACK_SIZE = 10
+
+# Optionally store the readings of each meter and day additionally packed into
+# one string of fixed-width records: the unix timestamp in seconds followed by
+# the values listed in PACKED_READING_FIELDS as 64 bit integers. Missing
+# values are stored as PACKED_READING_MISSING, other values are dropped.
+PACKED_READINGS = os.environ.get('REDIS_PACKED_READINGS', '0') == '1'
+PACKED_READING_FIELDS = ('energy', 'energyOut', 'power', 'power1', 'power2', 'power3')
+PACKED_READING_FORMAT = struct.Struct('<I' + 'q' * len(PACKED_READING_FIELDS))
+PACKED_READING_MISSING = -2 ** 63
+
+
+# Keys of readings, disaggregations and values derived from them start with a
+# prefix naming their type. Keys written by previous versions lack the prefix
+# and are still read until util/migrate_key_namespaces.py has renamed them.
+READING_PREFIX = 'r:'
+DISAGGREGATION_PREFIX = 'd:'
+AGGREGATE_PREFIX = 'agg:'
+NAMESPACE_PREFIXES = (READING_PREFIX, DISAGGREGATION_PREFIX, AGGREGATE_PREFIX)
+
+
+def reading_key(meter_id, timestamp):
+    """ Return the key of the reading of the given meter id at the given time.
+    :param str meter_id: the meter id the reading belongs to
+    :param str timestamp: the UTC time in the format '%Y-%m-%d %H:%M:%S'
+    """
+
+    return READING_PREFIX + meter_id + '_' + timestamp
+
+
+def disaggregation_entry_key(meter_id, timestamp):
+    """ Return the key of the disaggregation value of the given meter id at
+    the given time.
+    :param str meter_id: the meter id the disaggregation value belongs to
+    :param str timestamp: the UTC time in the format '%Y-%m-%d %H:%M:%S'
+    """
+
+    return DISAGGREGATION_PREFIX + meter_id + '_' + timestamp
+
+
+def last_reading_key(meter_id):
+    """ Return the key of the last reading of the given meter id.
+    :param str meter_id: the meter id the reading belongs to
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_last'
+
+
+def first_day_reading_key(meter_id, date):
+    """ Return the key of the first reading of the given meter id on the
+    given day.
+    :param str meter_id: the meter id the reading belongs to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_' + date + '_first'
+
+
+def last_day_reading_key(meter_id, date):
+    """ Return the key of the last reading of the given meter id on the given
+    day.
+    :param str meter_id: the meter id the reading belongs to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_' + date + '_last'
+
+
+def last_disaggregation_key(meter_id):
+    """ Return the key of the last disaggregation value of the given meter id.
+    :param str meter_id: the meter id the disaggregation value belongs to
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_last_disaggregation'
+
+
+def strip_namespace(key):
+    """ Return the given key without its namespace prefix, i.e. the key
+    previous versions stored the same data under.
+    :param str key: the key to strip
+    """
+
+    for prefix in NAMESPACE_PREFIXES:
+        if key.startswith(prefix):
+            return key[len(prefix):]
+
+    return key
+
+
+def get_namespaced(redis_client, key):
+    """ Return the value of the given namespaced key or, if it does not exist,
+    the value stored under the key without namespace by previous versions.
+    :param str key: the namespaced key
+    """
 
+    value = redis_client.get(key)
+    if value is None:
+        value = redis_client.get(strip_namespace(key))
+
+    return value
+
+
+# Replace the first and the last reading of a day if the given reading is
+# older or newer, respectively. The stored readings' times are compared with
+# the given reading's time in the same representation, i.e. as the UTC time
+# '%Y-%m-%d %H:%M:%S' or as unix timestamp for values written by previous
+# versions. The keys without namespace are looked at if the namespaced keys
+# do not exist.
+# KEYS: the first and last reading keys with and without namespace
+# ARGV: the reading's JSON, its UTC time and its unix timestamp
+UPDATE_DAY_READINGS_SCRIPT = """
+local function compare(key, legacy_key)
+    local value = redis.call('GET', key) or redis.call('GET', legacy_key)
+    if not value then
+        return nil
+    end
+    local ok, data = pcall(cjson.decode, value)
+    if not ok or type(data) ~= 'table' then
+        return nil
+    end
+    local stored, current = data['time'], nil
+    if type(stored) == 'string' then
+        current = ARGV[2]
+    elseif type(stored) == 'number' then
+        current = tonumber(ARGV[3])
+    else
+        return nil
+    end
+    if current < stored then
+        return -1
+    elseif current > stored then
+        return 1
+    end
+    return 0
+end
+
+local first = compare(KEYS[1], KEYS[3])
+if first == nil or first < 0 then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+local last = compare(KEYS[2], KEYS[4])
+if last == nil or last >= 0 then
+    redis.call('SET', KEYS[2], ARGV[1])
+end
+return 0
+"""
+# The script is created once from its bytes, which need no client to encode
+# them, and executed with the client passed on each call
+UPDATE_DAY_READINGS = Script(None, UPDATE_DAY_READINGS_SCRIPT.encode('utf-8'))
+
+
+def update_day_readings(redis_client, meter_id, timestamp, values):
+    """ Atomically make the given reading the first or last reading of its
+    day if it is older or newer than the stored ones.
+    :param redis_client: the redis client or PipelineWriter to write with
+    :param str meter_id: the meter id the reading belongs to
+    :param float timestamp: the reading's unix timestamp in seconds
+    :param dict values: the reading's values
+    """
+
+    reading_time = datetime.utcfromtimestamp(timestamp)
+    date = reading_time.strftime('%Y-%m-%d')
+    keys = [first_day_reading_key(meter_id, date), last_day_reading_key(meter_id, date)]
+    keys += [strip_namespace(key) for key in keys]
+    time_string = reading_time.strftime('%Y-%m-%d %H:%M:%S')
+    data = dict(type='reading', values=values, time=time_string)
+    args = [json.dumps(data), time_string, timestamp]
+    if isinstance(redis_client, PipelineWriter):
+        redis_client.run_script(UPDATE_DAY_READINGS, keys, args)
+    else:
+        UPDATE_DAY_READINGS(keys=keys, args=args, client=redis_client)
 
-def get_sorted_keys(redis_client, meter_id):
+
+def get_sorted_keys(redis_client, meter_id, prefix=''):
     """ Return all keys stored in the redis database for a given meter id.
     :param str meter_id: the meter id to prefix the scan with
+    :param str prefix: the namespace to scan, by default the keys without
+    namespace written by previous versions
     """
 
     return sorted([key.decode('utf-8') for key in
-                   redis_client.scan_iter(meter_id + '*', 200)])
+                   redis_client.scan_iter(prefix + meter_id + '*', 200)])
 
 
-def get_sorted_keys_date_prefix(redis_client, meter_id, date):
-    """ Return all keys stored in the redis database for a given meter id with
-    the given date prefix.
-    :param str meter_id: the meter id to prefix the scan with
-    :param str date: the date prefix
+def reading_index_key(meter_id):
+    """ Return the key of the sorted set which indexes all reading keys of the
+    given meter id by their unix timestamp.
+    :param str meter_id: the meter id the index belongs to
     """
 
-    return sorted([key.decode('utf-8') for key in
-                   redis_client.scan_iter(meter_id + '_' + date + '*', 200)])
+    return 'reading_index_' + meter_id
 
 
-def get_keys_date_hour_prefix(redis_client, meter_id, date, hour):
-    """ Return all keys in the redis database for a given meter id with
-    the given date and hour  prefix.
-    :param str meter_id: the meter id to prefix the scan with
-    :param str date: the date prefix
-    :param str hour: the hour prefix
+def index_reading(redis_client, meter_id, key, timestamp):
+    """ Add a reading key to the time index of the given meter id.
+    :param redis_client: the redis client or pipeline to write with
+    :param str meter_id: the meter id the reading belongs to
+    :param str key: the reading's key
+    :param float timestamp: the reading's unix timestamp in seconds
+    :returns: 1 if the key was not indexed yet, 0 otherwise (only when
+    writing with a redis client)
+    """
+
+    return redis_client.zadd(reading_index_key(meter_id), {key: timestamp})
+
+
+def average_power_key(meter_id, date):
+    """ Return the key of the hash which stores the average power values of
+    the given meter id per quarter-hour of the given day.
+    :param str meter_id: the meter id the average power values belong to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return 'average_power_' + meter_id + '_' + date
+
+
+def disaggregation_key(meter_id, date):
+    """ Return the key of the hash which stores the disaggregation values of
+    the given meter id on the given day, mapped to their UTC timestamps.
+    :param str meter_id: the meter id the disaggregation values belong to
+    :param str date: the date in the format '%Y-%m-%d'
     """
+
+    return 'disaggregation_' + meter_id + '_' + date
+
+
+def group_consumption_history_key(group_id, date, quarter_hour_index):
+    """ Return the key of the cached group consumption history response of
+    the given group in the given quarter-hour.
+    :param int group_id: the group's id
+    :param str date: the date in the format '%Y-%m-%d'
+    :param int quarter_hour_index: the index of the quarter-hour of the day
+    """
+
+    return 'group_consumption_history_{}_{}_{}'.format(group_id, date, quarter_hour_index)
+
+
+def power_accumulator_key(meter_id, date):
+    """ Return the key of the hash which accumulates the power values of the
+    given meter id per quarter-hour of the given day.
+    :param str meter_id: the meter id the accumulator belongs to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return 'power_accumulator_' + meter_id + '_' + date
+
+
+def hourly_rollup_key(meter_id, date):
+    """ Return the key of the hash which stores the hourly rollups of the
+    compacted readings of the given meter id on the given day, mapped to the
+    UTC begin of their hour.
+    :param str meter_id: the meter id the rollups belong to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_' + date + '_hourly'
+
+
+def daily_rollup_key(meter_id):
+    """ Return the key of the hash which stores the daily rollups of the
+    compacted readings of the given meter id, mapped to their dates.
+    :param str meter_id: the meter id the rollups belong to
+    """
+
+    return AGGREGATE_PREFIX + meter_id + '_daily'
+
+
+def calc_rollup(entries):
+    """ Downsample readings into a rollup holding the time and energy of the
+    first and the last reading and the minimum, maximum and average power.
+    :param list entries: the readings' dates and data, sorted by date
+    :returns: the rollup or None if there are no readings
+    :rtype: dict or type(None)
+    """
+
+    if len(entries) == 0:
+        return None
+
+    first_date, first_data = entries[0]
+    last_date, last_data = entries[-1]
+    powers = [data.get('values').get('power') for _, data in entries
+              if data.get('values').get('power') is not None]
+    return dict(first_time=calendar.timegm(first_date.timetuple()),
+                first_energy=first_data.get('values').get('energy'),
+                last_time=calendar.timegm(last_date.timetuple()),
+                last_energy=last_data.get('values').get('energy'),
+                min_power=min(powers, default=None),
+                max_power=max(powers, default=None),
+                avg_power=sum(powers) / len(powers) if len(powers) > 0 else None,
+                count=len(powers))
+
+
+def merge_rollups(rollup, other):
+    """ Merge two rollups of the same period, e.g. when readings of an
+    already compacted day were fetched again.
+    :param rollup: the stored rollup or None
+    :param dict other: the rollup to merge into it
+    :rtype: dict
+    """
+
+    if rollup is None:
+        return other
+
+    first = min(rollup, other, key=lambda r: r.get('first_time'))
+    last = max(rollup, other, key=lambda r: r.get('last_time'))
+    with_power = [r for r in (rollup, other) if r.get('count') > 0]
+    count = sum(r.get('count') for r in with_power)
+    return dict(first_time=first.get('first_time'), first_energy=first.get('first_energy'),
+                last_time=last.get('last_time'), last_energy=last.get('last_energy'),
+                min_power=min((r.get('min_power') for r in with_power), default=None),
+                max_power=max((r.get('max_power') for r in with_power), default=None),
+                avg_power=sum(r.get('avg_power') * r.get('count') for r in with_power) / count
+                if count > 0 else None,
+                count=count)
+
+
+def get_daily_rollup(redis_client, meter_id, date):
+    """ Return the daily rollup of the compacted readings of the given meter
+    id on the given day.
+    :param str meter_id: the meter id for which to get the rollup
+    :param str date: the date in the format '%Y-%m-%d'
+    :returns: the rollup or None if the day was not compacted
+    :rtype: dict or type(None)
+    """
+
+    rollup = redis_client.hget(daily_rollup_key(meter_id), date)
+    if rollup is None:
+        return None
+
+    return json.loads(rollup)
+
+
+def calc_day_bounds(date):
+    """ Return the unix timestamps of the begin of the given UTC day and of
+    the begin of the following day.
+    :param str date: the date in the format '%Y-%m-%d'
+    :rtype: tuple(int)
+    """
+
+    begin = calendar.timegm(datetime.strptime(date, '%Y-%m-%d').timetuple())
+    return begin, begin + 24 * 60 * 60
+
+
+def get_reading_keys(redis_client, meter_id, begin='-inf', end='+inf'):
+    """ Return the keys of all readings of the given meter id in the given
+    time range, sorted by time, using the meter's time index.
+    :param str meter_id: the meter id for which to get the keys
+    :param begin: the unix timestamp to begin with (inclusive)
+    :param end: the unix timestamp to end with (inclusive), prefix with '('
+    to exclude it
+    """
+
     return [key.decode('utf-8') for key in
-            redis_client.scan_iter(meter_id + '_' + date + ' ' + hour + '*')]
+            redis_client.zrangebyscore(reading_index_key(meter_id), begin, end)]
 
 
-def get_entry_date(redis_client, meter_id, key, entry_type):
-    """ Return creation date of an entry in the redis database.
+def get_reading_keys_date(redis_client, meter_id, date):
+    """ Return the keys of all readings of the given meter id on the given
+    day, sorted by time, using the meter's time index.
+    :param str meter_id: the meter id for which to get the keys
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    begin, end = calc_day_bounds(date)
+    return get_reading_keys(redis_client, meter_id, begin, '(' + str(end))
+
+
+def packed_readings_key(meter_id, date):
+    """ Return the key of the string which stores the packed readings of the
+    given meter id on the given day.
+    :param str meter_id: the meter id the readings belong to
+    :param str date: the date in the format '%Y-%m-%d'
+    """
+
+    return 'packed_readings_' + meter_id + '_' + date
+
+
+def encode_reading(timestamp, values):
+    """ Pack a reading into a fixed-width record. Missing values and values
+    which are None are stored as PACKED_READING_MISSING, values not listed in
+    PACKED_READING_FIELDS are dropped.
+    :param float timestamp: the reading's unix timestamp in seconds
+    :param dict values: the reading's values
+    :rtype: bytes
+    """
+
+    return PACKED_READING_FORMAT.pack(int(timestamp), *[
+        PACKED_READING_MISSING if values.get(field) is None else int(round(values.get(field)))
+        for field in PACKED_READING_FIELDS])
+
+
+def decode_readings(data):
+    """ Unpack all readings of a string of packed records in one pass. If a
+    timestamp occurs more than once, the last record wins. Missing values are
+    left out, so that the readings hold the values listed in
+    PACKED_READING_FIELDS which the stored readings hold.
+    :param bytes data: the packed records
+    :returns: the readings' values mapped to their UTC timestamps in the
+    format '%Y-%m-%d %H:%M:%S', sorted by time
+    :rtype: dict
+    """
+
+    readings = {record[0]: record[1:] for record in PACKED_READING_FORMAT.iter_unpack(
+        data[:len(data) - len(data) % PACKED_READING_FORMAT.size])}
+    return {datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M:%S'):
+            {field: value for field, value in zip(PACKED_READING_FIELDS, readings[timestamp])
+             if value != PACKED_READING_MISSING}
+            for timestamp in sorted(readings)}
+
+
+def append_packed_reading(redis_client, meter_id, timestamp, values):
+    """ Append a reading to the packed readings of its day.
+    :param redis_client: the redis client or pipeline to write with
+    :param str meter_id: the meter id the reading belongs to
+    :param float timestamp: the reading's unix timestamp in seconds
+    :param dict values: the reading's values
+    """
+
+    date = datetime.utcfromtimestamp(timestamp).strftime('%Y-%m-%d')
+    redis_client.append(packed_readings_key(meter_id, date), encode_reading(timestamp, values))
+
+
+def get_packed_readings(redis_client, meter_id, dates):
+    """ Return the packed readings of the given meter id on the given days,
+    fetched with one MGET.
+    :param str meter_id: the meter id for which to get the readings
+    :param list dates: the dates in the format '%Y-%m-%d'
+    :returns: the readings' values mapped to their UTC timestamps
+    :rtype: dict
+    """
+
+    result = {}
+    for data in redis_client.mget([packed_readings_key(meter_id, date) for date in dates]):
+        if data is not None:
+            result.update(decode_readings(data))
+
+    return result
+
+
+def get_disaggregation_days(redis_client, meter_id, dates):
+    """ Return the disaggregation values of the given meter id on the given
+    days, fetched in one round trip.
+    :param str meter_id: the meter id for which to get the values
+    :param list dates: the dates in the format '%Y-%m-%d'
+    :returns: the disaggregation values mapped to their UTC timestamps
+    :rtype: dict
+    """
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for date in dates:
+        pipeline.hgetall(disaggregation_key(meter_id, date))
+
+    result = {}
+    for data in pipeline.execute():
+        result.update({timestamp.decode('utf-8'): json.loads(values)
+                       for timestamp, values in data.items()})
+
+    return dict(sorted(result.items()))
+
+
+def remove_disaggregations(redis_client, cutoff):
+    """ Remove the disaggregation values of all meters before the cutoff,
+    i.e. the hashes of their days and the single keys written by previous
+    versions. The keys are found with one scan of the redis database each.
+    :param int cutoff: the unix timestamp of the begin of the oldest day to
+    keep
+    :returns: the number of removed keys
+    :rtype: int
+    """
+
+    keys = []
+    for pattern in 'disaggregation_*', DISAGGREGATION_PREFIX + '*':
+        for key in redis_client.scan_iter(pattern, 1000):
+            # The keys end with the separator '_' and the date or UTC time
+            try:
+                key_date = datetime.strptime(key.decode('utf-8').rpartition('_')[2][:10],
+                                             '%Y-%m-%d')
+
+            except ValueError:
+                # Keys without date like the high-water marks are kept
+                continue
+
+            if calendar.timegm(key_date.timetuple()) < cutoff:
+                keys.append(key)
+
+    for i in range(0, len(keys), MGET_CHUNK_SIZE):
+        redis_client.delete(*keys[i:i + MGET_CHUNK_SIZE])
+
+    return len(keys)
+
+
+def get_high_water_marks(redis_client, key):
+    """ Return the high-water marks, i.e. the unix timestamps in milliseconds
+    of the newest stored entries, of all meters.
+    :param str key: the key of the hash storing the high-water marks
+    :returns: the high-water marks mapped to their meter ids
+    :rtype: dict
+    """
+
+    return {meter_id.decode('utf-8'): int(timestamp) for meter_id, timestamp in
+            redis_client.hgetall(key).items()}
+
+
+def is_derived_key(meter_id, key):
+    """ Return whether the given key holds a derived value instead of a
+    reading or disaggregation entry.
     :param str meter_id: the meter id the entry belongs to
     :param str key: the entry's key
-    :param str entry_type: the entry's type (reading or disaggregation)
     """
-    if (key[len(meter_id) + 1:].endswith("last")
+
+    return (key.startswith(AGGREGATE_PREFIX)
+            or key[len(meter_id) + 1:].endswith("last")
             or key[len(meter_id) + 1:].endswith("first")
             or key[len(meter_id) + 1:].endswith("last_disaggregation")
-            or key.startswith('average_power')):
-        return None, None
+            or key.startswith('average_power'))
+
+
+def parse_key_date(meter_id, key):
+    """ Return the date encoded in the key of a reading or disaggregation
+    entry. Keys in the layout written by the task, i.e. the meter id, the
+    separator '_' and the UTC timestamp in the format '%Y-%m-%d %H:%M:%S',
+    are decoded with datetime.fromisoformat, all other keys with the generic
+    dateutil parser.
+    :param str meter_id: the meter id the entry belongs to
+    :param str key: the entry's key with or without namespace
+    :rtype: datetime
+    """
+
+    date = strip_namespace(key)[len(meter_id) + 1:]
+    if len(date) == 19:
+        try:
+            return datetime.fromisoformat(date)
+
+        except ValueError:
+            pass
+
+    return parser.parse(date)
+
+
+def parse_entry(meter_id, key, value, entry_type):
+    """ Parse an entry fetched from the redis database.
+    :param str meter_id: the meter id the entry belongs to
+    :param str key: the entry's key
+    :param bytes value: the entry's raw value
+    :param str entry_type: the entry's type (reading or disaggregation)
+    :returns: the entry's creation date and data or (None, None) if the entry
+    does not have the given type
+    """
 
     try:
-        data = json.loads(redis_client.get(key))
+        data = json.loads(value)
 
     except Exception as e:
         message = exception_message(e)
         logger.error(message)
     else:
         if data is not None and data.get('type') == entry_type:
-            entry_date = parser.parse(key[len(meter_id) + 1:])
+            entry_date = parse_key_date(meter_id, key)
             return entry_date, data
 
     return None, None
 
 
+def get_entry_date(redis_client, meter_id, key, entry_type):
+    """ Return creation date of an entry in the redis database.
+    :param str meter_id: the meter id the entry belongs to
+    :param str key: the entry's key
+    :param str entry_type: the entry's type (reading or disaggregation)
+    """
+    if is_derived_key(meter_id, key):
+        return None, None
+
+    try:
+        value = redis_client.get(key)
+
+    except Exception as e:
+        message = exception_message(e)
+        logger.error(message)
+        return None, None
+
+    return parse_entry(meter_id, key, value, entry_type)
+
+
+def get_entry_dates(redis_client, meter_id, keys, entry_type):
+    """ Return creation date and data of all entries with the given keys and
+    type. The entries are fetched with one MGET per chunk of MGET_CHUNK_SIZE
+    keys instead of one GET per key.
+    :param str meter_id: the meter id the entries belong to
+    :param list keys: the entries' keys
+    :param str entry_type: the entries' type (reading or disaggregation)
+    :returns: the creation date and data of each matching entry in the order
+    of the given keys
+    :rtype: [tuple]
+    """
+
+    keys = [key for key in keys if not is_derived_key(meter_id, key)]
+    entries = []
+    for i in range(0, len(keys), MGET_CHUNK_SIZE):
+        chunk = keys[i:i + MGET_CHUNK_SIZE]
+        for key, value in zip(chunk, redis_client.mget(chunk)):
+            if value is None:
+                continue
+
+            entry_date, data = parse_entry(meter_id, key, value, entry_type)
+            if entry_date is not None and data is not None:
+                entries.append((entry_date, data))
+
+    return entries
+
+
+def find_last_reading(redis_client, meter_id):
+    """ Find the last meter reading among the most recent entries of the
+    meter's time index and store it as the meter's last reading. Only
+    LAST_READING_FALLBACK_SIZE entries are looked at, so this never scans the
+    keyspace.
+    :param str meter_id: the meter id for which to get the values
+    :returns: the last reading or an empty dict if there is none
+    :rtype: dict
+    """
+
+    keys = redis_client.zrevrangebyscore(reading_index_key(meter_id), '+inf', '-inf',
+                                         start=0, num=LAST_READING_FALLBACK_SIZE)
+    if len(keys) == 0:
+        return dict()
+
+    for data in redis_client.mget(keys):
+        if data is not None and json.loads(data).get('type') == 'reading':
+            redis_client.set(last_reading_key(meter_id), data)
+            return json.loads(data)
+
+    return dict()
+
+
 def get_last_reading(redis_client, meter_id):
     """ Return the last meter reading stored in the redis db.
     :param str meter_id: the meter id for which to get the values
     """
 
-    data = redis_client.get(meter_id + '_last')
+    data = get_namespaced(redis_client, last_reading_key(meter_id))
 
-    if data in ({}, []):
-        logger.info("No key %s_last available. Iteration needed.", meter_id)
-        result = dict()
-        for key in reversed(get_sorted_keys(redis_client, meter_id)):
-            data = redis_client.get(key)
-            if json.loads(data).get('type') == 'reading':
-                result = json.loads(data)
-                break
+    if data is None:
+        logger.info("No key %s_last available. Index lookup needed.", meter_id)
+        return find_last_reading(redis_client, meter_id)
 
-    else:
-        result = json.loads(data)
+    return json.loads(data)
+
+
+def get_last_readings(redis_client, meter_ids):
+    """ Return the last meter readings of the given meter ids stored in the
+    redis db, fetched with a single MGET of the namespaced keys and the keys
+    written by previous versions. Missing _last keys are filled from the
+    meters' time indexes.
+    :param list meter_ids: the meter ids for which to get the values
+    :returns: the last reading of each meter id, an empty dict if there is
+    none
+    :rtype: dict
+    """
+
+    meter_ids = list(meter_ids)
+    if len(meter_ids) == 0:
+        return dict()
+
+    keys = [last_reading_key(meter_id) for meter_id in meter_ids]
+    values = redis_client.mget(keys + [strip_namespace(key) for key in keys])
+    result = dict()
+    for i, meter_id in enumerate(meter_ids):
+        data = values[i] if values[i] is not None else values[len(meter_ids) + i]
+        if data is None:
+            logger.info("No key %s_last available. Index lookup needed.", meter_id)
+            result[meter_id] = find_last_reading(redis_client, meter_id)
+        else:
+            result[meter_id] = json.loads(data)
 
     return result
 
 
+def mget_pipelined(redis_client, keys):
+    """ Return the values of the given keys, fetched with one MGET per chunk
+    of MGET_CHUNK_SIZE keys in one pipeline.
+    :param list keys: the keys to fetch
+    :returns: the values in the order of the keys, None for missing keys
+    :rtype: list
+    """
+
+    pipeline = redis_client.pipeline(transaction=False)
+    for i in range(0, len(keys), MGET_CHUNK_SIZE):
+        pipeline.mget(keys[i:i + MGET_CHUNK_SIZE])
+    return [value for chunk in pipeline.execute() for value in chunk]
+
+
 # pylint: disable=too-many-locals
 def get_first_meter_reading_date(redis_client, meter_id, date):
     """ Return the first reading for the given meter id on the given day which
@@ -93,18 +720,23 @@ def get_first_meter_reading_date(redis_client, meter_id, date):
     timezone-unaware date to UTC.
     : param str meter_id: the meter id for which to get the value
     : param str date: the date for which to get the value
-    : returns: the last reading for the given meter id on the given date or
+    : returns: the first reading for the given meter id on the given date or
     None if there are no values
     : rtype: float or type(None)
     """
-    key_date_first = f"{meter_id}_{date}_first"
-    redis_key_date_first = redis_client.get(key_date_first)
+    key_date_first = first_day_reading_key(meter_id, date)
+    redis_key_date_first = get_namespaced(redis_client, key_date_first)
 
     if redis_key_date_first is None:
         logger.info("No key %s_%s_first available. Iteration needed.", meter_id, date)
-        sorted_keys_date = get_sorted_keys_date_prefix(redis_client, meter_id, date)
+        sorted_keys_date = get_reading_keys_date(redis_client, meter_id, date)
 
         if len(sorted_keys_date) == 0:
+            # The readings of the day may have been compacted into rollups
+            rollup = get_daily_rollup(redis_client, meter_id, date)
+            if rollup is not None:
+                return rollup.get('first_energy')
+
             logger.info('No first reading available for meter id %s on %s', meter_id, str(date))
             return None
 
@@ -114,7 +746,7 @@ def get_first_meter_reading_date(redis_client, meter_id, date):
             if reading_date is None or data is None:
                 continue
 
-            data["time"] = reading_date.timestamp()
+            data["time"] = reading_date.strftime('%Y-%m-%d %H:%M:%S')
             redis_client.set(key_date_first, json.dumps(data))
             return data.get('values').get('energy')
 
@@ -124,13 +756,14 @@ def get_first_meter_reading_date(redis_client, meter_id, date):
     except Exception as e:
         message = exception_message(e)
         logger.error(message)
-    else:
-        return data.get('values').get('energy')
+        return None
+
+    return data.get('values').get('energy')
 
 
 # pylint: disable=too-many-locals
 def get_last_meter_reading_date(redis_client, meter_id, date):
-    """ Return the first reading for the given meter id on the given day which
+    """ Return the last reading for the given meter id on the given day which
     is stored in the redis database. As we were using unix timestamps as
     basis for our dates all along, there is no need to convert the stored,
     timezone-unaware date to UTC.
@@ -140,14 +773,19 @@ def get_last_meter_reading_date(redis_client, meter_id, date):
     None if there are no values
     : rtype: float or type(None)
     """
-    key_date_last = f"{meter_id}_{date}_last"
-    redis_key_date_last = redis_client.get(key_date_last)
+    key_date_last = last_day_reading_key(meter_id, date)
+    redis_key_date_last = get_namespaced(redis_client, key_date_last)
 
     if redis_key_date_last is None:
         logger.info("No key %s_%s_last available. Iteration needed.", meter_id, date)
-        sorted_keys_date = get_sorted_keys_date_prefix(redis_client, meter_id, date)
+        sorted_keys_date = get_reading_keys_date(redis_client, meter_id, date)
 
         if len(sorted_keys_date) == 0:
+            # The readings of the day may have been compacted into rollups
+            rollup = get_daily_rollup(redis_client, meter_id, date)
+            if rollup is not None:
+                return rollup.get('last_energy')
+
             logger.info('No last reading available for meter id %s on %s', meter_id, str(date))
             return None
 
@@ -157,7 +795,7 @@ def get_last_meter_reading_date(redis_client, meter_id, date):
             if reading_date is None or data is None:
                 continue
 
-            data["time"] = reading_date.timestamp()
+            data["time"] = reading_date.strftime('%Y-%m-%d %H:%M:%S')
             redis_client.set(key_date_last, json.dumps(data))
             return data.get('values').get('energy')
 
@@ -167,5 +805,125 @@ def get_last_meter_reading_date(redis_client, meter_id, date):
     except Exception as e:
         message = exception_message(e)
         logger.error(message)
-    else:
-        return data.get('values').get('energy')
+        return None
+
+    return data.get('values').get('energy')
+
+
+class PipelineWriter:
+    """ Buffer write commands in a non-transactional redis pipeline and flush
+    them every flush_size commands. Commands which record the progress of the
+    writes, e.g. a meter's high-water mark, are sent after the flush which
+    executed all commands buffered before them. They are dropped if one of
+    the commands buffered since the previous progress command failed. """
+
+    def __init__(self, redis_client, flush_size):
+        """ Create a pipeline writer.
+        :param redis_client: the redis client to write with
+        :param int flush_size: the number of buffered commands which triggers
+        a flush
+        """
+
+        self.pipeline = redis_client.pipeline(transaction=False)
+        self.flush_size = flush_size
+        self.buffered_commands = 0
+        self.flushed_commands = 0
+        self.flush_durations = []
+        self.sequence = 0
+        self.progress_start = 0
+        self.progress = []
+        self.failed_commands = set()
+
+    def set(self, key, value):
+        """ Buffer a SET command. """
+
+        self.pipeline.set(key, value)
+        self.buffered()
+
+    def zadd(self, key, mapping):
+        """ Buffer a ZADD command. """
+
+        self.pipeline.zadd(key, mapping)
+        self.buffered()
+
+    def append(self, key, value):
+        """ Buffer an APPEND command. """
+
+        self.pipeline.append(key, value)
+        self.buffered()
+
+    def hset(self, key, field, value):
+        """ Buffer an HSET command. """
+
+        self.pipeline.hset(key, field, value)
+        self.buffered()
+
+    def hset_progress(self, key, field, value):
+        """ Buffer an HSET command which is sent only if all commands buffered
+        since the previous progress command were executed without errors. """
+
+        self.progress.append((key, field, value, self.progress_start, self.sequence))
+        self.progress_start = self.sequence
+
+    def run_script(self, script, keys, args):
+        """ Buffer an execution of the given lua script. """
+
+        script(keys=keys, args=args, client=self.pipeline)
+        self.buffered()
+
+    def buffered(self):
+        """ Count a buffered command and flush if the buffer is full. """
+
+        self.buffered_commands += 1
+        self.sequence += 1
+        if self.buffered_commands >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """ Send all buffered commands to the redis database. A failing
+        command does not prevent the others from being executed. """
+
+        if self.buffered_commands == 0 and len(self.progress) == 0:
+            return
+
+        commands = self.buffered_commands
+        self.buffered_commands = 0
+        start = time.monotonic()
+        try:
+            for i, result in enumerate(self.pipeline.execute(raise_on_error=False)):
+                if isinstance(result, Exception):
+                    self.failed_commands.add(self.sequence - commands + i)
+                    message = exception_message(result)
+                    logger.error(message)
+
+        except Exception as e:
+            self.failed_commands.update(range(self.sequence - commands, self.sequence))
+            message = exception_message(e)
+            logger.error(message)
+            self.pipeline.reset()
+
+        # Only send the progress whose commands all succeeded
+        progress = [(key, field, value) for key, field, value, begin, end in self.progress
+                    if not any(begin <= i < end for i in self.failed_commands)]
+        if len(progress) < len(self.progress):
+            message = 'Dropped {} progress commands after failed writes'.format(
+                len(self.progress) - len(progress))
+            logger.error(message)
+        if len(progress) > 0:
+            for key, field, value in progress:
+                self.pipeline.hset(key, field, value)
+            commands += len(progress)
+            try:
+                self.pipeline.execute()
+
+            except Exception as e:
+                message = exception_message(e)
+                logger.error(message)
+                self.pipeline.reset()
+        self.failed_commands = {i for i in self.failed_commands if i >= self.progress_start}
+        self.progress = []
+
+        duration = time.monotonic() - start
+        self.flushed_commands += commands
+        self.flush_durations.append(duration)
+        logger.debug('Flushed %s redis commands in %.3f s', commands, duration)
@@ -7,9 +7,10 @@ from models.savings import UserSaving, CommunitySaving
 from models.user import User
 from util.date_helpers import calc_support_year_start_datetime, message_timestamp
 from util.energy_saving_calculation import calc_energy_consumption_last_term,\
-    calc_estimated_energy_saving
+    calc_estimated_energy_savings
 from util.error import exception_message
-from util.per_capita_consumption_calculation import define_base_values, calc_per_capita_consumption
+from util.per_capita_consumption_calculation import define_base_values,\
+    calc_per_capita_consumptions
 
 log_file_path = path.join(path.dirname(
     path.abspath(__file__)), 'logger_configuration.conf')
@@ -35,6 +36,12 @@ def get_all_meter_ids(session):
            in session.query(Group.group_production_meter_id_second).all()]
 
 
+def get_all_group_ids(session):
+    """ Get all group ids from the SQLite database. """
+
+    return [group_id[0] for group_id in session.query(Group.id).all()]
+
+
 def get_all_users(session):
     """ Get all users from the SQLite database. """
 
@@ -54,8 +61,8 @@ def write_savings(session):
 
     start = calc_support_year_start_datetime()
     try:
-        for key, value in estimate_energy_saving_each_user(start,
-                                                           session).items():
+        savings, community_saving = estimate_energy_savings(start, session)
+        for key, value in savings.items():
 
             if value is None:
                 message = ERROR_MESSAGE_SAVING.format(key, message_timestamp)
@@ -70,7 +77,6 @@ def write_savings(session):
             session.add(user_saving)
 
         # Create CommunitySaving instance
-        community_saving = estimate_energy_saving_all_users(start, session)
         session.add(CommunitySaving(datetime.utcnow(), community_saving))
 
         session.commit()
@@ -158,38 +164,69 @@ def write_per_capita_consumption(dt, session):
     If for one user there are no yesterday's values in the database, write the
     base values for that user.
     If today's entry already exists for a user, skip writing that entry.
+    The values of all users are calculated in one pass and inserted in bulk.
     :param datetime dt: the date to write the values for
     :param sqlalchemy.orm.scoping.scoped_session session: the database session
     """
 
-    for user in get_all_users(session):
+    # Skip the users whose entry exists
+    existing_meter_ids = {meter_id[0] for meter_id in session.query(
+        PerCapitaConsumption.meter_id).filter(PerCapitaConsumption.date >= dt,
+                                              PerCapitaConsumption.date < dt + timedelta(days=1))}
+    users = [(meter_id, inhabitants) for meter_id, inhabitants in
+             session.query(User.meter_id, User.inhabitants).all()
+             if meter_id not in existing_meter_ids]
+
+    datasets = calc_per_capita_consumptions(users, dt, session)
+    mappings = []
+    for meter_id, inhabitants in users:
+        if meter_id not in datasets:
+            continue
 
         try:
-            # Check if entry exists
-            pcc_today = session.query(PerCapitaConsumption).filter_by(
-                date=dt, meter_id=user.meter_id).first()
-            # Create today's entry if it does not exist
-            if not pcc_today:
-                dataset = calc_per_capita_consumption(
-                    user.meter_id, user.inhabitants, dt, session)
-                # If there are no yesterday's values in the database for this user,
-                # define the base values
-                if dataset is None:
-                    dataset = define_base_values(user.inhabitants, dt)
-            # Create PerCapitaConsumption instance
-                session.add(PerCapitaConsumption(dt, user.meter_id, dataset['consumption'],
-                                                 dataset['consumption_cumulated'],
-                                                 dataset['inhabitants'],
-                                                 dataset['per_capita_consumption'],
-                                                 dataset['per_capita_consumption_cumulated'],
-                                                 dataset['days'],
-                                                 dataset['moving_average'],
-                                                 dataset['moving_average_annualized']))
+            dataset = datasets[meter_id]
+            # If there are no yesterday's values in the database for this user,
+            # define the base values
+            if dataset is None:
+                dataset = define_base_values(inhabitants, dt)
+            mappings.append(dict(date=dt, meter_id=meter_id,
+                                 consumption=dataset['consumption'],
+                                 consumption_cumulated=dataset['consumption_cumulated'],
+                                 inhabitants=dataset['inhabitants'],
+                                 per_capita_consumption=dataset['per_capita_consumption'],
+                                 per_capita_consumption_cumulated=dataset[
+                                     'per_capita_consumption_cumulated'],
+                                 days=dataset['days'],
+                                 moving_average=dataset['moving_average'],
+                                 moving_average_annualized=dataset[
+                                     'moving_average_annualized']))
+
         except Exception as e:
             message = exception_message(e)
             logger.error(message)
+            continue
 
-    session.commit()
+    try:
+        session.bulk_insert_mappings(PerCapitaConsumption, mappings)
+        session.commit()
+
+    except Exception as e:
+        message = exception_message(e)
+        logger.error(message)
+        session.rollback()
+
+
+def estimate_energy_savings(start, session):
+    """ Calculate the estimated energy saving of each user and of all users
+    in one pass.
+    :param datetime.date start: the start date of the given term
+    :param sqlalchemy.orm.scoping.scoped_session session: the database session
+    :returns: the estimated energy saving of each user mapped to their meter
+    id and the estimated energy saving of all users in the given term
+    :rtype: tuple(dict, float)
+    """
+
+    return calc_estimated_energy_savings(get_all_user_meter_ids(session), start)
 
 
 def estimate_energy_saving_each_user(start, session):
@@ -200,12 +237,7 @@ def estimate_energy_saving_each_user(start, session):
     :rtype: dict
     """
 
-    savings = dict()
-    for meter_id in get_all_user_meter_ids(session):
-        saving = calc_estimated_energy_saving(meter_id, start)
-        savings[meter_id] = saving
-
-    return savings
+    return estimate_energy_savings(start, session)[0]
 
 
 def estimate_energy_saving_all_users(start, session):
@@ -218,10 +250,4 @@ def estimate_energy_saving_all_users(start, session):
     :rtype: float
     """
 
-    savings = 0.0
-    for meter_id in get_all_user_meter_ids(session):
-        saving = calc_estimated_energy_saving(meter_id, start)
-        if saving is not None:
-            savings += saving
-
-    return savings
+    return estimate_energy_savings(start, session)[1]
@@ -1,8 +1,10 @@
+from collections import defaultdict
 import json
 import os
 import math
 from os import path
 import time as stdlib_time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime, timedelta
 import logging.config
 from discovergy.discovergy import Discovergy
@@ -10,10 +12,18 @@ import redis
 from util.error import exception_message
 from util.database import create_session
 from util.date_helpers import calc_support_year_start, calc_term_boundaries,\
-    calc_end, calc_support_week_start, calc_two_days_back
+    calc_end, calc_support_week_start, calc_two_days_back, calc_quarter_hour_index
 from util.sqlite_helpers import get_all_meter_ids, write_baselines,\
-    write_savings, write_base_values_or_per_capita_consumption
-from util.redis_helpers import get_keys_date_hour_prefix, get_entry_date
+    write_savings, write_base_values_or_per_capita_consumption, get_all_group_ids
+from util.redis_helpers import index_reading, PipelineWriter, get_high_water_marks,\
+    reading_index_key, power_accumulator_key, average_power_key, append_packed_reading,\
+    PACKED_READINGS, METER_UPDATES_CHANNEL, group_consumption_history_key, disaggregation_key,\
+    reading_key, last_reading_key, last_disaggregation_key,\
+    strip_namespace, get_reading_keys, get_entry_dates, calc_day_bounds, calc_rollup,\
+    merge_rollups, hourly_rollup_key, daily_rollup_key, packed_readings_key,\
+    update_day_readings, remove_disaggregations, first_day_reading_key, last_day_reading_key,\
+    MGET_CHUNK_SIZE
+from util.migrate_reading_index import migrate as index_legacy_readings
 
 
 log_file_path = path.join(path.dirname(
@@ -26,8 +36,29 @@ password = os.environ['DISCOVERGY_PASSWORD']
 redis_host = os.environ['REDIS_HOST']
 redis_port = os.environ['REDIS_PORT']
 redis_db = os.environ['REDIS_DB']
-last_data_flush = None
-end_next_interval = None
+pipeline_flush_size = 1000
+fetch_concurrency = int(os.environ.get('DISCOVERGY_FETCH_CONCURRENCY', 8))
+fetch_timeout = int(os.environ.get('DISCOVERGY_FETCH_TIMEOUT', 60))
+# Readings older than this number of days are compacted into hourly and daily
+# rollups and older disaggregation values are removed, 0 keeps all of them.
+# Must exceed the one-week interval of the backfilled readings, otherwise their
+# high-water marks get compacted.
+reading_retention_days = int(os.environ.get('REDIS_READING_RETENTION_DAYS', 90))
+job_runtimes_key = 'task_job_runtimes'
+job_overruns_key = 'task_job_overruns'
+reading_high_water_marks_key = 'reading_high_water_marks'
+disaggregation_high_water_marks_key = 'disaggregation_high_water_marks'
+
+
+def calc_quarter_hour_end(timestamp):
+    """ Calculate the end of the quarter-hour a reading belongs to. A
+    quarter-hour includes its end, but not its begin.
+    :param float timestamp: the reading's unix timestamp in seconds
+    :return: the UTC end of the quarter-hour
+    :rtype: datetime
+    """
+
+    return datetime.utcfromtimestamp(math.ceil(timestamp / 900) * 900)
 
 
 def check_and_nullify_power_value(reading, meter_id):
@@ -46,6 +77,120 @@ def check_and_nullify_power_value(reading, meter_id):
     return reading
 
 
+def write_reading(writer, meter_id, reading):
+    """ Buffer the writes of a reading obtained from discovergy, i.e. the
+    reading itself, its index entry, the first and last readings of its
+    day and, if enabled, its packed encoding.
+    :param util.redis_helpers.PipelineWriter writer: the pipeline writer
+    :param str meter_id: the meter id the reading belongs to
+    :param dict reading: the reading obtained from discovergy
+    """
+
+    adjusted_reading = check_and_nullify_power_value(reading, meter_id)
+    timestamp = adjusted_reading['time']
+
+    # Convert unix epoch time in milliseconds to UTC format
+    new_timestamp = datetime.utcfromtimestamp(timestamp/1000).\
+        strftime('%Y-%m-%d %H:%M:%S')
+
+    key = reading_key(meter_id, new_timestamp)
+
+    # Write adjusted reading to redis database as key-value-pair
+    # The unique key consists of the namespace 'r:', the meter
+    # id, the separator '_' and the UTC timestamp (19 chars)
+    data = dict(type='reading',
+                values=adjusted_reading['values'])
+    writer.set(key, json.dumps(data))
+    index_reading(writer, meter_id, key, timestamp/1000)
+    update_day_readings(writer, meter_id, timestamp/1000,
+                        adjusted_reading['values'])
+    if PACKED_READINGS:
+        append_packed_reading(writer, meter_id, timestamp/1000,
+                              adjusted_reading['values'])
+
+
+def lookup_reading(pipeline, meter_id, timestamp):
+    """ Queue the lookup whether the reading of the given meter id at the
+    given time is stored, with or without namespace.
+    :param pipeline: the redis pipeline to queue the lookup in
+    :param str meter_id: the meter id the reading belongs to
+    :param str timestamp: the UTC time in the format '%Y-%m-%d %H:%M:%S'
+    """
+
+    key = reading_key(meter_id, timestamp)
+    pipeline.exists(key, strip_namespace(key))
+
+
+def lookup_disaggregation(pipeline, meter_id, timestamp):
+    """ Queue the lookup whether the disaggregation value of the given meter
+    id at the given time is stored in the hash of its day.
+    :param pipeline: the redis pipeline to queue the lookup in
+    :param str meter_id: the meter id the disaggregation value belongs to
+    :param str timestamp: the UTC time in the format '%Y-%m-%d %H:%M:%S'
+    """
+
+    pipeline.hexists(disaggregation_key(meter_id, timestamp[:10]), timestamp)
+
+
+def calc_day_rollups(entries, hourly_rollups, daily_rollup):
+    """ Calculate the hourly and daily rollups of a day's readings, merged
+    with the rollups of the day stored before.
+    :param list entries: the readings' dates and data, sorted by date
+    :param dict hourly_rollups: the stored hourly rollups mapped to the UTC
+    begin of their hour
+    :param daily_rollup: the stored daily rollup or None
+    :returns: the hourly rollups mapped to the UTC begin of their hour and
+    the daily rollup
+    :rtype: tuple
+    """
+
+    hours = defaultdict(list)
+    for entry in entries:
+        hours[entry[0].strftime('%Y-%m-%d %H:00:00')].append(entry)
+
+    return ({hour: merge_rollups(hourly_rollups.get(hour), calc_rollup(hour_entries))
+             for hour, hour_entries in hours.items()},
+            merge_rollups(daily_rollup, calc_rollup(entries)))
+
+
+def remove_compacted_day_readings(redis_client, cutoff):
+    """ Remove the first and last readings of the days before the cutoff
+    whose readings were compacted into a daily rollup, which holds the same
+    energies. The keys are found with one scan of the redis database each.
+    :param int cutoff: the unix timestamp of the begin of the oldest day to
+    keep
+    :returns: the number of removed keys
+    :rtype: int
+    """
+
+    keys = []
+    for pattern in '*_first', '*_last':
+        for key in redis_client.scan_iter(pattern, 1000):
+            # The keys consist of the meter id, the date and the suffix
+            meter_id, _, date = strip_namespace(key.decode('utf-8')).rpartition('_')[0]\
+                .partition('_')
+            try:
+                if calc_day_bounds(date)[0] < cutoff:
+                    keys.append((key, meter_id, date))
+
+            except ValueError:
+                # Keys without date like the last readings are kept
+                continue
+
+    removed = 0
+    for i in range(0, len(keys), MGET_CHUNK_SIZE):
+        chunk = keys[i:i + MGET_CHUNK_SIZE]
+        pipeline = redis_client.pipeline(transaction=False)
+        for _, meter_id, date in chunk:
+            pipeline.hexists(daily_rollup_key(meter_id), date)
+        compacted = [key for (key, _, _), exists in zip(chunk, pipeline.execute()) if exists]
+        if len(compacted) > 0:
+            redis_client.delete(*compacted)
+            removed += len(compacted)
+
+    return removed
+
+
 class Task:
     """ Handle discovergy login, data retrieval, populating and updating the
     redis database. """
@@ -54,39 +199,170 @@ class Task:
         self.d = Discovergy(client_name)
         self.redis_client = redis.Redis(
             host=redis_host, port=redis_port, db=redis_db)  # connect to server
-
-        # pylint: disable=global-statement
-        global end_next_interval
-        # set end_next_interval to end of next quarter-hour
-        current_time = datetime.utcnow()
-        nsecs = current_time.minute * 60 + current_time.second + \
-                current_time.microsecond * 1e-6
-        delta = math.ceil(nsecs / 900) * 900 - nsecs
-        end_next_interval = current_time + timedelta(seconds=delta)
-
+        self.pipeline_stats = {}
+        self.fetch_stats = {}
+        # One pool for all jobs, so that threads stuck in abandoned fetches
+        # occupy its workers instead of piling up in new pools
+        self.fetch_executor = ThreadPoolExecutor(max_workers=fetch_concurrency)
 
     def login(self):
         """ Authenticate against the discovergy backend. """
 
         self.d.login(email, password)
 
+    def record_pipeline_stats(self, job, writer):
+        """ Flush the given pipeline writer and record how many commands it
+        flushed and how long the flushes took.
+        :param str job: the name of the job the writer was used by
+        :param util.redis_helpers.PipelineWriter writer: the pipeline writer
+        """
+
+        writer.flush()
+        self.pipeline_stats[job] = dict(commands=writer.flushed_commands,
+                                        flushes=len(writer.flush_durations),
+                                        seconds=sum(writer.flush_durations),
+                                        max_seconds=max(writer.flush_durations, default=0.0))
+        message = '{} flushed {} redis commands in {} flushes within {:.3f} s (max {:.3f} s)'.\
+            format(job, writer.flushed_commands, len(writer.flush_durations),
+                   self.pipeline_stats[job]['seconds'], self.pipeline_stats[job]['max_seconds'])
+        logger.info(message)
+
+    def fetch_concurrently(self, job, meter_ids, fetch):
+        """ Call the given discovergy fetch function for all meter ids in the
+        task's bounded thread pool of fetch_concurrency workers and yield the
+        results in the calling thread as they arrive, so that a single writer
+        handles all redis writes. Failing meters are logged and skipped, meters
+        whose fetch takes longer than fetch_timeout seconds are abandoned.
+        :param str job: the name of the job fetching the data
+        :param list meter_ids: the meter ids to fetch the data for
+        :param fetch: the function fetching the data for one meter id
+        :returns: generator of (meter_id, result) tuples
+        """
+
+        stats = dict(meters=len(meter_ids), fetched=0, errors=0, timeouts=0)
+        self.fetch_stats[job] = stats
+        started = {}
+
+        def timed_fetch(meter_id):
+            started[meter_id] = stdlib_time.monotonic()
+            return fetch(meter_id)
+
+        pending = {self.fetch_executor.submit(timed_fetch, meter_id): meter_id
+                   for meter_id in meter_ids}
+
+        # Abandon all meters left once each of them could have been fetched
+        # within the timeout, so that workers stuck in abandoned fetches
+        # cannot stall the job
+        job_deadline = stdlib_time.monotonic() + fetch_timeout * (
+            math.ceil(len(meter_ids) / fetch_concurrency) + 1)
+        try:
+            while pending:
+                done = wait(pending, timeout=1, return_when=FIRST_COMPLETED).done
+                for future in done:
+                    meter_id = pending.pop(future)
+                    try:
+                        result = future.result()
+
+                    except Exception as e:
+                        stats['errors'] += 1
+                        message = exception_message(e)
+                        logger.error(message)
+                        continue
+
+                    stats['fetched'] += 1
+                    yield meter_id, result
+
+                self.abandon_fetches(job, pending, started, job_deadline)
+
+        finally:
+            # Drop the fetches which have not started yet from the shared pool
+            for future in pending:
+                future.cancel()
+            message = '{} fetched data for {} of {} meters ({} errors, {} timeouts)'.format(
+                job, stats['fetched'], stats['meters'], stats['errors'], stats['timeouts'])
+            logger.info(message)
+
+    def abandon_fetches(self, job, pending, started, job_deadline):
+        """ Remove the fetches which took longer than fetch_timeout seconds
+        since they started or which are still pending after the job's deadline
+        from the pending fetches.
+        :param str job: the name of the job fetching the data
+        :param dict pending: the meter ids of the pending fetches mapped to
+        their futures
+        :param dict started: the monotonic start times of the fetches mapped
+        to their meter ids
+        :param float job_deadline: the monotonic time after which all pending
+        fetches are abandoned
+        """
+
+        now = stdlib_time.monotonic()
+        for future, meter_id in list(pending.items()):
+            if now > job_deadline or \
+                    (meter_id in started and now - started[meter_id] > fetch_timeout):
+                del pending[future]
+                future.cancel()
+                self.fetch_stats[job]['timeouts'] += 1
+                message = '{} timed out after {} s for metering id {}'.format(
+                    job, fetch_timeout, meter_id)
+                logger.error(message)
+
+    def calc_fetch_starts(self, meter_ids, high_water_marks_key, backfill_start, lookup_entry):
+        """ Calculate the timestamp to fetch data from for each meter id. This
+        is the meter's high-water mark, i.e. the time of the newest entry
+        already stored. New meters, meters whose high-water mark lies before
+        the backfill start and meters whose high-water mark entry is missing
+        in the redis database are backfilled from the backfill start.
+        :param list meter_ids: the meter ids to calculate the start for
+        :param str high_water_marks_key: the key of the high-water marks hash
+        :param int backfill_start: the unix timestamp in milliseconds to
+        backfill from
+        :param lookup_entry: the function queueing the lookup of an entry in a
+        pipeline from its meter id and UTC time, which results in a true value
+        if the entry is stored
+        :returns: the unix timestamps in milliseconds mapped to their meter ids
+        :rtype: dict
+        """
+
+        high_water_marks = get_high_water_marks(self.redis_client, high_water_marks_key)
+        candidates = [meter_id for meter_id in meter_ids
+                      if high_water_marks.get(meter_id, backfill_start) > backfill_start]
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for meter_id in candidates:
+            lookup_entry(pipeline, meter_id, datetime.utcfromtimestamp(
+                high_water_marks[meter_id]/1000).strftime('%Y-%m-%d %H:%M:%S'))
+
+        starts = {meter_id: backfill_start for meter_id in meter_ids}
+        for meter_id, exists in zip(candidates, pipeline.execute()):
+            if exists:
+                starts[meter_id] = high_water_marks[meter_id]
+            else:
+                message = 'Gap detected for metering id {}, backfilling from {}'.format(
+                    meter_id, backfill_start)
+                logger.info(message)
+
+        return starts
+
     def write_readings(self, session, end):
         """ Get all readings for all meters from one the beginning of the BAFA support
         year until now with one-week interval (this is the finest granularity we get for one
         year back in time, cf. https://api.discovergy.com/docs/) and write them
-        to the redis database.
+        to the redis database. Meters which were already backfilled are only
+        fetched from their newest stored reading on.
         :param sqlalchemy.orm.scoping.scoped_session session: the database session
         :param int end: end of interval in the format required by the
         discovergy API
         """
 
-        for meter_id in get_all_meter_ids(session):
+        writer = PipelineWriter(self.redis_client, pipeline_flush_size)
+        meter_ids = get_all_meter_ids(session)
+        starts = self.calc_fetch_starts(meter_ids, reading_high_water_marks_key,
+                                        calc_support_year_start(), lookup_reading)
+        for meter_id, readings in self.fetch_concurrently(
+                'write_readings', meter_ids,
+                lambda meter_id: self.d.get_readings(meter_id, starts[meter_id], end,
+                                                     'one_week')):
 
             try:
-                readings = self.d.get_readings(meter_id,
-                                               calc_support_year_start(), end,
-                                               'one_week')
-
                 if readings == []:
                     message = 'No readings available for metering id {}'.format(
                         meter_id)
@@ -94,37 +370,28 @@ class Task:
                     continue
 
                 for reading in readings:
-                    adjusted_reading = check_and_nullify_power_value(reading,
-                                                                     meter_id)
-                    timestamp = adjusted_reading['time']
+                    write_reading(writer, meter_id, reading)
 
-                    # Convert unix epoch time in milliseconds to UTC format
-                    new_timestamp = datetime.utcfromtimestamp(timestamp/1000).\
-                        strftime('%Y-%m-%d %H:%M:%S')
-
-                    key = meter_id + '_' + str(new_timestamp)
-
-                    # Write adjusted reading to redis database as key-value-pair
-                    # The unique key consists of the meter id (16 chars), the
-                    # separator '_' and the UTC timestamp (19 chars)
-                    data = dict(type='reading',
-                                values=adjusted_reading['values'])
-                    self.redis_client.set(key, json.dumps(data))
+                # Record the newest reading once all readings are stored
+                writer.hset_progress(reading_high_water_marks_key, meter_id,
+                                     max(reading['time'] for reading in readings))
 
             except Exception as e:
                 message = exception_message(e)
                 logger.error(message)
 
+        self.record_pipeline_stats('write_readings', writer)
+
     def write_last_readings(self, session):
         """ Get the last reading for all meters and write them to the redis
         database.
         :param sqlalchemy.orm.scoping.scoped_session session: the database session
         """
 
-        for meter_id in get_all_meter_ids(session):
+        for meter_id, reading in self.fetch_concurrently(
+                'write_last_readings', get_all_meter_ids(session), self.d.get_last_reading):
 
             try:
-                reading = self.d.get_last_reading(meter_id)
                 if reading == {}:
                     message = 'No last reading available for metering id {}'.format(
                         meter_id)
@@ -135,40 +402,100 @@ class Task:
                     reading, meter_id)
                 reading_timestamp = str(datetime.utcfromtimestamp(
                     adjusted_reading['time']/1000).strftime('%F %T'))
-                key = meter_id + '_' + reading_timestamp
-                date_key = datetime.utcnow().strftime('%Y-%m-%d')
+                key = reading_key(meter_id, reading_timestamp)
                 # Write reading to redis database as key-value-pair
-                # The unique key consists meter id, separator '_' and UTC
-                # timestamp
+                # The unique key consists of the namespace 'r:', the meter id,
+                # the separator '_' and the UTC timestamp
                 data = dict(type='reading', values=adjusted_reading['values'])
                 self.redis_client.set(key, json.dumps(data))
-                self.redis_client.set(meter_id + '_last', json.dumps(data))
-                data["time"] = reading_timestamp
-                self.redis_client.set(meter_id + '_' + date_key + '_last', json.dumps(data))
-
-                if self.redis_client.get(meter_id + '_' + date_key + '_first') is None:
-                    self.redis_client.set(meter_id + '_' + date_key + '_first', json.dumps(data))
+                new_reading = index_reading(self.redis_client, meter_id, key,
+                                            adjusted_reading['time']/1000)
+                if new_reading:
+                    self.accumulate_power(meter_id, adjusted_reading)
+                    if PACKED_READINGS:
+                        append_packed_reading(self.redis_client, meter_id,
+                                              adjusted_reading['time']/1000,
+                                              adjusted_reading['values'])
+                self.redis_client.set(last_reading_key(meter_id), json.dumps(data))
+                update_day_readings(self.redis_client, meter_id,
+                                    adjusted_reading['time']/1000, adjusted_reading['values'])
+
+                if new_reading:
+                    # Notify the web process so that it pushes the new reading
+                    self.redis_client.publish(METER_UPDATES_CHANNEL, meter_id)
 
             except Exception as e:
                 message = exception_message(e)
                 logger.error(message)
 
+    def accumulate_power(self, meter_id, reading):
+        """ Add a new reading's power value to the running sum and count of its
+        quarter-hour, so that the average power can be finalized without
+        reading the quarter-hour's readings again.
+        :param str meter_id: the meter id the reading belongs to
+        :param dict reading: the reading obtained from discovergy
+        """
+
+        interval_end = calc_quarter_hour_end(reading['time']/1000)
+        date_interval = (interval_end - timedelta(minutes=15)).strftime('%Y-%m-%d')
+        field = interval_end.strftime('%Y-%m-%d %H:%M:%S')
+        key = power_accumulator_key(meter_id, date_interval)
+        pipeline = self.redis_client.pipeline(transaction=False)
+        pipeline.hincrbyfloat(key, field + ':sum', reading['values'].get('power', 0))
+        pipeline.hincrby(key, field + ':count', 1)
+        pipeline.expire(key, int(timedelta(days=3).total_seconds()))
+        pipeline.execute()
+
+    def calc_missing_term_boundaries(self, meter_ids):
+        """ Look up which term boundaries of previous and ongoing terms each
+        meter lacks. A boundary counts as stored if the last hourly reading of
+        its day, which is only fetched for the boundaries, is stored or if the
+        day was compacted.
+        :param list meter_ids: the meter ids to look up the boundaries for
+        :returns: the missing term boundaries and the ends of their days as
+        unix timestamps in milliseconds mapped to the meter ids
+        :rtype: dict
+        """
+
+        intervals = [(timestamp, round((datetime.utcfromtimestamp(
+            timestamp/1000) + timedelta(hours=24, minutes=59,
+                                        seconds=59)).timestamp() * 1000))
+                     for timestamp in calc_term_boundaries()]
+        pipeline = self.redis_client.pipeline(transaction=False)
+        for meter_id in meter_ids:
+            for timestamp, end_of_day in intervals:
+                pipeline.zcount(reading_index_key(meter_id),
+                                timestamp/1000 + 24 * 60 * 60, end_of_day/1000)
+                pipeline.hexists(daily_rollup_key(meter_id), datetime.utcfromtimestamp(
+                    timestamp/1000).strftime('%Y-%m-%d'))
+        results = iter(pipeline.execute())
+        stored = iter([count > 0 or compacted for count, compacted in zip(results, results)])
+        return {meter_id: [interval for interval in intervals if not next(stored)]
+                for meter_id in meter_ids}
+
     def write_energy_consumption(self, session):
         """ Get readings for all meters at start and end dates of
-        previous and ongoing terms and write them to the redis database.
+        previous and ongoing terms and write them to the redis database. Term
+        boundaries for which a meter already has readings are skipped.
         :param sqlalchemy.orm.scoping.scoped_session session: the database session
         """
 
-        for meter_id in get_all_meter_ids(session):
+        writer = PipelineWriter(self.redis_client, pipeline_flush_size)
+        meter_ids = get_all_meter_ids(session)
+        missing_intervals = self.calc_missing_term_boundaries(meter_ids)
 
-            try:
-                for timestamp in calc_term_boundaries():
-                    end_of_day = round((datetime.utcfromtimestamp(
-                        timestamp/1000) + timedelta(hours=24, minutes=59,
-                                                    seconds=59)).timestamp() * 1000)
+        def fetch(meter_id):
+            term_readings = []
+            for timestamp, end_of_day in missing_intervals[meter_id]:
+                term_readings.append(self.d.get_readings(meter_id, timestamp,
+                                                         end_of_day, 'one_hour'))
+            return term_readings
+
+        for meter_id, term_readings in self.fetch_concurrently(
+                'write_energy_consumption', meter_ids, fetch):
 
-                    readings = self.d.get_readings(meter_id, timestamp,
-                                                   end_of_day, 'one_hour')
+            try:
+                for readings in term_readings:
 
                     if readings == []:
                         message = 'No readings available for metering id {}'.format(
@@ -177,43 +504,37 @@ class Task:
                         continue
 
                     for reading in readings:
-                        adjusted_reading = check_and_nullify_power_value(
-                            reading, meter_id)
-                        timestamp = adjusted_reading['time']
-
-                        # Convert unix epoch time in milliseconds to UTC format
-                        new_timestamp = datetime.utcfromtimestamp(
-                            timestamp/1000).strftime('%Y-%m-%d %H:%M:%S')
-
-                        key = meter_id + '_' + str(new_timestamp)
-
-                        # Write adjusted reading to redis database as key-value-pair
-                        data = dict(type='reading',
-                                    values=adjusted_reading['values'])
-                        self.redis_client.set(key, json.dumps(data))
+                        write_reading(writer, meter_id, reading)
 
             except Exception as e:
                 message = exception_message(e)
                 logger.error(message)
 
+        self.record_pipeline_stats('write_energy_consumption', writer)
+
     def write_disaggregations(self, session, end):
         """ Get all disaggregation values for all meters from one week back
         until now. This is the earliest data we get, otherwise you'll end up
         with a '400 Bad Request: Duration of the data cannot be larger than 1
         week. Please try for a smaller duration.' If one week back lies before
         the current BAFA support year start, start with that value instead.
+        Meters which were already backfilled are only fetched from their newest
+        stored disaggregation value on.
         :param sqlalchemy.orm.scoping.scoped_session session: the database session
         :param int end: end of interval in the format required by the
         discovergy API
         """
 
-        for meter_id in get_all_meter_ids(session):
+        writer = PipelineWriter(self.redis_client, pipeline_flush_size)
+        meter_ids = get_all_meter_ids(session)
+        starts = self.calc_fetch_starts(meter_ids, disaggregation_high_water_marks_key,
+                                        calc_support_week_start(), lookup_disaggregation)
+        for meter_id, disaggregation in self.fetch_concurrently(
+                'write_disaggregations', meter_ids,
+                lambda meter_id: self.d.get_disaggregation(meter_id, starts[meter_id], end)):
 
             try:
 
-                disaggregation = self.d.get_disaggregation(
-                    meter_id, calc_support_week_start(), end)
-
                 if disaggregation == {}:
                     message = 'No disaggregation available for metering id {}'.format(
                         meter_id)
@@ -225,19 +546,22 @@ class Task:
                     # Convert unix epoch time in milliseconds to UTC format
                     new_timestamp = datetime.utcfromtimestamp(
                         int(timestamp)/1000).strftime('%Y-%m-%d %H:%M:%S')
-                    key = meter_id + '_' + str(new_timestamp)
 
-                    # Write disaggregation to redis database as key-value-pair
-                    # The unique key consists of meter id, separator '_' and UTC timestamp
-                    data = dict(type='disaggregation',
-                                values=disaggregation[timestamp])
+                    # Add the disaggregation to the meter's disaggregation
+                    # values of the day
+                    writer.hset(disaggregation_key(meter_id, new_timestamp[:10]),
+                                new_timestamp, json.dumps(disaggregation[timestamp]))
 
-                    self.redis_client.set(key, json.dumps(data))
+                # Record the newest value once all values are stored
+                writer.hset_progress(disaggregation_high_water_marks_key, meter_id,
+                                     max(int(timestamp) for timestamp in disaggregation))
 
             except Exception as e:
                 message = exception_message(e)
                 logger.error(message)
 
+        self.record_pipeline_stats('write_disaggregations', writer)
+
     def write_last_disaggregations(self, session):
         """ Get the last disaggregation values for all meters and write them to the redis
         database.
@@ -245,12 +569,12 @@ class Task:
         """
 
         two_days_back = calc_two_days_back()
-        for meter_id in get_all_meter_ids(session):
+        end = calc_end()
+        for meter_id, disaggregation in self.fetch_concurrently(
+                'write_last_disaggregations', get_all_meter_ids(session),
+                lambda meter_id: self.d.get_disaggregation(meter_id, two_days_back, end)):
 
             try:
-                disaggregation = self.d.get_disaggregation(
-                    meter_id, two_days_back, calc_end())
-
                 if disaggregation in ({}, []):
                     message = 'No disaggregation available for metering id {}'.format(
                         meter_id)
@@ -265,70 +589,165 @@ class Task:
                     new_timestamp = datetime.utcfromtimestamp(int(timestamp)/1000).\
                         strftime('%Y-%m-%d %H:%M:%S')
 
-                    key = meter_id + '_' + str(new_timestamp)
-
-                    # Write disaggregation to redis database as key-value-pair
-                    # The unique key consists of meter id (16 chars), separator '_' and UTC
-                    # timestamp
+                    # Write the last disaggregation and add it to the meter's
+                    # disaggregation values of the day
                     data = dict(type='disaggregation',
                                 values=disaggregation[timestamp])
 
-                    self.redis_client.set(meter_id + '_last_disaggregation', json.dumps(data))
-                    self.redis_client.set(key, json.dumps(data))
+                    self.redis_client.set(last_disaggregation_key(meter_id), json.dumps(data))
+                    self.redis_client.hset(disaggregation_key(meter_id, new_timestamp[:10]),
+                                           new_timestamp, json.dumps(disaggregation[timestamp]))
 
             except Exception as e:
                 message = exception_message(e)
                 logger.error(message)
 
-    def calculate_average_power(self, session):
-        # pylint: disable=global-statement
-        global end_next_interval
+    def calculate_average_power(self, session, end_next_interval):
+        """ Calculate the average power of all meters in the quarter-hour
+        ending with the given datetime from the accumulated power values and
+        add it to the hash of the meters' average power values of that day.
+        :param sqlalchemy.orm.scoping.scoped_session session: the database session
+        :param datetime end_next_interval: the UTC end of the quarter-hour
+        """
+
         date_interval = (end_next_interval - timedelta(minutes=15)).strftime("%Y-%m-%d")
-        hour_interval = (end_next_interval - timedelta(minutes=15)).strftime("%H")
+        field = end_next_interval.strftime("%Y-%m-%d %H:%M:%S")
 
         for meter_id in get_all_meter_ids(session):
-            average_power_key = 'average_power_' + meter_id + '_' + date_interval
-            power_sum = 0
-            divider = 0
-            for key in get_keys_date_hour_prefix(self.redis_client, meter_id, date_interval,
-                                                 hour_interval):
-
-                reading_date, data = get_entry_date(self.redis_client, meter_id, key, 'reading')
-
-                if reading_date is None or data is None:
-                    continue
-
-                reading_timestamp = reading_date.timestamp()
+            power_sum, divider = self.redis_client.hmget(
+                power_accumulator_key(meter_id, date_interval), field + ':sum',
+                field + ':count')
 
-                if ((end_next_interval - timedelta(minutes=15)).timestamp() < reading_timestamp
-                        <= end_next_interval.timestamp()):
-                    power_sum += data.get('values').get('power')
-                    divider += 1
-
-            if divider != 0:
-                average = power_sum / divider
+            if divider is not None and int(divider) != 0:
+                average = float(power_sum) / int(divider)
             else:
                 average = 0
                 message = f"No readings available for {meter_id} between " \
                           f"{(end_next_interval - timedelta(minutes=15))} and {end_next_interval}"
                 logger.info(message)
 
-            if len(self.redis_client.keys(average_power_key)) == 0:
-                data = {end_next_interval.strftime("%Y-%m-%d %H:%M:%S"): average}
+            key = average_power_key(meter_id, date_interval)
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.hset(key, field, average)
+            pipeline.expire(key, int(timedelta(days=3).total_seconds()))
+            try:
+                pipeline.execute()
+
+            except redis.exceptions.ResponseError:
+                # Replace average power values stored as JSON string by
+                # previous versions
+                self.redis_client.delete(key)
+                pipeline.hset(key, field, average)
+                pipeline.expire(key, int(timedelta(days=3).total_seconds()))
+                pipeline.execute()
+
+        # Drop the group consumption history responses cached before the new
+        # average power values were available
+        keys = [group_consumption_history_key(group_id, end_next_interval.strftime('%Y-%m-%d'),
+                                              calc_quarter_hour_index(end_next_interval))
+                for group_id in get_all_group_ids(session)]
+        if len(keys) > 0:
+            self.redis_client.delete(*keys)
+
+    def compact_meter_readings(self, meter_id, cutoff):
+        """ Downsample the readings of the given meter id before the cutoff
+        into hourly and daily rollups and remove them together with the day's
+        first and last readings and disaggregation values, one day at a time.
+        Rollups of days compacted before are merged with the new ones.
+        :param str meter_id: the meter id whose readings to compact
+        :param int cutoff: the unix timestamp of the begin of the oldest day
+        to keep
+        :returns: the number of removed readings
+        :rtype: int
+        """
+
+        index_key = reading_index_key(meter_id)
+        compacted = 0
+        while True:
+            oldest = self.redis_client.zrangebyscore(index_key, '-inf', '(' + str(cutoff),
+                                                     start=0, num=1, withscores=True)
+            if len(oldest) == 0:
+                return compacted
+
+            date = datetime.utcfromtimestamp(oldest[0][1]).strftime('%Y-%m-%d')
+            begin, end = calc_day_bounds(date)
+            keys = get_reading_keys(self.redis_client, meter_id, begin, '(' + str(end))
+            entries = get_entry_dates(self.redis_client, meter_id, keys, 'reading')
+
+            pipeline = self.redis_client.pipeline(transaction=False)
+            pipeline.hgetall(hourly_rollup_key(meter_id, date))
+            pipeline.hget(daily_rollup_key(meter_id), date)
+            hourly_rollups, daily_rollup = pipeline.execute()
+
+            # Write the rollups and remove the readings atomically so that
+            # readers never miss the day's data
+            pipeline = self.redis_client.pipeline()
+            if len(entries) > 0:
+                hourly_rollups, daily_rollup = calc_day_rollups(
+                    entries, {hour.decode('utf-8'): json.loads(rollup)
+                              for hour, rollup in hourly_rollups.items()},
+                    json.loads(daily_rollup) if daily_rollup is not None else None)
+                pipeline.hset(hourly_rollup_key(meter_id, date), mapping={
+                    hour: json.dumps(rollup) for hour, rollup in hourly_rollups.items()})
+                pipeline.hset(daily_rollup_key(meter_id), date, json.dumps(daily_rollup))
+            for i in range(0, len(keys), MGET_CHUNK_SIZE):
+                pipeline.delete(*keys[i:i + MGET_CHUNK_SIZE])
+            pipeline.zremrangebyscore(index_key, begin, '(' + str(end))
+            pipeline.delete(packed_readings_key(meter_id, date),
+                            power_accumulator_key(meter_id, date),
+                            disaggregation_key(meter_id, date))
+            # The daily rollup holds the energies of the day's first and
+            # last readings
+            if len(entries) > 0 or daily_rollup is not None:
+                pipeline.delete(first_day_reading_key(meter_id, date),
+                                last_day_reading_key(meter_id, date),
+                                strip_namespace(first_day_reading_key(meter_id, date)),
+                                strip_namespace(last_day_reading_key(meter_id, date)))
+            pipeline.execute()
+            compacted += len(keys)
+
+    def compact_readings(self, deadline):
+        """ Compact the readings older than the retention period of all
+        meters into hourly and daily rollups and remove the disaggregation
+        values and the compacted days' first and last readings older than the
+        retention period.
+        :param float deadline: the unix timestamp the job was scheduled for
+        """
+
+        if reading_retention_days <= 0:
+            return
 
+        cutoff = calc_day_bounds(datetime.utcfromtimestamp(
+            deadline - reading_retention_days * 24 * 60 * 60).strftime('%Y-%m-%d'))[0]
+        session = create_session()
+        for meter_id in get_all_meter_ids(session):
+            try:
+                compacted = self.compact_meter_readings(meter_id, cutoff)
+
+            except Exception as e:
+                message = exception_message(e)
+                logger.error(message)
             else:
-                data = json.loads(self.redis_client.get(average_power_key))
-                data[end_next_interval.strftime("%Y-%m-%d %H:%M:%S")] = average
+                if compacted > 0:
+                    message = 'Compacted {} readings of metering id {}'.format(
+                        compacted, meter_id)
+                    logger.info(message)
+
+        try:
+            removed = remove_disaggregations(self.redis_client, cutoff)
+            removed_day_readings = remove_compacted_day_readings(self.redis_client, cutoff)
 
-            self.redis_client.set(average_power_key, json.dumps(data))
-            self.redis_client.expire(average_power_key, int(timedelta(days=3).total_seconds()))
+        except Exception as e:
+            message = exception_message(e)
+            logger.error(message)
+        else:
+            message = 'Removed {} disaggregation keys and {} day reading keys'.format(
+                removed, removed_day_readings)
+            logger.info(message)
 
     def populate_redis(self):
         """ Populate the redis database with all discovergy data from the past. """
 
-        # pylint: disable=global-statement
-        global last_data_flush
-        last_data_flush = datetime.utcnow()
         end = calc_end()
 
         # Connect to sqlite database
@@ -348,43 +767,159 @@ class Task:
         self.write_energy_consumption(session)
         self.write_disaggregations(session, end)
 
+    def update_live_data(self, deadline):
+        """ Write the latest readings and disaggregation values to the redis
+        database.
+        :param float deadline: the unix timestamp the job was scheduled for
+        """
+
+        message = 'Fill redis at {}'.format(
+            datetime.fromtimestamp(deadline).strftime("%H:%M:%S"))
+        logger.info(message)
+        session = create_session()
+        self.write_last_readings(session)
+        self.write_last_disaggregations(session)
+
+    def update_average_power(self, deadline):
+        """ Calculate the average power of the quarter-hour ending with the
+        deadline.
+        :param float deadline: the unix timestamp the job was scheduled for
+        """
+
+        session = create_session()
+        self.calculate_average_power(session, datetime.utcfromtimestamp(deadline))
+
+    def flush_data(self, deadline):
+        """ Populate the redis database with all discovergy data from the past
+        and write the daily values to the SQLite database.
+        :param float deadline: the unix timestamp the job was scheduled for
+        """
+
+        message = 'Flush data at {}'.format(
+            datetime.fromtimestamp(deadline).strftime("%H:%M:%S"))
+        logger.info(message)
+        self.populate_redis()
+        session = create_session()
+        write_baselines(session)
+        write_savings(session)
+        write_base_values_or_per_capita_consumption(session)
+
     def update_redis(self):
-        """ Update the redis database every 60s with the latest discovergy data. """
+        """ Update the redis database every 60s with the latest discovergy
+        data, calculate the average power every quarter-hour and flush and
+        compact all data every 24h. """
 
         message = 'Started redis task at {}'.format(
             datetime.now().strftime("%H:%M:%S"))
         logger.info(message)
 
-        while True:
-            stdlib_time.sleep(60)
-            message = 'Fill redis at {}'.format(
-                datetime.now().strftime("%H:%M:%S"))
+        # The day lookups only find readings in the time indexes
+        count = index_legacy_readings(self.redis_client, get_all_meter_ids(create_session()))
+        if count > 0:
+            message = 'Indexed {} readings written by previous versions'.format(count)
             logger.info(message)
 
-            # Populate redis if last data flush was more than 24h ago
-            # pylint: disable=global-statement
-            global last_data_flush
-            global end_next_interval
-
-            # Connect to SQLite database
-            session = create_session()
-
-            if (last_data_flush is None) or (datetime.utcnow() -
-                                             last_data_flush >
-                                             timedelta(hours=24)):
-                self.populate_redis()
-                self.write_last_readings(session)
-                self.write_last_disaggregations(session)
-                write_baselines(session)
-                write_savings(session)
-                write_base_values_or_per_capita_consumption(session)
-            else:
-                self.write_last_readings(session)
-                self.write_last_disaggregations(session)
+        scheduler = Scheduler(self.redis_client)
+        scheduler.add_job('flush_data', 24 * 60 * 60, self.flush_data, run_immediately=True)
+        scheduler.add_job('compact_readings', 24 * 60 * 60, self.compact_readings)
+        scheduler.add_job('update_live_data', 60, self.update_live_data)
+        scheduler.add_job('update_average_power', 15 * 60, self.update_average_power,
+                          catch_up=True)
+        scheduler.run()
+
+
+class Scheduler:
+    """ Run jobs periodically at fixed wall-clock deadlines, i.e. at the
+    multiples of their period since the epoch, so that the job runtimes do not
+    delay the following runs. Jobs which catch up replay every deadline which
+    passed while other jobs were running, the other jobs skip them. """
+
+    def __init__(self, redis_client):
+        """ Create a scheduler without jobs.
+        :param redis_client: the redis client to export the job runtimes with
+        """
+
+        self.redis_client = redis_client
+        self.jobs = []
+
+    def add_job(self, name, period, function, run_immediately=False, catch_up=False):
+        """ Add a job to the scheduler. Jobs which are due at the same time
+        run in the order they were added.
+        :param str name: the job's name
+        :param int period: the job's period in seconds
+        :param function: the function to run, called with the unix timestamp
+        of the deadline the run was scheduled for
+        :param bool run_immediately: whether to run the job on start instead
+        of waiting for the first deadline
+        :param bool catch_up: whether to run the job for every missed deadline
+        instead of skipping them
+        """
+
+        now = stdlib_time.time()
+        if run_immediately:
+            next_run = now
+        else:
+            next_run = (math.floor(now / period) + 1) * period
+        self.jobs.append(dict(name=name, period=period, function=function,
+                              next_run=next_run, catch_up=catch_up))
+
+    def run_job(self, job):
+        """ Run the given job, export its runtime and schedule its next
+        deadline, which is the following multiple of its period. Deadlines
+        missed by a job which does not catch up are skipped.
+        :param dict job: the job to run
+        """
+
+        deadline = job['next_run']
+        start = stdlib_time.time()
+        try:
+            job['function'](deadline)
+
+        except Exception as e:
+            message = exception_message(e)
+            logger.error(message)
+
+        end = stdlib_time.time()
+        runtime = end - start
+        logger.info('Job %s ran for %.3f s', job['name'], runtime)
+        try:
+            self.redis_client.hset(job_runtimes_key, job['name'], runtime)
+
+        except Exception as e:
+            message = exception_message(e)
+            logger.error(message)
+
+        # Anchor the next deadline to the wall clock, also after a run on start
+        next_run = (math.floor(deadline / job['period']) + 1) * job['period']
+        if end >= next_run and not job['catch_up']:
+            missed = math.floor(end / job['period']) - math.floor(deadline / job['period'])
+            next_run = (math.floor(end / job['period']) + 1) * job['period']
+            message = 'Job {} overran its period of {} s by {:.3f} s, skipping {} run(s)'.\
+                format(job['name'], job['period'], end - deadline - job['period'], missed)
+            logger.warning(message)
+            try:
+                self.redis_client.hincrby(job_overruns_key, job['name'], missed)
+
+            except Exception as e:
+                message = exception_message(e)
+                logger.error(message)
 
-            if (datetime.utcnow() - end_next_interval) > timedelta(0):
-                self.calculate_average_power(session)
-                end_next_interval = end_next_interval + timedelta(minutes=15)
+        job['next_run'] = next_run
+
+    def run_pending(self):
+        """ Run all jobs which are due. """
+
+        for job in self.jobs:
+            if job['next_run'] <= stdlib_time.time():
+                self.run_job(job)
+
+    def run(self):
+        """ Run the jobs forever. """
+
+        while True:
+            self.run_pending()
+            next_run = min(job['next_run'] for job in self.jobs)
+            stdlib_time.sleep(max(0.0, next_run - stdlib_time.time()))
 
 
 def run():
@@ -1,13 +1,10 @@
 from datetime import datetime
-import json
 import logging.config
 import os
 import redis
-from models.group import Group
-from models.user import User
-from util.database import db
+from util.cache import get_group_parameters
 from util.error import exception_message
-from util.redis_helpers import get_sorted_keys, get_last_reading
+from util.redis_helpers import get_last_reading, get_last_readings
 
 
 logger = logging.getLogger(__name__)
@@ -16,36 +13,99 @@ redis_port = os.environ['REDIS_PORT']
 redis_db = os.environ['REDIS_DB']
 
 
-def get_group_production_meter_ids(user_id):
-    """ Get the group production meter ids from the SQLite database for the given user.
-    :param int user_id: the user's id
-    :returns: the group production meter ids of the group the user belongs to
+def get_production_meter_ids_of_group(group_id):
+    """ Get the production meter ids of the given group from the SQLite database.
+    :param int group_id: the group's id
+    :returns: the group's production meter ids
     :rtype: tuple
     """
 
-    user = db.session.query(User).filter_by(id=user_id).first()
-    group = db.session.query(Group).filter_by(id=user.group_id).first()
+    group = get_group_parameters(group_id)
 
-    return group.group_production_meter_id_first, group.group_production_meter_id_second
+    return group.get('group_production_meter_id_first'),\
+        group.get('group_production_meter_id_second')
 
 
-def get_group_members(user_id):
-    """ Get the parameters from the database to create a group data packet for
-    the given user.
-    :param int user_id: the user's id
+def get_members_of_group(group_id):
+    """ Get the ids, meter ids and inhabitants of all members of the given group
+    from the cache or from the SQLite database.
+    :param int group_id: the group's id
     :return: the group members' ids and inhabitants
     :rtype: [dict]
     """
 
-    user = db.session.query(User).filter_by(id=user_id).first()
-    group_users = db.session.query(User).filter_by(
-        group_id=user.group_id).all()
-    group_members = []
-    for group_user in group_users:
-        group_members.append(dict(id=group_user.id, meter_id=group_user.meter_id,
-                                  inhabitants=group_user.inhabitants))
+    group = get_group_parameters(group_id)
+    if group is None:
+        return []
 
-    return group_members
+    return group.get('members')
+
+
+def get_meter_ids_of_group(group_id):
+    """ Get the meter ids whose readings are part of the live data of the
+    given group, i.e. the production meter ids and the members' meter ids.
+    :param int group_id: the group's id
+    :return: the meter ids
+    :rtype: set
+    """
+
+    meter_ids = {member.get('meter_id') for member in get_members_of_group(group_id)}
+    meter_ids.update(get_production_meter_ids_of_group(group_id))
+    meter_ids.discard(None)
+
+    return meter_ids
+
+
+def create_delta(previous, data):
+    """ Create the changes between two data packages of a group for the
+    clients using the delta protocol.
+    :param dict previous: the data package the clients already have
+    :param dict data: the new data package
+    :return: the new date, the group production if it changed, the id and
+    changed fields of each changed group user and the ids of the removed
+    group users
+    :rtype: dict
+    """
+
+    delta = dict(date=data.get('date'))
+    if data.get('group_production') != previous.get('group_production'):
+        delta['group_production'] = data.get('group_production')
+
+    previous_users = {user.get('id'): user for user in previous.get('group_users', [])}
+    changed_users = []
+    for user in data.get('group_users', []):
+        previous_user = previous_users.pop(user.get('id'), {})
+        changed_fields = {key: value for key, value in user.items()
+                          if key not in previous_user or previous_user.get(key) != value}
+        if len(changed_fields) > 0:
+            changed_fields['id'] = user.get('id')
+            changed_users.append(changed_fields)
+    if len(changed_users) > 0:
+        delta['group_users'] = changed_users
+    if len(previous_users) > 0:
+        delta['removed_users'] = list(previous_users)
+
+    return delta
+
+
+def get_production_power(last_readings, meter_id, position):
+    """ Get the power of the last reading of a group production meter.
+    :param dict last_readings: the last readings mapped to their meter ids
+    :param str meter_id: the production meter's id
+    :param str position: the production meter's position in the group,
+    'first' or 'second'
+    :returns: the power or 0.0 if there is no reading
+    :rtype: float
+    """
+
+    last_reading = last_readings.get(meter_id)
+    if len(last_reading) == 0:
+        logger.error(
+            'No readings for group %s production meter with id %s in the database.',
+            position, meter_id)
+        return 0.0
+
+    return last_reading.get('values').get('power')
 
 
 class WebsocketProvider:
@@ -56,36 +116,21 @@ class WebsocketProvider:
 
         self.redis_client = redis.Redis(
             host=redis_host, port=redis_port, db=redis_db)  # connect to server
-        self.cached_first_readings = {}
-
-    def get_first_reading(self, meter_id):
-        """ Return the first meter reading stored in the redis db.
-        :param str meter_id: the meter id for which to get the values
-        """
-        if meter_id in self.cached_first_readings:
-            return self.cached_first_readings[meter_id]
-
-        result = dict()
-        for key in get_sorted_keys(self.redis_client, meter_id):
-            data = self.redis_client.get(key)
-            if json.loads(data).get('type') == 'reading':
-                result = json.loads(data)
-                break
 
-        self.cached_first_readings[meter_id] = result
-        return result
-
-    def create_member_data(self, member):
+    def create_member_data(self, member, member_reading=None):
         """ Create a data package for a group member to include in a websocket
         data package.
         :param dict member: a group member's parameters
+        :param dict member_reading: the member's last reading if it has
+        already been fetched
         :return: a group member data package
         :rtype: dict
         """
 
         member_id = member.get('id')
         member_meter_id = member.get('meter_id')
-        member_reading = get_last_reading(self.redis_client, member_meter_id)
+        if member_reading is None:
+            member_reading = get_last_reading(self.redis_client, member_meter_id)
         if len(member_reading) == 0:
             logger.error(
                 'No readings for meter id %s in the database.', member_meter_id)
@@ -101,57 +146,48 @@ class WebsocketProvider:
                            power=member_power)
         return member_data
 
-    def create_data(self, user_id):
-        """ Create a data package with the latest available data.
-        :param int user_id: the user's id
+    def create_group_data(self, group_id):
+        """ Create a data package with the latest available data of a group,
+        which is the same for all of its members.
+        :param int group_id: the group's id
         :return: the group's overall consumption, the group's overall
         production and each group user's id, meter id, energy and power
         :rtype: dict
         """
 
         try:
-            group_production_meter_ids = get_group_production_meter_ids(
-                user_id)
+            group_production_meter_ids = get_production_meter_ids_of_group(
+                group_id)
             group_first_production_meter = group_production_meter_ids[0]
             group_second_production_meter = group_production_meter_ids[1]
+            group_members = get_members_of_group(group_id)
+
+            # Fetch the last readings of all members and production meters at once
+            last_readings = get_last_readings(
+                self.redis_client,
+                [meter_id for meter_id in group_production_meter_ids if meter_id is not None]
+                + [member.get('meter_id') for member in group_members])
 
             if group_first_production_meter is not None:
-                group_last_reading_first_production_meter = get_last_reading(
-                    self.redis_client, group_first_production_meter)
-                if len(group_last_reading_first_production_meter) == 0:
-                    logger.error(
-                        'No readings for group first production meter with id \
-                                %s in the database.',
-                        group_first_production_meter)
-                    group_production_first_meter = 0.0
-                else:
-                    group_production_first_meter = group_last_reading_first_production_meter.get(
-                        'values').get('power')
+                group_production_first_meter = get_production_power(
+                    last_readings, group_first_production_meter, 'first')
             else:
-                logger.error('No first production meter id for user id %s.',
-                             user_id)
+                logger.error('No first production meter id for group id %s.',
+                             group_id)
                 group_production_first_meter = 0.0
 
             if group_second_production_meter is not None:
-                group_last_reading_second_production_meter = get_last_reading(
-                    self.redis_client, group_second_production_meter)
-                if len(group_last_reading_second_production_meter) == 0:
-                    logger.error(
-                        'No readings for group second production meter with id \
-                                %s in the database.',
-                        group_second_production_meter)
-                    group_production_second_meter = 0.0
-                else:
-                    group_production_second_meter = group_last_reading_second_production_meter.get(
-                        'values').get('power')
+                group_production_second_meter = get_production_power(
+                    last_readings, group_second_production_meter, 'second')
             else:
-                logger.info('No second production meter id for user id %s.',
-                            user_id)
+                logger.info('No second production meter id for group id %s.',
+                            group_id)
                 group_production_second_meter = 0.0
 
             group_users = []
-            for member in get_group_members(user_id):
-                member_data = self.create_member_data(member)
+            for member in group_members:
+                member_data = self.create_member_data(
+                    member, last_readings.get(member.get('meter_id')))
                 group_users.append(member_data)
 
             group_production = group_production_first_meter + group_production_second_meter